@@ -0,0 +1,251 @@
+from datetime import datetime
+import numpy as np
+from django.db.models import F
+from django.utils import timezone
+from .rollups import HISTOGRAM_BIN_SECONDS, hourly_totals, session_queryset
+from .sketch import QuantileSketch
+
+DOW_LABELS = {1: 'Sun', 2: 'Mon', 3: 'Tue', 4: 'Wed', 5: 'Thu', 6: 'Fri', 7: 'Sat'}
+QUARTER_HOUR = 900   # every UTC offset in use is a multiple of 15 minutes
+PERCENTILES = (0.5, 0.9, 0.99)
+LOG_BIN_EPSILON = 1e-9   # keeps waits exactly on a log bin edge (log(243)/log(3) = 4.999...) in the upper bin
+
+
+def bin_edges(bin_idx, bin_size, log_base=None):
+    """
+    (start, end) seconds of a wait-time bin. Linear bins are bin_size wide; log bins are
+    [0, bin_size), then [bin_size * log_base**(i-1), bin_size * log_base**i).
+    """
+    if not log_base:
+        return bin_idx * bin_size, (bin_idx + 1) * bin_size
+    if bin_idx == 0:
+        return 0, bin_size
+    return bin_size * log_base ** (bin_idx - 1), bin_size * log_base ** bin_idx
+
+
+def bin_indices(waits, bin_size, log_base=None):
+    """The bin_edges() bin of each wait, as an int64 array."""
+    waits = np.asarray(waits, dtype=np.float64)
+    if not log_base:
+        return np.floor_divide(waits, bin_size).astype(np.int64)
+    indices = np.zeros(len(waits), dtype=np.int64)
+    longer = waits >= bin_size
+    ratio = np.log(waits[longer] / bin_size) / np.log(log_base)
+    indices[longer] = 1 + np.floor(ratio + LOG_BIN_EPSILON).astype(np.int64)
+    return indices
+
+
+def distribution(bins, counts, bin_size, log_base=None):
+    results = []
+    for bin_idx, count in zip(bins, counts):
+        start_sec, end_sec = (int(edge) for edge in bin_edges(bin_idx, bin_size, log_base))
+        results.append((f"{start_sec//60}-{end_sec//60} min", count))
+    return results
+
+
+def waits_distribution(waits, bin_size, log_base=None):
+    """Counts waits per bin with one bincount; only bins that have waits are listed."""
+    if not len(waits):
+        return []
+    counts = np.bincount(bin_indices(waits, bin_size, log_base))
+    bins = np.flatnonzero(counts)
+    return distribution(bins.tolist(), counts[bins].tolist(), bin_size, log_base)
+
+
+def _exact_quantiles(values, quantiles):
+    """Same ranks as QuantileSketch.quantile, read from the sorted values."""
+    values = np.sort(values)
+    n = len(values)
+    return [float(values[int(q * (n - 1))]) if n else None for q in quantiles]
+
+
+def _label(q):
+    return f"p{q * 100:g}"
+
+
+class DashboardAnalytics:
+    """
+    Every dashboard aggregate for one window, read from the database once.
+
+    With outliers included and no custom base_qs, the window is read from the hourly
+    rollups (plus raw rows for the partial hours at its ends), so the cost follows the
+    number of hours rather than sessions. Otherwise the window's (enter_timestamp, exit,
+    duration) columns are loaded once into NumPy arrays and the outlier bounds are
+    computed once. Either way each method gives the same result as the matching
+    get_*_custom function in dashboard.utils given the same base_qs, each of which
+    re-runs the outlier query on every call. Percentiles are exact from rows and come
+    from the rollups' quantile sketches (within 1%) otherwise.
+    Local hour and weekday are worked out once per distinct quarter hour rather than
+    per row, in the current timezone, to match TruncHour/ExtractHour/ExtractWeekDay.
+    """
+
+    def __init__(self, start_time, end_time, exclude_outliers=False, base_qs=None, simulated=None):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.exclude_outliers = exclude_outliers
+        self.from_rollups = False
+        use_rollups = base_qs is None and not exclude_outliers
+        if base_qs is None:
+            base_qs = session_queryset(simulated)
+        self.base_qs = base_qs
+        if not (use_rollups and self._load_rollups(hourly_totals(start_time, end_time, simulated))):
+            self._load_rows()
+
+    def _window(self):
+        return self.base_qs.filter(enter_timestamp__gte=self.start_time, enter_timestamp__lte=self.end_time)
+
+    def _load_rollups(self, hours):
+        tz = timezone.get_current_timezone()
+        if any(hour.astimezone(tz).minute for hour, _ in hours):
+            return False  # a half-hour offset splits each UTC hour across two local hours
+        self.from_rollups = True
+        self.arrival_counts = np.array([t['arrivals'] for _, t in hours], dtype=np.float64)
+        self.completed_counts = np.array([t['completed'] for _, t in hours], dtype=np.float64)
+        self.wait_sums = np.array([t['duration_sum'] for _, t in hours], dtype=np.float64)
+        self.wait_mins = np.array([np.nan if t['duration_min'] is None else t['duration_min'] for _, t in hours])
+        self.wait_maxs = np.array([np.nan if t['duration_max'] is None else t['duration_max'] for _, t in hours])
+        self.histograms = [t['histogram'] for _, t in hours]
+        self.sketches = [t['sketch'] for _, t in hours]
+        self._local_fields(np.array([hour.timestamp() for hour, _ in hours], dtype=np.float64))
+        return True
+
+    def _load_rows(self):
+        rows = list(self._window().values_list('id', 'enter_timestamp', 'exit_timestamp', 'duration_seconds'))
+        count = len(rows)
+        self.ids = np.fromiter((r[0] for r in rows), np.int64, count)
+        enter = np.fromiter((r[1].timestamp() for r in rows), np.float64, count)
+        self.exited = np.fromiter((r[2] is not None for r in rows), bool, count)
+        self.durations = np.fromiter((np.nan if r[3] is None else r[3] for r in rows), np.float64, count)
+        self._local_fields(enter)
+
+        # completed: the sessions wait-time figures are computed over
+        completed = self.exited & (self.durations > 1)
+        self.bounds = None
+        if self.exclude_outliers:
+            completed &= self.durations >= 2
+            values = np.sort(self.durations[completed])
+            n = len(values)
+            if n >= 4:
+                q1, q3 = float(values[n // 4]), float(values[(3 * n) // 4])
+                iqr = q3 - q1
+                self.bounds = (max(2.0, q1 - 1.5 * iqr), q3 + 1.5 * iqr)
+                completed &= (self.durations >= self.bounds[0]) & (self.durations <= self.bounds[1])
+            # with outliers excluded, the arrival charts only count sessions that pass the filter
+            arrivals = completed
+        else:
+            arrivals = np.ones(count, dtype=bool)
+        self.completed = completed
+        # per-row versions of the per-hour rollup columns, so both sources share the methods below
+        self.arrival_counts = arrivals.astype(np.float64)
+        self.completed_counts = completed.astype(np.float64)
+        self.wait_sums = np.where(completed, self.durations, 0.0)
+        self.wait_mins = self.wait_maxs = np.where(completed, self.durations, np.nan)
+
+    def _local_fields(self, enter):
+        tz = timezone.get_current_timezone()
+        quarters, inverse = np.unique(np.floor(enter / QUARTER_HOUR).astype(np.int64), return_inverse=True)
+        local = [datetime.fromtimestamp(int(q) * QUARTER_HOUR, tz) for q in quarters]
+        naive_hours = [t.replace(minute=0, second=0, microsecond=0, tzinfo=None) for t in local]
+        hour_index = {h: i for i, h in enumerate(sorted(set(naive_hours)))}
+        self.hour_starts = [timezone.make_aware(h, tz) for h in sorted(hour_index)]
+        self.hour_slot = np.array([hour_index[h] for h in naive_hours], dtype=np.int64)[inverse]
+        self.hour_of_day = np.array([t.hour for t in local], dtype=np.int64)[inverse]
+        self.weekday = np.array([t.isoweekday() % 7 + 1 for t in local], dtype=np.int64)[inverse]
+
+    def overview(self):
+        completed = self.completed_counts.sum()
+        return {
+            'total_arrivals': int(self.arrival_counts.sum()),
+            'avg_wait': float(self.wait_sums.sum() / completed) if completed else 0.0,
+            'max_wait': float(np.nanmax(self.wait_maxs)) if completed else 0.0,
+            'min_wait': float(np.nanmin(self.wait_mins)) if completed else 0.0,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+        }
+
+    def arrivals_by_hour(self):
+        counts = np.bincount(self.hour_slot, weights=self.arrival_counts, minlength=len(self.hour_starts))
+        return [{'h': self.hour_starts[i], 'count': int(c)} for i, c in enumerate(counts) if c]
+
+    def wait_time_distribution(self, bin_size=300, log_base=None):
+        if not self.from_rollups:
+            return waits_distribution(self.durations[self.completed], bin_size, log_base)
+        if bin_size % HISTOGRAM_BIN_SECONDS == 0 and (not log_base or float(log_base).is_integer()):
+            # every bin edge is a whole minute, so each histogram minute falls in exactly one bin
+            minutes = {}
+            for histogram in self.histograms:
+                for minute, count in histogram.items():
+                    minutes[int(minute)] = minutes.get(int(minute), 0) + count
+            if not minutes:
+                return []
+            keys = np.fromiter(minutes, np.int64, len(minutes))
+            counts = np.bincount(bin_indices(keys * HISTOGRAM_BIN_SECONDS, bin_size, log_base),
+                                 weights=np.fromiter(minutes.values(), np.float64, len(minutes)))
+            bins = np.flatnonzero(counts)
+            return distribution(bins.tolist(), [int(c) for c in counts[bins]], bin_size, log_base)
+        # the rollup histograms can't be split into bins narrower than theirs
+        waits = np.fromiter(
+            self._window().exclude(exit_timestamp__isnull=True).filter(duration_seconds__gt=1)
+            .values_list('duration_seconds', flat=True), np.float64
+        )
+        return waits_distribution(waits, bin_size, log_base)
+
+    def top_longest_waits(self, top_n=10):
+        if self.from_rollups:
+            return list(
+                self._window().exclude(exit_timestamp__isnull=True)
+                .order_by(F('duration_seconds').desc(nulls_last=True), 'id')[:top_n]
+            )
+        mask = self.completed if self.exclude_outliers else self.exited
+        durations = self.durations[mask]
+        ids = self.ids[mask]
+        # longest first, sessions without a duration last (as the database sorts NULLs)
+        order = np.lexsort((ids, -np.where(np.isnan(durations), -np.inf, durations)))
+        top = ids[order[:top_n]].tolist()
+        sessions = {s.pk: s for s in self.base_qs.filter(pk__in=top)}
+        return [sessions[pk] for pk in top]
+
+    def arrivals_by_day_of_week(self):
+        counts = np.bincount(self.weekday, weights=self.arrival_counts, minlength=8)
+        return [(DOW_LABELS[d], int(counts[d])) for d in range(1, 8) if counts[d]]
+
+    def time_of_day_pattern(self):
+        counts = np.bincount(self.hour_of_day, weights=self.arrival_counts, minlength=24)
+        return [(h, int(counts[h])) for h in range(24)]
+
+    def _average_wait_by(self, keys, size):
+        sums = np.bincount(keys, weights=self.wait_sums, minlength=size)
+        counts = np.bincount(keys, weights=self.completed_counts, minlength=size)
+        return sums, counts
+
+    def wait_distribution_by_dow(self):
+        sums, counts = self._average_wait_by(self.weekday, 8)
+        return [(DOW_LABELS[d], float(sums[d] / counts[d]) / 60.0) for d in range(1, 8) if counts[d]]
+
+    def wait_distribution_by_hour(self):
+        sums, counts = self._average_wait_by(self.hour_of_day, 24)
+        return [(h, float(sums[h] / counts[h]) / 60.0 if counts[h] else 0.0) for h in range(24)]
+
+    def wait_percentiles(self, quantiles=PERCENTILES):
+        """{'p50': seconds, ...} over the window's completed waits; 0.0 when there are none."""
+        if self.from_rollups:
+            sketch = QuantileSketch()
+            for counts in self.sketches:
+                sketch.merge(counts)
+            values = [sketch.quantile(q) for q in quantiles]
+        else:
+            values = _exact_quantiles(self.durations[self.completed], quantiles)
+        return {_label(q): value or 0.0 for q, value in zip(quantiles, values)}
+
+    def wait_percentiles_by_hour(self, quantiles=(0.5, 0.9)):
+        """[(hour of day, {'p50': minutes, ...})] for all 24 hours, like wait_distribution_by_hour."""
+        if self.from_rollups:
+            sketches = [QuantileSketch() for _ in range(24)]
+            for hour, counts in zip(self.hour_of_day.tolist(), self.sketches):
+                sketches[hour].merge(counts)
+            values = [[sketch.quantile(q) for q in quantiles] for sketch in sketches]
+        else:
+            hours = self.hour_of_day[self.completed]
+            waits = self.durations[self.completed]
+            values = [_exact_quantiles(waits[hours == h], quantiles) for h in range(24)]
+        return [(h, {_label(q): (v or 0.0) / 60.0 for q, v in zip(quantiles, values[h])}) for h in range(24)]
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class DashboardConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dashboard'
+
+    def ready(self):
+        # keeps HourlyRollup up to date as sessions are written
+        from . import rollups  # noqa: F401
+        # bumps the data version cached dashboard results are keyed on
+        from . import caching  # noqa: F401
@@ -0,0 +1,108 @@
+import functools
+import hashlib
+import inspect
+import time
+from datetime import timedelta
+from django.core.cache import caches
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from detection.models import PersonSession
+from detection.signals import sessions_written
+from .models import DataVersion
+
+# Dashboard results are cached under keys carrying a data version kept in the database, so
+# every web process (and the detection worker that writes sessions) agrees on it whatever
+# cache backend CACHES['dashboard'] points at. A write bumps the version and older entries
+# are simply never read again.
+CACHE_ALIAS = 'dashboard'
+# Windows that ended this long ago are settled: only writes to sessions that old change
+# them, which is rare, so their results are kept without a timeout.
+SETTLED_AFTER = timedelta(days=1)
+VERSION_ID = 1
+
+
+def _version_row():
+    # created on first use rather than by a migration; starting from the clock means a
+    # recreated row (a reset database) never reuses versions still sitting in the cache
+    start = time.time_ns() // 1000
+    return DataVersion.objects.get_or_create(pk=VERSION_ID, defaults={'live': start, 'history': start})[0]
+
+
+def data_version():
+    """(live, history) as of now: one small read."""
+    row = DataVersion.objects.filter(pk=VERSION_ID).values_list('live', 'history').first()
+    if row is None:
+        version = _version_row()
+        row = (version.live, version.history)
+    return row
+
+
+def bump(enter_timestamps=(), history=False):
+    """
+    Marks sessions entering at these times as written. history is bumped too when any of
+    them entered before the settled horizon (or when asked, after bulk changes).
+    """
+    if not history:
+        horizon = timezone.now() - SETTLED_AFTER
+        history = any(enter < horizon for enter in enter_timestamps)
+    changes = {'live': F('live') + 1}
+    if history:
+        changes['history'] = F('history') + 1
+    if not DataVersion.objects.filter(pk=VERSION_ID).update(**changes):
+        _version_row()
+
+
+def cached(name, start_time, end_time, compute, **params):
+    """
+    compute()'s result for [start_time, end_time] and params, from the cache when the data
+    it depends on hasn't changed since it was stored. Settled windows are keyed on the
+    history version and kept indefinitely; others on the live version with the cache's
+    default timeout.
+    """
+    live, history = data_version()
+    settled = end_time <= timezone.now() - SETTLED_AFTER
+    key = repr((name, start_time.timestamp(), end_time.timestamp(), sorted(params.items())))
+    key = f"{name}:{hashlib.sha1(key.encode()).hexdigest()}"
+    version = f"h{history}" if settled else f"l{live}"
+    cache = caches[CACHE_ALIAS]
+    result = cache.get(key, version=version)
+    if result is None:
+        result = compute()
+        if settled:
+            cache.set(key, result, timeout=None, version=version)
+        else:
+            cache.set(key, result, version=version)
+    return result
+
+
+def cached_window(func):
+    """
+    Caches a dashboard.utils function on its window, flags and other arguments. Calls with
+    a custom base_qs, or without an explicit window, aren't cacheable and run as before.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        start_time = params.pop('start_time', None) or params.pop('custom_start', None)
+        end_time = params.pop('end_time', None) or params.pop('custom_end', None)
+        if params.pop('base_qs', None) is not None or start_time is None or end_time is None:
+            return func(*args, **kwargs)
+        return cached(func.__name__, start_time, end_time, lambda: func(*args, **kwargs), **params)
+    return wrapper
+
+
+@receiver(sessions_written)
+def _sessions_written(sender, sessions, **kwargs):
+    bump(s.enter_timestamp for s in sessions)
+
+
+@receiver(post_save, sender=PersonSession)
+@receiver(post_delete, sender=PersonSession)
+def _session_changed(sender, instance, **kwargs):
+    bump([instance.enter_timestamp])
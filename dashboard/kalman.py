@@ -24,7 +24,7 @@ def predict_appointment_kalman(appt_datetime, weeks_lookback=8, exclude_outliers
         enter_timestamp__gte=start_lookback,
         enter_timestamp__lt=now,
         exit_timestamp__isnull=False
-    ).annotate(
+    ).defer('appearance_feature').annotate(
         dw=ExtractWeekDay('enter_timestamp'),
         hh=ExtractHour('enter_timestamp')
     ).filter(
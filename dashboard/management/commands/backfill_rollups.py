@@ -0,0 +1,33 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from dashboard.caching import bump
+from dashboard.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds the dashboard's hourly rollups from PersonSession rows. Run after changing "
+            "sessions with queryset update()/delete() or bulk_create, which don't update them; "
+            "also invalidates cached dashboard results.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Only rebuild the last N days (default: all of history).'
+        )
+
+    def handle(self, *args, **options):
+        start = None
+        if options['days'] is not None:
+            start = timezone.now() - timedelta(days=options['days'])
+        began = time.perf_counter()
+        with transaction.atomic():
+            written = rebuild(start=start)
+            bump(history=True)  # the sessions changed without signals, so cached results may be stale
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} hourly rollups in {time.perf_counter() - began:.2f}s."
+        ))
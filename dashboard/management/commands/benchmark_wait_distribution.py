@@ -0,0 +1,107 @@
+import time
+from datetime import timedelta
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from dashboard.utils import get_wait_time_distribution_custom
+from detection.models import PersonSession
+
+
+def python_loop(qs, bin_size):
+    """The previous implementation: bucket each duration in a Python dict."""
+    bins = {}
+    for d in qs.values_list('duration_seconds', flat=True):
+        idx = int(float(d or 0) // bin_size)
+        bins[idx] = bins.get(idx, 0) + 1
+    return sorted(bins.items())
+
+
+class Command(BaseCommand):
+    help = ("Times the wait-time histogram (Python loop, NumPy bincount and grouped SQL; linear and "
+            "log bins) on synthetic sessions. Everything runs in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            default='10000,1000000,10000000',
+            help='Comma-separated session counts to measure at (default: 10000,1000000,10000000).'
+        )
+        parser.add_argument(
+            '--bin-size',
+            type=int,
+            default=300,
+            help='Bin width in seconds, and the first log bin (default: 300).'
+        )
+        parser.add_argument(
+            '--log-base',
+            type=float,
+            default=2.0,
+            help='Growth factor of the log-scale bins (default: 2).'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Runs per query; the fastest is reported (default: 3).'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(n) for n in options['rows'].split(','))
+        except ValueError:
+            raise CommandError("--rows must be comma-separated integers")
+        bin_size, log_base = options['bin_size'], options['log_base']
+        end = timezone.now()
+        start = end - timedelta(days=7)
+        sessions = PersonSession.objects.filter(track_id__startswith='bench_').defer('appearance_feature')
+        window = sessions.filter(enter_timestamp__gte=start, enter_timestamp__lte=end) \
+                         .exclude(exit_timestamp__isnull=True).filter(duration_seconds__gt=1)
+        cases = [
+            ("python loop", lambda: python_loop(window, bin_size)),
+            ("numpy bincount", lambda: get_wait_time_distribution_custom(
+                start, end, bin_size, base_qs=sessions, method='numpy')),
+            ("sql group by", lambda: get_wait_time_distribution_custom(
+                start, end, bin_size, base_qs=sessions, method='sql')),
+            ("numpy bincount, log", lambda: get_wait_time_distribution_custom(
+                start, end, bin_size, base_qs=sessions, log_base=log_base, method='numpy')),
+            ("sql group by, log", lambda: get_wait_time_distribution_custom(
+                start, end, bin_size, base_qs=sessions, log_base=log_base, method='sql')),
+        ]
+
+        with transaction.atomic():
+            for size in sizes:
+                self._fill(start, size)
+                self.stdout.write(f"{size} sessions:")
+                results = {}
+                for name, run in cases:
+                    best = float('inf')
+                    for _ in range(max(1, options['repeat'])):
+                        t0 = time.perf_counter()
+                        results[name] = run()
+                        best = min(best, time.perf_counter() - t0)
+                    self.stdout.write(f"{name:>22}: {best * 1000:10.1f} ms")
+                if results["numpy bincount"] != results["sql group by"] or \
+                        results["numpy bincount, log"] != results["sql group by, log"]:
+                    raise CommandError("NumPy and SQL histograms disagree")
+            transaction.set_rollback(True)
+
+    def _fill(self, start, size, chunk=100000):
+        """Replaces the synthetic sessions with `size` new ones, inserted in arrival order as live data is."""
+        rng = np.random.default_rng(0)
+        offsets = np.sort(rng.uniform(0, 6 * 86400, size))
+        waits = rng.gamma(2.0, 600.0, size)
+        adapt = connection.ops.adapt_datetimefield_value
+        table = PersonSession._meta.db_table
+        sql = (f"INSERT INTO {table} (track_id, enter_timestamp, exit_timestamp, duration_seconds, active) "
+               "VALUES (%s, %s, %s, %s, %s)")
+        with connection.cursor() as cursor:
+            # raw SQL on both ends: a queryset delete() would send post_delete for every row
+            cursor.execute(f"DELETE FROM {table} WHERE track_id LIKE 'bench_%%'")
+            for first in range(0, size, chunk):
+                cursor.executemany(sql, [
+                    (f"bench_{first + i}", adapt(start + timedelta(seconds=offset)),
+                     adapt(start + timedelta(seconds=offset + wait)), wait, False)
+                    for i, (offset, wait) in enumerate(zip(offsets[first:first + chunk].tolist(),
+                                                           waits[first:first + chunk].tolist()))
+                ])
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:06
+
+from datetime import timezone as dt_timezone
+
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    # A frozen copy of dashboard.rollups.rebuild() as it stood for this schema, so later
+    # changes to that module can't change what this migration writes.
+    PersonSession = apps.get_model('detection', 'PersonSession')
+    HourlyRollup = apps.get_model('dashboard', 'HourlyRollup')
+    buckets = {}
+    rows = PersonSession.objects.order_by().values_list(
+        'enter_timestamp', 'track_id', 'exit_timestamp', 'duration_seconds')
+    for enter, track_id, exit_timestamp, duration in rows.iterator(chunk_size=2000):
+        hour = enter.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+        totals = buckets.setdefault((hour, track_id.startswith('sim_')), {
+            'arrivals': 0, 'completed': 0, 'duration_sum': 0.0,
+            'duration_min': None, 'duration_max': None, 'histogram': {},
+        })
+        totals['arrivals'] += 1
+        if exit_timestamp is None or duration is None or duration <= 1:
+            continue
+        totals['completed'] += 1
+        totals['duration_sum'] += duration
+        if totals['duration_min'] is None or duration < totals['duration_min']:
+            totals['duration_min'] = duration
+        if totals['duration_max'] is None or duration > totals['duration_max']:
+            totals['duration_max'] = duration
+        minute = str(int(duration // 60))
+        totals['histogram'][minute] = totals['histogram'].get(minute, 0) + 1
+    HourlyRollup.objects.all().delete()
+    HourlyRollup.objects.bulk_create(
+        [HourlyRollup(hour=hour, simulated=simulated, **totals)
+         for (hour, simulated), totals in sorted(buckets.items())],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('detection', '0006_alter_personsession_enter_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('simulated', models.BooleanField(default=False)),
+                ('arrivals', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('duration_sum', models.FloatField(default=0.0)),
+                ('duration_min', models.FloatField(blank=True, null=True)),
+                ('duration_max', models.FloatField(blank=True, null=True)),
+                ('histogram', models.JSONField(default=dict)),
+            ],
+            options={
+                'ordering': ['hour'],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'simulated'), name='unique_rollup_hour')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
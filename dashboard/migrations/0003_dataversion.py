@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0002_hourlyrollup_sketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('live', models.PositiveBigIntegerField(default=0)),
+                ('history', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,3 +1,41 @@
 from django.db import models
 
-# Create your models here.
+
+class HourlyRollup(models.Model):
+    """
+    Session totals for one UTC hour of arrivals, kept separately for simulated and real
+    sessions. completed and the duration fields cover sessions that have exited after more
+    than a second; histogram maps whole minutes of waiting to a count, and sketch holds
+    the same waits as a QuantileSketch for percentiles and outlier bounds.
+    """
+    hour = models.DateTimeField()
+    simulated = models.BooleanField(default=False)
+    arrivals = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    duration_sum = models.FloatField(default=0.0)
+    duration_min = models.FloatField(null=True, blank=True)
+    duration_max = models.FloatField(null=True, blank=True)
+    histogram = models.JSONField(default=dict)
+    sketch = models.JSONField(default=dict)
+
+    class Meta:
+        ordering = ['hour']
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'simulated'], name='unique_rollup_hour'),
+        ]
+
+    def __str__(self):
+        return f"HourlyRollup {self.hour} ({'simulated' if self.simulated else 'real'}): {self.arrivals} arrivals"
+
+
+class DataVersion(models.Model):
+    """
+    Counters bumped whenever PersonSession rows are written, which dashboard.caching folds
+    into its cache keys. live changes on every write; history only when a write touches a
+    session that entered long enough ago for finished windows to include it.
+    """
+    live = models.PositiveBigIntegerField(default=0)
+    history = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"DataVersion live={self.live} history={self.history}"
@@ -0,0 +1,195 @@
+"""
+Hourly session totals (HourlyRollup) that the dashboard reads for whole, finished hours.
+
+They are kept current by signals, on these write paths:
+
+- SessionWriter flushes send sessions_written, refreshing every hour the batch touched
+  with one read and one upsert.
+- A single PersonSession save() or delete() sends post_save/post_delete, which refreshes
+  that session's hour the same way: a read and an upsert per call, so loops of saves
+  should go through SessionWriter instead.
+
+Queryset update()/delete() and bulk_create/bulk_update outside SessionWriter (as in
+simulate_data) send no signal and leave the rollups, and the dashboard cache, stale. Run backfill_rollups after writing sessions that way: it
+rebuilds the rollups and bumps the cache version.
+"""
+from datetime import timedelta, timezone as dt_timezone
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from detection.models import PersonSession
+from detection.signals import sessions_written
+from .models import HourlyRollup
+from .sketch import QuantileSketch
+
+HOUR = timedelta(hours=1)
+HISTOGRAM_BIN_SECONDS = 60
+SIMULATED_PREFIX = 'sim_'
+ROLLUP_FIELDS = ['arrivals', 'completed', 'duration_sum', 'duration_min', 'duration_max', 'histogram', 'sketch']
+ROW_FIELDS = ('enter_timestamp', 'track_id', 'exit_timestamp', 'duration_seconds')
+
+
+def hour_floor(dt):
+    return dt.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def session_queryset(simulated=None):
+    """All sessions, or only the simulated (track_id sim_*) or real ones."""
+    qs = PersonSession.objects.defer('appearance_feature')
+    if simulated is True:
+        return qs.filter(track_id__startswith=SIMULATED_PREFIX)
+    if simulated is False:
+        return qs.exclude(track_id__startswith=SIMULATED_PREFIX)
+    return qs
+
+
+def empty_totals():
+    return {'arrivals': 0, 'completed': 0, 'duration_sum': 0.0,
+            'duration_min': None, 'duration_max': None, 'histogram': {}, 'sketch': {}}
+
+
+def merge(into, totals):
+    """Adds one set of hourly totals to another."""
+    into['arrivals'] += totals['arrivals']
+    into['completed'] += totals['completed']
+    into['duration_sum'] += totals['duration_sum']
+    for key, pick in (('duration_min', min), ('duration_max', max)):
+        if totals[key] is not None:
+            into[key] = totals[key] if into[key] is None else pick(into[key], totals[key])
+    for key in ('histogram', 'sketch'):
+        for bucket, count in totals[key].items():
+            into[key][bucket] = into[key].get(bucket, 0) + count
+    return into
+
+
+def summarise(rows):
+    """
+    (enter_timestamp, track_id, exit_timestamp, duration_seconds) rows ->
+    {(hour, simulated): totals}, with the same 'completed' rule as dashboard.utils
+    (exited, and waited more than a second).
+    """
+    buckets = {}
+    sketch = QuantileSketch()
+    for enter, track_id, exit_timestamp, duration in rows:
+        key = (hour_floor(enter), track_id.startswith(SIMULATED_PREFIX))
+        totals = buckets.get(key)
+        if totals is None:
+            totals = buckets[key] = empty_totals()
+        totals['arrivals'] += 1
+        if exit_timestamp is None or duration is None or duration <= 1:
+            continue
+        totals['completed'] += 1
+        totals['duration_sum'] += duration
+        if totals['duration_min'] is None or duration < totals['duration_min']:
+            totals['duration_min'] = duration
+        if totals['duration_max'] is None or duration > totals['duration_max']:
+            totals['duration_max'] = duration
+        minute = str(int(duration // HISTOGRAM_BIN_SECONDS))
+        totals['histogram'][minute] = totals['histogram'].get(minute, 0) + 1
+        bucket = str(sketch.key(duration))
+        totals['sketch'][bucket] = totals['sketch'].get(bucket, 0) + 1
+    return buckets
+
+
+def refresh_hours(hours, prune=False):
+    """
+    Recomputes the rollups for the given hours from their sessions: one read and one
+    upsert however many sessions changed. prune also removes rollups for hours that no
+    longer have any sessions, which only deletes can cause.
+    """
+    hours = sorted({hour_floor(h) for h in hours})
+    if not hours:
+        return
+    in_hours = Q()
+    for hour in hours:
+        in_hours |= Q(enter_timestamp__gte=hour, enter_timestamp__lt=hour + HOUR)
+    buckets = summarise(PersonSession.objects.filter(in_hours).values_list(*ROW_FIELDS))
+    if buckets:
+        HourlyRollup.objects.bulk_create(
+            [HourlyRollup(hour=hour, simulated=simulated, **totals) for (hour, simulated), totals in buckets.items()],
+            update_conflicts=True, unique_fields=['hour', 'simulated'], update_fields=ROLLUP_FIELDS,
+        )
+    if prune:
+        stale = HourlyRollup.objects.filter(hour__in=hours)
+        for hour, simulated in buckets:
+            stale = stale.exclude(hour=hour, simulated=simulated)
+        stale.delete()
+
+
+def rebuild(start=None, end=None, batch_size=500):
+    """
+    Replaces the rollups for every hour touching [start, end] (all of history by default)
+    with totals computed from the sessions. Returns the number of rollups written.
+    """
+    sessions = PersonSession.objects.all()
+    rollups = HourlyRollup.objects.all()
+    if start is not None:
+        start = hour_floor(start)
+        sessions = sessions.filter(enter_timestamp__gte=start)
+        rollups = rollups.filter(hour__gte=start)
+    if end is not None:
+        end = hour_floor(end) + HOUR
+        sessions = sessions.filter(enter_timestamp__lt=end)
+        rollups = rollups.filter(hour__lt=end)
+    buckets = summarise(sessions.order_by().values_list(*ROW_FIELDS).iterator(chunk_size=2000))
+    rollups.delete()
+    HourlyRollup.objects.bulk_create(
+        [HourlyRollup(hour=hour, simulated=simulated, **totals)
+         for (hour, simulated), totals in sorted(buckets.items())],
+        batch_size=batch_size,
+    )
+    return len(buckets)
+
+
+def _window_sources(start_time, end_time, simulated=None, now=None):
+    """
+    Splits [start_time, end_time] into the rollups for whole hours that have finished and
+    the sessions for the rest: the partial hours at either end and the hour in progress.
+    """
+    now = now or timezone.now()
+    first = hour_floor(start_time)
+    if first < start_time:
+        first += HOUR
+    last = min(hour_floor(end_time), hour_floor(now))
+    in_range = Q(enter_timestamp__gte=start_time, enter_timestamp__lte=end_time)
+    rollups = HourlyRollup.objects.none()
+    if first < last:
+        rollups = HourlyRollup.objects.filter(hour__gte=first, hour__lt=last)
+        if simulated is not None:
+            rollups = rollups.filter(simulated=simulated)
+        in_range &= Q(enter_timestamp__lt=first) | Q(enter_timestamp__gte=last)
+    return rollups, session_queryset(simulated).filter(in_range).values_list(*ROW_FIELDS)
+
+
+def hourly_totals(start_time, end_time, simulated=None, now=None):
+    """Totals per UTC hour for sessions entering in [start_time, end_time], oldest first, as [(hour, totals)]."""
+    rollups, rows = _window_sources(start_time, end_time, simulated, now)
+    hours = {}
+    for rollup in rollups.values('hour', *ROLLUP_FIELDS):
+        merge(hours.setdefault(rollup.pop('hour'), empty_totals()), rollup)
+    for (hour, _), totals in summarise(rows).items():
+        merge(hours.setdefault(hour, empty_totals()), totals)
+    return sorted(hours.items())
+
+
+def window_sketch(start_time, end_time, simulated=None, now=None):
+    """The merged QuantileSketch of completed waits for sessions entering in [start_time, end_time]."""
+    rollups, rows = _window_sources(start_time, end_time, simulated, now)
+    sketch = QuantileSketch()
+    for counts in rollups.values_list('sketch', flat=True):
+        sketch.merge(counts)
+    for totals in summarise(rows).values():
+        sketch.merge(totals['sketch'])
+    return sketch
+
+
+@receiver(sessions_written)
+def _sessions_written(sender, sessions, **kwargs):
+    refresh_hours(s.enter_timestamp for s in sessions)
+
+
+@receiver(post_save, sender=PersonSession)
+@receiver(post_delete, sender=PersonSession)
+def _session_changed(sender, instance, **kwargs):
+    refresh_hours([instance.enter_timestamp], prune=True)
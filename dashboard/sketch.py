@@ -0,0 +1,66 @@
+import math
+
+RELATIVE_ACCURACY = 0.01
+ORIGIN = 2.0    # bucket 0 starts at the shortest wait the outlier filter keeps, so that cut is exact
+
+
+class QuantileSketch:
+    """
+    Log-bucketed quantile sketch (as in DDSketch) for wait durations. A value x is counted
+    in bucket floor(log_gamma(x / ORIGIN)), and every bucket is reported as one value within
+    `relative_accuracy` of anything in it, so a quantile is off by at most 1% of itself.
+    Sketches merge by adding bucket counts: merging is exact and order independent, which is
+    what lets one hourly sketch per rollup stand in for all of a window's durations.
+    Stored as {str(bucket): count}, like the rollup histogram.
+    """
+
+    def __init__(self, counts=None, relative_accuracy=RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.counts = {}
+        if counts:
+            self.merge(counts)
+
+    def key(self, value):
+        return math.floor(math.log(value / ORIGIN) / self._log_gamma)
+
+    def value(self, key):
+        lower = ORIGIN * self.gamma ** key
+        return lower * 2 * self.gamma / (1 + self.gamma)
+
+    def add(self, value, count=1):
+        if value > 0:
+            key = self.key(value)
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def merge(self, other):
+        """Adds another sketch, or its stored {str(bucket): count} form."""
+        counts = other.counts if isinstance(other, QuantileSketch) else other
+        for key, count in counts.items():
+            key = int(key)
+            self.counts[key] = self.counts.get(key, 0) + count
+        return self
+
+    def to_json(self):
+        return {str(key): count for key, count in self.counts.items()}
+
+    def count(self, min_value=None):
+        if min_value is None:
+            return sum(self.counts.values())
+        lowest = self.key(min_value)
+        return sum(c for k, c in self.counts.items() if k >= lowest)
+
+    def value_at(self, rank, min_value=None):
+        """The rank-th smallest value (from 0), optionally among values >= min_value."""
+        lowest = None if min_value is None else self.key(min_value)
+        for key in sorted(self.counts):
+            if lowest is not None and key < lowest:
+                continue
+            rank -= self.counts[key]
+            if rank < 0:
+                return self.value(key)
+        return None
+
+    def quantile(self, q):
+        n = self.count()
+        return self.value_at(int(q * (n - 1))) if n else None
@@ -1,3 +1,6 @@
+import importlib
+import json
+from django.apps import apps as django_apps
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.utils import timezone
@@ -6,8 +9,21 @@ from datetime import timedelta
 from dashboard.kalman import predict_appointment_kalman, kalman_filter_update
 from dashboard.utils import (
     get_overview_data, _exclude_outliers_qs,
-    get_wait_time_distribution_custom
+    get_wait_time_distribution_custom, get_top_longest_waits_custom,
+    get_arrivals_by_hour_custom, get_arrivals_by_day_of_week_custom, get_time_of_day_pattern_custom,
+    get_wait_distribution_by_dow_custom, get_wait_distribution_by_hour_custom,
 )
+from dashboard.analytics import DashboardAnalytics
+from dashboard import caching, rollups
+from dashboard.models import HourlyRollup
+from dashboard.sketch import QuantileSketch
+import random
+from io import StringIO
+from django.core.management import call_command
+from django.db.models import Max
+from detection.sessions import SessionWriter
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from detection.models import PersonSession
 from queuing.models import NotificationRequest, Feedback
@@ -37,6 +53,11 @@ class DashboardSimpleTests(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertIn("active_sessions", res.json())
 
+    def test_dashboard_shows_wait_percentiles(self):
+        res = self.client.get(reverse("dashboard_home"), {"exclude_outliers": "0"})
+        self.assertEqual(set(res.context["wait_percentiles"]), {"p50", "p90", "p99"})
+        self.assertEqual(len(json.loads(res.context["hod_p90_values_json"])), 24)
+
     def test_export_csv_header_line(self):
         res = self.client.get(reverse("dashboard_export_csv"))
         self.assertEqual(res.status_code, 200)
@@ -125,3 +146,339 @@ class DashboardUtilsTests(TestCase):
             now - timedelta(days=1), now, bin_size=300
         )
         self.assertIsInstance(result, list)
+
+    def test_analytics_never_load_appearance_features(self):
+        now = timezone.now()
+        with CaptureQueriesContext(connection) as ctx:
+            get_wait_time_distribution_custom(now - timedelta(days=1), now)
+            top = get_top_longest_waits_custom(now - timedelta(days=1), now)
+        self.assertEqual(len(top), 10)
+        self.assertFalse(any('appearance_feature' in q['sql'] for q in ctx.captured_queries))
+
+
+class DashboardAnalyticsTests(TestCase):
+    def setUp(self):
+        self.end = timezone.now()
+        self.start = self.end - timedelta(days=7)
+        for i in range(80):
+            enter = self.end - timedelta(minutes=97 * i + 13)
+            if i % 15 == 0:
+                wait = 5000 + i * 100.5     # outliers
+            elif i % 11 == 0:
+                wait = 1.5                  # too short to count once outliers are excluded
+            else:
+                wait = 200 + (i * 37.3) % 900
+            active = i % 9 == 0
+            PersonSession.objects.create(
+                track_id=f"t_{i}",
+                enter_timestamp=enter,
+                exit_timestamp=None if active else enter + timedelta(seconds=wait),
+                duration_seconds=None if active else wait,
+                active=active,
+            )
+        for i in range(12):
+            enter = self.end - timedelta(minutes=331 * i + 5)
+            PersonSession.objects.create(track_id=f"sim_{i}", enter_timestamp=enter,
+                                         exit_timestamp=enter + timedelta(seconds=90 * i + 30),
+                                         duration_seconds=90 * i + 30, active=False)
+
+    def assertSeriesAlmostEqual(self, first, second):
+        self.assertEqual([label for label, _ in first], [label for label, _ in second])
+        for (_, a), (_, b) in zip(first, second):
+            self.assertAlmostEqual(a, b, places=9)
+
+    def check_matches_utils(self, exclude_outliers, simulated=None):
+        start, end = self.start, self.end
+        # a base_qs keeps dashboard.utils on its original SQL, whatever DashboardAnalytics reads from
+        raw = PersonSession.objects.defer('appearance_feature')
+        if simulated is not None:
+            raw = raw.filter(track_id__startswith='sim_') if simulated else raw.exclude(track_id__startswith='sim_')
+        analytics = DashboardAnalytics(start, end, exclude_outliers=exclude_outliers, simulated=simulated)
+        overview = get_overview_data(exclude_outliers=exclude_outliers, base_qs=raw, custom_start=start, custom_end=end)
+        ours = analytics.overview()
+        self.assertEqual(ours['total_arrivals'], overview['total_arrivals'])
+        for key in ('avg_wait', 'max_wait', 'min_wait'):
+            self.assertAlmostEqual(ours[key], overview[key], places=9)
+        self.assertEqual(analytics.arrivals_by_hour(), get_arrivals_by_hour_custom(start, end, exclude_outliers, raw))
+        for bin_size, log_base in ((300, None), (45, None), (60, 2), (45, 1.5)):
+            ours = analytics.wait_time_distribution(bin_size, log_base)
+            for method in ('sql', 'numpy'):
+                self.assertEqual(ours, get_wait_time_distribution_custom(
+                    start, end, bin_size, exclude_outliers, raw, log_base=log_base, method=method))
+        self.assertEqual([s.pk for s in analytics.top_longest_waits(10)],
+                         [s.pk for s in get_top_longest_waits_custom(start, end, 10, raw, exclude_outliers)])
+        self.assertEqual(analytics.arrivals_by_day_of_week(),
+                         get_arrivals_by_day_of_week_custom(start, end, exclude_outliers, raw))
+        self.assertEqual(analytics.time_of_day_pattern(),
+                         get_time_of_day_pattern_custom(start, end, exclude_outliers, raw))
+        self.assertSeriesAlmostEqual(analytics.wait_distribution_by_dow(),
+                                     get_wait_distribution_by_dow_custom(start, end, exclude_outliers, raw))
+        self.assertSeriesAlmostEqual(analytics.wait_distribution_by_hour(),
+                                     get_wait_distribution_by_hour_custom(start, end, exclude_outliers, raw))
+        return analytics
+
+    def test_matches_utils_with_outliers_excluded(self):
+        self.check_matches_utils(True)
+
+    def test_matches_utils_with_outliers_included(self):
+        self.assertTrue(self.check_matches_utils(False).from_rollups)
+        self.check_matches_utils(False, simulated=True)
+        self.check_matches_utils(False, simulated=False)
+
+    def test_matches_utils_in_other_timezones(self):
+        with timezone.override('America/New_York'):
+            self.assertTrue(self.check_matches_utils(False).from_rollups)
+        with timezone.override('Asia/Kolkata'):
+            self.check_matches_utils(True)
+            # UTC hours straddle two Kolkata hours, so the rollups can't be used
+            self.assertFalse(self.check_matches_utils(False).from_rollups)
+
+    def test_log_bins_count_waits_on_an_edge_in_the_upper_bin(self):
+        start = self.end + timedelta(hours=1)
+        for k, wait in enumerate([59.5, 60, 179.9, 180, 60 * 3 ** 5, 60 * 3 ** 6 - 1]):
+            enter = start + timedelta(minutes=k)
+            PersonSession.objects.create(track_id=f"edge_{k}", enter_timestamp=enter,
+                                         exit_timestamp=enter + timedelta(seconds=wait), duration_seconds=wait, active=False)
+        raw = PersonSession.objects.defer('appearance_feature')
+        expected = [('0-1 min', 1), ('1-3 min', 2), ('3-9 min', 1), ('243-729 min', 2)]
+        for method in ('sql', 'numpy'):
+            self.assertEqual(get_wait_time_distribution_custom(
+                start, start + timedelta(hours=1), 60, base_qs=raw, log_base=3, method=method), expected)
+
+    def test_sketched_outlier_bounds_match_sorted_ones(self):
+        raw = PersonSession.objects.defer('appearance_feature')
+        sketched = get_overview_data(exclude_outliers=True, custom_start=self.start, custom_end=self.end)
+        exact = get_overview_data(exclude_outliers=True, base_qs=raw, custom_start=self.start, custom_end=self.end)
+        self.assertEqual(sketched['total_arrivals'], exact['total_arrivals'])
+        self.assertAlmostEqual(sketched['avg_wait'], exact['avg_wait'], places=9)
+        self.assertEqual(get_time_of_day_pattern_custom(self.start, self.end, True),
+                         get_time_of_day_pattern_custom(self.start, self.end, True, raw))
+
+    def test_sketched_percentiles_are_within_one_percent(self):
+        raw = PersonSession.objects.defer('appearance_feature')
+        sketched = DashboardAnalytics(self.start, self.end)
+        exact = DashboardAnalytics(self.start, self.end, base_qs=raw)
+        self.assertTrue(sketched.from_rollups)
+        self.assertFalse(exact.from_rollups)
+        self.assertEqual(list(sketched.wait_percentiles()), ['p50', 'p90', 'p99'])
+        for key, value in exact.wait_percentiles().items():
+            self.assertAlmostEqual(sketched.wait_percentiles()[key], value, delta=value * 0.01)
+        for (h, ours), (_, theirs) in zip(sketched.wait_percentiles_by_hour(), exact.wait_percentiles_by_hour()):
+            for key in ('p50', 'p90'):
+                self.assertAlmostEqual(ours[key], theirs[key], delta=theirs[key] * 0.01 + 1e-9)
+
+    def test_single_query_for_the_window(self):
+        with CaptureQueriesContext(connection) as ctx:
+            analytics = DashboardAnalytics(self.start, self.end, exclude_outliers=True)
+            analytics.overview()
+            analytics.arrivals_by_hour()
+            analytics.wait_time_distribution()
+            analytics.wait_distribution_by_hour()
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_empty_window(self):
+        analytics = DashboardAnalytics(self.end + timedelta(days=1), self.end + timedelta(days=2), exclude_outliers=True)
+        self.assertEqual(analytics.overview()['total_arrivals'], 0)
+        self.assertEqual(analytics.arrivals_by_hour(), [])
+        self.assertEqual(analytics.wait_time_distribution(), [])
+        self.assertEqual(analytics.top_longest_waits(), [])
+        self.assertEqual(analytics.time_of_day_pattern(), [(h, 0) for h in range(24)])
+
+
+class HourlyRollupTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.hour = rollups.hour_floor(self.now) - timedelta(hours=3)
+
+    def session(self, track_id, minutes, wait=None):
+        enter = self.hour + timedelta(minutes=minutes)
+        return PersonSession.objects.create(
+            track_id=track_id, enter_timestamp=enter,
+            exit_timestamp=None if wait is None else enter + timedelta(seconds=wait),
+            duration_seconds=wait, active=wait is None,
+        )
+
+    def rollup_values(self):
+        return list(HourlyRollup.objects.order_by('hour', 'simulated').values('hour', 'simulated', *rollups.ROLLUP_FIELDS))
+
+    def test_saves_update_the_hour(self):
+        self.session('1', 5, 130.0)
+        self.session('2', 50, 0.5)
+        active = self.session('3', 59)
+        self.session('sim_1', 10, 400.0)
+        real = HourlyRollup.objects.get(hour=self.hour, simulated=False)
+        self.assertEqual((real.arrivals, real.completed), (3, 1))
+        self.assertEqual((real.duration_sum, real.duration_min, real.duration_max), (130.0, 130.0, 130.0))
+        self.assertEqual(real.histogram, {'2': 1})
+        self.assertEqual(HourlyRollup.objects.get(hour=self.hour, simulated=True).histogram, {'6': 1})
+
+        active.exit_timestamp = active.enter_timestamp + timedelta(seconds=600)
+        active.save()
+        real.refresh_from_db()
+        self.assertEqual((real.completed, real.duration_max), (2, 600.0))
+        active.delete()
+        real.refresh_from_db()
+        self.assertEqual(real.arrivals, 2)
+        PersonSession.objects.filter(track_id='sim_1').get().delete()
+        self.assertFalse(HourlyRollup.objects.filter(simulated=True).exists())
+
+    def test_session_writer_flush_updates_rollups(self):
+        writer = SessionWriter(PersonSession)
+        old = self.session('1', 5)
+        session = PersonSession(track_id='2', enter_timestamp=self.now)
+        writer.create(session)
+        writer.update(old, exit_timestamp=old.enter_timestamp + timedelta(seconds=90), duration_seconds=90.0, active=False)
+        writer.flush()
+        self.assertEqual(HourlyRollup.objects.get(hour=self.hour).completed, 1)
+        self.assertEqual(HourlyRollup.objects.get(hour=rollups.hour_floor(self.now)).arrivals, 1)
+
+    def test_backfill_matches_incremental_rollups(self):
+        for i in range(30):
+            self.session(f"{'sim_' if i % 4 == 0 else ''}{i}", i * 17, None if i % 7 == 0 else 20.0 + i * 61)
+        incremental = self.rollup_values()
+        HourlyRollup.objects.all().delete()
+        call_command('backfill_rollups', stdout=StringIO())
+        self.assertEqual(self.rollup_values(), incremental)
+        PersonSession.objects.filter(track_id='3').update(duration_seconds=5000.0)  # sends no signal
+        call_command('backfill_rollups', days=1, stdout=StringIO())
+        self.assertEqual(HourlyRollup.objects.filter(simulated=False).aggregate(m=Max('duration_max'))['m'], 5000.0)
+
+    def test_migration_backfills_match_incremental_rollups(self):
+        for i in range(30):
+            self.session(f"{'sim_' if i % 4 == 0 else ''}{i}", i * 17, None if i % 7 == 0 else 1.5 + i * 61)
+        incremental = self.rollup_values()
+        HourlyRollup.objects.all().delete()
+        importlib.import_module('dashboard.migrations.0001_initial').backfill(django_apps, None)
+        importlib.import_module('dashboard.migrations.0002_hourlyrollup_sketch').backfill(django_apps, None)
+        self.assertEqual(self.rollup_values(), incremental)
+
+    def test_totals_read_rollups_for_whole_hours_and_rows_for_the_rest(self):
+        self.session('1', 5, 130.0)
+        recent = PersonSession.objects.create(track_id='2', enter_timestamp=self.now, active=True)
+        # changed behind the rollups' back: only whole, finished hours should come from them
+        HourlyRollup.objects.filter(hour=self.hour).update(arrivals=7)
+        start = self.hour - timedelta(minutes=30)
+        with CaptureQueriesContext(connection) as ctx:
+            totals = dict(rollups.hourly_totals(start, self.now + timedelta(hours=1)))
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual(totals[self.hour]['arrivals'], 7)
+        self.assertEqual(totals[rollups.hour_floor(recent.enter_timestamp)]['arrivals'], 1)
+        # a window starting inside the hour counts that hour from its rows
+        partial = dict(rollups.hourly_totals(self.hour + timedelta(minutes=1), self.now))
+        self.assertEqual(partial[self.hour]['arrivals'], 1)
+
+
+class AnalyticsCacheTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.end = self.now
+        self.start = self.end - timedelta(days=1)
+
+    def session(self, track_id, enter, wait=300.0):
+        return PersonSession.objects.create(
+            track_id=track_id, enter_timestamp=enter, exit_timestamp=enter + timedelta(seconds=wait),
+            duration_seconds=wait, active=False,
+        )
+
+    def test_repeat_calls_are_served_from_the_cache(self):
+        self.session('1', self.now - timedelta(hours=2))
+        first = get_overview_data(custom_start=self.start, custom_end=self.end)
+        with self.assertNumQueries(1):  # the data version
+            self.assertEqual(get_overview_data(custom_start=self.start, custom_end=self.end), first)
+        # a different flag is a different entry
+        excluded = get_overview_data(exclude_outliers=True, custom_start=self.start, custom_end=self.end)
+        self.assertEqual(excluded['total_arrivals'], 1)
+
+    def test_writes_invalidate_live_windows(self):
+        self.session('1', self.now - timedelta(hours=2))
+        self.assertEqual(get_overview_data(custom_start=self.start, custom_end=self.end)['total_arrivals'], 1)
+        session = self.session('2', self.now - timedelta(hours=1))
+        self.assertEqual(get_overview_data(custom_start=self.start, custom_end=self.end)['total_arrivals'], 2)
+        session.delete()
+        self.assertEqual(get_overview_data(custom_start=self.start, custom_end=self.end)['total_arrivals'], 1)
+
+        writer = SessionWriter(PersonSession)
+        writer.create(PersonSession(track_id='3', enter_timestamp=self.now))
+        writer.flush()
+        self.assertEqual(get_overview_data(custom_start=self.start, custom_end=self.end)['total_arrivals'], 2)
+
+    def test_settled_windows_only_change_with_old_sessions(self):
+        start, end = self.now - timedelta(days=10), self.now - timedelta(days=3)
+        self.session('1', self.now - timedelta(days=5))
+        first = get_arrivals_by_hour_custom(start, end)
+        live, history = caching.data_version()
+        self.session('2', self.now)
+        self.assertEqual(caching.data_version(), (live + 1, history))
+        with self.assertNumQueries(1):
+            self.assertEqual(get_arrivals_by_hour_custom(start, end), first)
+
+        self.session('3', self.now - timedelta(days=4))
+        self.assertEqual(caching.data_version(), (live + 2, history + 1))
+        self.assertEqual(sum(row['count'] for row in get_arrivals_by_hour_custom(start, end)), 2)
+
+    def test_custom_base_qs_is_not_cached(self):
+        self.session('1', self.now - timedelta(hours=2))
+        base_qs = PersonSession.objects.all()
+        get_top_longest_waits_custom(self.start, self.end, base_qs=base_qs)
+        PersonSession.objects.update(duration_seconds=900.0)  # sends no signal
+        top = get_top_longest_waits_custom(self.start, self.end, base_qs=base_qs)
+        self.assertEqual(top[0].duration_seconds, 900.0)
+
+    def test_backfill_rollups_invalidates_the_cache(self):
+        start, end = self.now - timedelta(days=10), self.now - timedelta(days=3)
+        self.session('1', self.now - timedelta(days=5))
+        self.assertEqual(get_overview_data(custom_start=start, custom_end=end)['max_wait'], 300.0)
+        PersonSession.objects.update(duration_seconds=900.0)  # sends no signal
+        call_command('backfill_rollups', stdout=StringIO())
+        self.assertEqual(get_overview_data(custom_start=start, custom_end=end)['max_wait'], 900.0)
+
+    def test_dashboard_and_csv_share_cached_results(self):
+        User.objects.create_user(username="staffer", password="pw", is_staff=True)
+        self.client.login(username="staffer", password="pw")
+        self.session('1', self.now - timedelta(hours=2))
+        # an explicit range: the default one moves on with the clock every minute
+        params = {"exclude_outliers": "0", "start": (self.now - timedelta(days=1)).strftime('%d/%m/%Y %H:%M'),
+                  "end": (self.now + timedelta(hours=1)).strftime('%d/%m/%Y %H:%M')}
+        self.assertEqual(self.client.get(reverse("dashboard_home"), params).context["total_arrivals"], 1)
+        with CaptureQueriesContext(connection) as ctx:
+            csv_text = self.client.get(reverse("dashboard_export_csv"), params).content.decode()
+        self.assertIn("Total Arrivals,1", csv_text)
+        self.assertFalse(any('dashboard_hourlyrollup' in q['sql'] for q in ctx.captured_queries))
+        self.session('2', self.now - timedelta(hours=1))
+        self.assertEqual(self.client.get(reverse("dashboard_home"), params).context["total_arrivals"], 2)
+
+
+class QuantileSketchTests(TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.values = [rng.lognormvariate(6, 1) for _ in range(5000)] + [1.5, 1.99, 2.0, 2.01]
+
+    def sketch(self, values):
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def test_quantiles_within_relative_accuracy(self):
+        sketch = self.sketch(self.values)
+        ordered = sorted(self.values)
+        for q in (0.01, 0.25, 0.5, 0.75, 0.9, 0.99):
+            exact = ordered[int(q * (len(ordered) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), exact * 0.01 + 1e-9)
+
+    def test_merging_is_exact_and_order_independent(self):
+        whole = self.sketch(self.values)
+        parts = [self.sketch(self.values[i::7]) for i in range(7)]
+        forward, backward = QuantileSketch(), QuantileSketch()
+        for part in parts:
+            forward.merge(part)
+        for part in reversed(parts):
+            backward.merge(part.to_json())
+        self.assertEqual(forward.counts, whole.counts)
+        self.assertEqual(backward.counts, whole.counts)
+
+    def test_shortest_kept_wait_starts_a_bucket(self):
+        sketch = self.sketch(self.values)
+        self.assertEqual(sketch.count(2), sum(v >= 2 for v in self.values))
+        self.assertGreaterEqual(sketch.value_at(0, 2), 2)
+        self.assertIsNone(QuantileSketch().quantile(0.5))
@@ -1,33 +1,60 @@
+import math
 from datetime import timedelta
-from django.db.models import Avg, Max, Min, Count, FloatField
-from django.db.models.functions import TruncHour, ExtractWeekDay, ExtractHour, Cast
+import numpy as np
+from django.db.models import Avg, Max, Min, Count, FloatField, IntegerField, F, Value, Case, When
+from django.db.models.functions import TruncHour, ExtractWeekDay, ExtractHour, Cast, Floor, Ln
 from django.utils import timezone
 from detection.models import PersonSession
+from .analytics import DashboardAnalytics, LOG_BIN_EPSILON, distribution, waits_distribution
+from .caching import cached_window
+from .rollups import window_sketch
 
-def _exclude_outliers_qs(qs, field='duration_seconds', min_value=2):
+# Without a custom base_qs, the aggregates below are answered from the hourly rollups (see
+# dashboard.rollups) when outliers are included; raw rows are only read for partial hours.
+# When outliers are excluded, the bounds come from the rollups' merged quantile sketches.
+# Those calls are also cached per window and flags until sessions change (dashboard.caching).
+
+def _exclude_outliers_qs(qs, field='duration_seconds', min_value=2, sketch=None):
     qs = qs.filter(**{f'{field}__gte': min_value})
-    values = sorted(float(v) for v in qs.values_list(field, flat=True))
-    n = len(values)
-    if n < 4:
-        return qs
-    Q1 = values[n // 4]
-    Q3 = values[(3 * n) // 4]
+    if sketch is not None:
+        # quartiles read from a QuantileSketch of the same durations (within 1%) instead of sorting them
+        n = sketch.count(min_value)
+        if n < 4:
+            return qs
+        Q1 = sketch.value_at(n // 4, min_value)
+        Q3 = sketch.value_at((3 * n) // 4, min_value)
+    else:
+        values = sorted(float(v) for v in qs.values_list(field, flat=True))
+        n = len(values)
+        if n < 4:
+            return qs
+        Q1 = values[n // 4]
+        Q3 = values[(3 * n) // 4]
     IQR = Q3 - Q1
     lower = max(float(min_value), Q1 - 1.5 * IQR)
     upper = Q3 + 1.5 * IQR
     return qs.filter(**{f'{field}__gte': lower, f'{field}__lte': upper})
 
+def _outlier_sketch(start_time, end_time, exclude_outliers, base_qs):
+    if exclude_outliers and base_qs is None:
+        return window_sketch(start_time, end_time)
+    return None
+
+@cached_window
 def get_overview_data(exclude_outliers=False, base_qs=None, custom_start=None, custom_end=None):
-    if base_qs is None:
-        base_qs = PersonSession.objects.all()
     if not custom_end:
         custom_end = timezone.now()
     if not custom_start:
         custom_start = custom_end - timedelta(days=7)
+    if base_qs is None and not exclude_outliers:
+        return DashboardAnalytics(custom_start, custom_end).overview()
+    sketch = _outlier_sketch(custom_start, custom_end, exclude_outliers, base_qs)
+    if base_qs is None:
+        base_qs = PersonSession.objects.defer('appearance_feature')
     qs = base_qs.filter(enter_timestamp__gte=custom_start, enter_timestamp__lte=custom_end)
     if exclude_outliers:
         filtered = qs.exclude(exit_timestamp__isnull=True).filter(duration_seconds__gt=1)
-        filtered = _exclude_outliers_qs(filtered, 'duration_seconds')
+        filtered = _exclude_outliers_qs(filtered, 'duration_seconds', sketch=sketch)
         total_arrivals = filtered.count()
         agg = filtered.annotate(duration_f=Cast('duration_seconds', FloatField())).aggregate(
             avg_wait=Avg('duration_f'),
@@ -51,60 +78,83 @@ def get_overview_data(exclude_outliers=False, base_qs=None, custom_start=None, c
         'end_time': custom_end,
     }
 
+@cached_window
 def get_arrivals_by_hour_custom(start_time, end_time, exclude_outliers=False, base_qs=None):
+    if base_qs is None and not exclude_outliers:
+        return DashboardAnalytics(start_time, end_time).arrivals_by_hour()
+    sketch = _outlier_sketch(start_time, end_time, exclude_outliers, base_qs)
     if base_qs is None:
-        base_qs = PersonSession.objects.all()
+        base_qs = PersonSession.objects.defer('appearance_feature')
     qs = base_qs.filter(enter_timestamp__gte=start_time, enter_timestamp__lte=end_time)
     if exclude_outliers:
         qs = qs.exclude(exit_timestamp__isnull=True).filter(duration_seconds__gt=1)
-        qs = _exclude_outliers_qs(qs, 'duration_seconds')
+        qs = _exclude_outliers_qs(qs, 'duration_seconds', sketch=sketch)
     qs = qs.annotate(h=TruncHour('enter_timestamp')).values('h').annotate(count=Count('id')).order_by('h')
     return list(qs)
 
+def _bin_expression(bin_size, log_base=None):
+    """SQL for the analytics.bin_edges() bin of duration_seconds."""
+    ratio = F('duration_seconds') / Value(float(bin_size))
+    if not log_base:
+        # durations here are positive, so truncating is flooring, and a cast is native SQL everywhere
+        return Cast(ratio, IntegerField())
+    return Case(
+        When(duration_seconds__lt=bin_size, then=Value(0.0)),
+        default=Value(1.0) + Floor(Ln(ratio) / Value(math.log(log_base)) + Value(LOG_BIN_EPSILON)),
+        output_field=FloatField(),
+    )
+
+@cached_window
 def get_wait_time_distribution_custom(start_time, end_time, bin_size=300,
-                                      exclude_outliers=False, base_qs=None):
+                                      exclude_outliers=False, base_qs=None,
+                                      log_base=None, method='sql'):
+    """
+    Completed waits per bin: bin_size-second bins, or log-scale ones (see analytics.bin_edges)
+    when log_base is given. method='sql' counts with one grouped query; 'numpy' streams the
+    durations and counts them with one bincount, which can be quicker where SQL math is slow.
+    """
+    if base_qs is None and not exclude_outliers:
+        return DashboardAnalytics(start_time, end_time).wait_time_distribution(bin_size, log_base)
+    sketch = _outlier_sketch(start_time, end_time, exclude_outliers, base_qs)
     if base_qs is None:
-        base_qs = PersonSession.objects.all()
+        base_qs = PersonSession.objects.defer('appearance_feature')
     qs = base_qs.filter(enter_timestamp__gte=start_time, enter_timestamp__lte=end_time) \
                 .exclude(exit_timestamp__isnull=True).filter(duration_seconds__gt=1)
     if exclude_outliers:
-        qs = _exclude_outliers_qs(qs, 'duration_seconds')
-    if not qs.exists():
-        return []
-    bins = {}
-    for s in qs:
-        w = float(s.duration_seconds or 0)
-        idx = int(w // bin_size)
-        bins[idx] = bins.get(idx, 0) + 1
-    sorted_bins = sorted(bins.items(), key=lambda x: x[0])
-    results = []
-    for bin_idx, count in sorted_bins:
-        start_sec = bin_idx * bin_size
-        end_sec = (bin_idx + 1) * bin_size
-        label = f"{start_sec//60}-{end_sec//60} min"
-        results.append((label, count))
-    return results
+        qs = _exclude_outliers_qs(qs, 'duration_seconds', sketch=sketch)
+    if method == 'numpy':
+        waits = np.fromiter(qs.values_list('duration_seconds', flat=True), np.float64)
+        return waits_distribution(waits, bin_size, log_base)
+    rows = qs.annotate(bin=_bin_expression(bin_size, log_base)).values('bin') \
+             .annotate(count=Count('id')).order_by('bin')
+    return distribution([int(r['bin']) for r in rows], [r['count'] for r in rows], bin_size, log_base)
 
+@cached_window
 def get_top_longest_waits_custom(start_time, end_time, top_n=10,
                                  base_qs=None, exclude_outliers=False):
+    sketch = _outlier_sketch(start_time, end_time, exclude_outliers, base_qs)
     if base_qs is None:
-        base_qs = PersonSession.objects.all()
+        base_qs = PersonSession.objects.defer('appearance_feature')
     qs = base_qs.filter(enter_timestamp__gte=start_time, enter_timestamp__lte=end_time) \
                 .exclude(exit_timestamp__isnull=True).order_by('-duration_seconds')
     if exclude_outliers:
         qs = qs.filter(duration_seconds__gt=1)
-        qs = _exclude_outliers_qs(qs, 'duration_seconds')
+        qs = _exclude_outliers_qs(qs, 'duration_seconds', sketch=sketch)
     return list(qs[:top_n])
 
+@cached_window
 def get_arrivals_by_day_of_week_custom(start_time, end_time,
                                        exclude_outliers=False,
                                        base_qs=None):
+    if base_qs is None and not exclude_outliers:
+        return DashboardAnalytics(start_time, end_time).arrivals_by_day_of_week()
+    sketch = _outlier_sketch(start_time, end_time, exclude_outliers, base_qs)
     if base_qs is None:
-        base_qs = PersonSession.objects.all()
+        base_qs = PersonSession.objects.defer('appearance_feature')
     qs = base_qs.filter(enter_timestamp__gte=start_time, enter_timestamp__lte=end_time)
     if exclude_outliers:
         qs = qs.exclude(exit_timestamp__isnull=True).filter(duration_seconds__gt=1)
-        qs = _exclude_outliers_qs(qs, 'duration_seconds')
+        qs = _exclude_outliers_qs(qs, 'duration_seconds', sketch=sketch)
     qs = qs.annotate(dw=ExtractWeekDay('enter_timestamp')).values('dw').annotate(count=Count('id')).order_by('dw')
     dow_map = {1:'Sun', 2:'Mon', 3:'Tue', 4:'Wed', 5:'Thu', 6:'Fri', 7:'Sat'}
     results = []
@@ -114,15 +164,19 @@ def get_arrivals_by_day_of_week_custom(start_time, end_time,
         results.append((label, row['count']))
     return results
 
+@cached_window
 def get_time_of_day_pattern_custom(start_time, end_time,
                                    exclude_outliers=False,
                                    base_qs=None):
+    if base_qs is None and not exclude_outliers:
+        return DashboardAnalytics(start_time, end_time).time_of_day_pattern()
+    sketch = _outlier_sketch(start_time, end_time, exclude_outliers, base_qs)
     if base_qs is None:
-        base_qs = PersonSession.objects.all()
+        base_qs = PersonSession.objects.defer('appearance_feature')
     qs = base_qs.filter(enter_timestamp__gte=start_time, enter_timestamp__lte=end_time)
     if exclude_outliers:
         qs = qs.exclude(exit_timestamp__isnull=True).filter(duration_seconds__gt=1)
-        qs = _exclude_outliers_qs(qs, 'duration_seconds')
+        qs = _exclude_outliers_qs(qs, 'duration_seconds', sketch=sketch)
     qs = qs.annotate(hh=ExtractHour('enter_timestamp')).values('hh').annotate(count=Count('id')).order_by('hh')
     hour_dict = {i:0 for i in range(24)}
     for row in qs:
@@ -130,15 +184,19 @@ def get_time_of_day_pattern_custom(start_time, end_time,
         hour_dict[h] += row['count']
     return [(h, hour_dict[h]) for h in range(24)]
 
+@cached_window
 def get_wait_distribution_by_dow_custom(start_time, end_time,
                                         exclude_outliers=False,
                                         base_qs=None):
+    if base_qs is None and not exclude_outliers:
+        return DashboardAnalytics(start_time, end_time).wait_distribution_by_dow()
+    sketch = _outlier_sketch(start_time, end_time, exclude_outliers, base_qs)
     if base_qs is None:
-        base_qs = PersonSession.objects.all()
+        base_qs = PersonSession.objects.defer('appearance_feature')
     qs = base_qs.filter(enter_timestamp__gte=start_time, enter_timestamp__lte=end_time) \
                 .exclude(exit_timestamp__isnull=True).filter(duration_seconds__gt=1)
     if exclude_outliers:
-        qs = _exclude_outliers_qs(qs, 'duration_seconds')
+        qs = _exclude_outliers_qs(qs, 'duration_seconds', sketch=sketch)
     agg_qs = qs.annotate(dw=ExtractWeekDay('enter_timestamp')) \
                .values('dw').annotate(avg_wait=Avg('duration_seconds')) \
                .order_by('dw')
@@ -151,15 +209,19 @@ def get_wait_distribution_by_dow_custom(start_time, end_time,
         results.append((label, secs/60.0))
     return results
 
+@cached_window
 def get_wait_distribution_by_hour_custom(start_time, end_time,
                                          exclude_outliers=False,
                                          base_qs=None):
+    if base_qs is None and not exclude_outliers:
+        return DashboardAnalytics(start_time, end_time).wait_distribution_by_hour()
+    sketch = _outlier_sketch(start_time, end_time, exclude_outliers, base_qs)
     if base_qs is None:
-        base_qs = PersonSession.objects.all()
+        base_qs = PersonSession.objects.defer('appearance_feature')
     qs = base_qs.filter(enter_timestamp__gte=start_time, enter_timestamp__lte=end_time) \
                 .exclude(exit_timestamp__isnull=True).filter(duration_seconds__gt=1)
     if exclude_outliers:
-        qs = _exclude_outliers_qs(qs, 'duration_seconds')
+        qs = _exclude_outliers_qs(qs, 'duration_seconds', sketch=sketch)
     agg_qs = qs.annotate(hh=ExtractHour('enter_timestamp')) \
                .values('hh').annotate(avg_wait=Avg('duration_seconds')) \
                .order_by('hh')
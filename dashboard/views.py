@@ -9,16 +9,8 @@ from detection.models import PersonSession
 from detection.detection_module import generate_video_stream
 from django.contrib.admin.views.decorators import staff_member_required
 
-from .utils import (
-    get_overview_data,
-    get_arrivals_by_hour_custom,
-    get_wait_time_distribution_custom,
-    get_top_longest_waits_custom,
-    get_arrivals_by_day_of_week_custom,
-    get_time_of_day_pattern_custom,
-    get_wait_distribution_by_dow_custom,
-    get_wait_distribution_by_hour_custom,
-)
+from .analytics import DashboardAnalytics
+from .caching import cached
 from .kalman import predict_appointment_kalman
 
 def parse_uk_datetime(dt_string):
@@ -29,6 +21,30 @@ def parse_uk_datetime(dt_string):
     except ValueError:
         return None
 
+def default_window():
+    """The last 7 days, ending on the next whole minute so repeat requests share cached results."""
+    end_time = timezone.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+    return end_time - timedelta(days=7), end_time
+
+def analytics_results(start_time, end_time, exclude_outliers, simulated):
+    """Every DashboardAnalytics result the page and CSV export use, cached until sessions change."""
+    def compute():
+        # one read (from the hourly rollups when outliers are included) for every chart
+        analytics = DashboardAnalytics(start_time, end_time, exclude_outliers=exclude_outliers, simulated=simulated)
+        return {
+            'overview': analytics.overview(),
+            'arrivals_by_hour': analytics.arrivals_by_hour(),
+            'wait_time_distribution': analytics.wait_time_distribution(bin_size=300),
+            'top_longest_waits': analytics.top_longest_waits(top_n=10),
+            'arrivals_by_day_of_week': analytics.arrivals_by_day_of_week(),
+            'time_of_day_pattern': analytics.time_of_day_pattern(),
+            'wait_distribution_by_dow': analytics.wait_distribution_by_dow(),
+            'wait_distribution_by_hour': analytics.wait_distribution_by_hour(),
+            'wait_percentiles': analytics.wait_percentiles(),
+            'wait_percentiles_by_hour': analytics.wait_percentiles_by_hour(),
+        }
+    return cached('dashboard', start_time, end_time, compute, exclude_outliers=exclude_outliers, simulated=simulated)
+
 @staff_member_required(login_url='login')
 def dashboard_all_in_one(request):
     #Outliers
@@ -50,33 +66,25 @@ def dashboard_all_in_one(request):
         start_time, end_time = st, et
         is_custom_range = True
     else:
-        end_time = timezone.now()
-        start_time = end_time - timedelta(days=7)
+        start_time, end_time = default_window()
 
     #base queryset
     if show_simulated:
-        base_qs = PersonSession.objects.filter(track_id__startswith='sim_')
+        base_qs = PersonSession.objects.filter(track_id__startswith='sim_').defer('appearance_feature')
         current_data_text = "Currently displaying simulated data."
     else:
-        base_qs = PersonSession.objects.exclude(track_id__startswith='sim_')
+        base_qs = PersonSession.objects.exclude(track_id__startswith='sim_').defer('appearance_feature')
         current_data_text = "Currently displaying real data."
 
-    overview = get_overview_data(
-        exclude_outliers=exclude_outliers,
-        base_qs=base_qs,
-        custom_start=start_time,
-        custom_end=end_time
-    )
+    analytics = analytics_results(start_time, end_time, exclude_outliers, show_simulated)
+
+    overview = analytics['overview']
     total_arrivals = overview['total_arrivals']
     avg_wait_min = round(overview['avg_wait']/60,2)
     max_wait_min = round(overview['max_wait']/60,2)
     min_wait_min = round(overview['min_wait']/60,2)
 
-    hour_qs = get_arrivals_by_hour_custom(
-        start_time, end_time,
-        exclude_outliers=exclude_outliers,
-        base_qs=base_qs
-    )
+    hour_qs = analytics['arrivals_by_hour']
     hour_labels, hour_counts = [], []
     for row in hour_qs:
         dt = row['h']
@@ -84,62 +92,43 @@ def dashboard_all_in_one(request):
         hour_labels.append(label_str)
         hour_counts.append(row['count'])
 
-    dist_data = get_wait_time_distribution_custom(
-        start_time, end_time, bin_size=300,
-        exclude_outliers=exclude_outliers,
-        base_qs=base_qs
-    )
+    dist_data = analytics['wait_time_distribution']
     dist_labels, dist_counts = [], []
     for lbl, cnt in dist_data:
         dist_labels.append(lbl)
         dist_counts.append(cnt)
 
-    top_sessions = get_top_longest_waits_custom(
-        start_time, end_time, top_n=10,
-        base_qs=base_qs,
-        exclude_outliers=exclude_outliers
-    )
+    top_sessions = analytics['top_longest_waits']
 
-    dow_data = get_arrivals_by_day_of_week_custom(
-        start_time, end_time,
-        exclude_outliers=exclude_outliers,
-        base_qs=base_qs
-    )
+    dow_data = analytics['arrivals_by_day_of_week']
     if dow_data:
         dow_labels, dow_counts_ = zip(*dow_data)
     else:
         dow_labels, dow_counts_ = [], []
 
-    tod_data = get_time_of_day_pattern_custom(
-        start_time, end_time,
-        exclude_outliers=exclude_outliers,
-        base_qs=base_qs
-    )
+    tod_data = analytics['time_of_day_pattern']
     tod_labels, tod_counts = [], []
     for hh, c in tod_data:
         tod_labels.append(str(hh))
         tod_counts.append(c)
 
-    dow_wait_data = get_wait_distribution_by_dow_custom(
-        start_time, end_time,
-        exclude_outliers=exclude_outliers,
-        base_qs=base_qs
-    )
+    dow_wait_data = analytics['wait_distribution_by_dow']
     dow_wait_labels, dow_wait_values = [], []
     for label, avg_mins in dow_wait_data:
         dow_wait_labels.append(label)
         dow_wait_values.append(round(avg_mins,2))
 
-    hod_wait_data = get_wait_distribution_by_hour_custom(
-        start_time, end_time,
-        exclude_outliers=exclude_outliers,
-        base_qs=base_qs
-    )
+    hod_wait_data = analytics['wait_distribution_by_hour']
     hod_wait_labels, hod_wait_values = [], []
     for hh, avg_mins in hod_wait_data:
         hod_wait_labels.append(str(hh))
         hod_wait_values.append(round(avg_mins,2))
 
+    percentiles = {k: round(v/60,2) for k, v in analytics['wait_percentiles'].items()}
+    hod_pct_data = analytics['wait_percentiles_by_hour']
+    hod_p50_values = [round(p['p50'],2) for _, p in hod_pct_data]
+    hod_p90_values = [round(p['p90'],2) for _, p in hod_pct_data]
+
     predict_predicted_minutes = None
     predict_error_message = None
     predict_date = ""
@@ -202,6 +191,9 @@ def dashboard_all_in_one(request):
         'dow_wait_values_json': json.dumps(dow_wait_values),
         'hod_wait_labels_json': json.dumps(hod_wait_labels),
         'hod_wait_values_json': json.dumps(hod_wait_values),
+        'wait_percentiles': percentiles,
+        'hod_p50_values_json': json.dumps(hod_p50_values),
+        'hod_p90_values_json': json.dumps(hod_p90_values),
         'predict_predicted_minutes': predict_predicted_minutes,
         'predict_error_message': predict_error_message,
         'predict_date': predict_date,
@@ -219,7 +211,7 @@ def active_sessions_api(request):
     exclude_flag = request.GET.get('exclude_outliers', '1')
     exclude_outliers = (exclude_flag == '1')
 
-    active_sessions = PersonSession.objects.filter(exit_timestamp__isnull=True)
+    active_sessions = PersonSession.objects.filter(exit_timestamp__isnull=True).defer('appearance_feature')
     data = []
     for s in active_sessions:
         final_est = predict_appointment_kalman(s.enter_timestamp, 8)
@@ -266,45 +258,16 @@ def export_dashboard_csv(request):
         if st and et and st < et:
             start_time, end_time = st, et
         else:
-            end_time = timezone.now()
-            start_time = end_time - timedelta(days=7)
+            start_time, end_time = default_window()
     else:
-        end_time = timezone.now()
-        start_time = end_time - timedelta(days=7)
-
-    if show_simulated:
-        base_qs = PersonSession.objects.filter(track_id__startswith='sim_')
-    else:
-        base_qs = PersonSession.objects.exclude(track_id__startswith='sim_')
-
-    from .utils import (
-        get_overview_data,
-        get_arrivals_by_hour_custom,
-        get_wait_time_distribution_custom,
-        get_top_longest_waits_custom
-    )
+        start_time, end_time = default_window()
 
-    overview = get_overview_data(
-        exclude_outliers=exclude_outliers,
-        base_qs=base_qs,
-        custom_start=start_time,
-        custom_end=end_time
-    )
-    arrivals_hourly = get_arrivals_by_hour_custom(
-        start_time, end_time,
-        exclude_outliers=exclude_outliers,
-        base_qs=base_qs
-    )
-    wait_dist = get_wait_time_distribution_custom(
-        start_time, end_time, 300,
-        exclude_outliers=exclude_outliers,
-        base_qs=base_qs
-    )
-    top_sessions = get_top_longest_waits_custom(
-        start_time, end_time, 10,
-        base_qs=base_qs,
-        exclude_outliers=exclude_outliers
-    )
+    # the same cached results as the dashboard page for this range and flags
+    analytics = analytics_results(start_time, end_time, exclude_outliers, show_simulated)
+    overview = analytics['overview']
+    arrivals_hourly = analytics['arrivals_by_hour']
+    wait_dist = analytics['wait_time_distribution']
+    top_sessions = analytics['top_longest_waits']
 
     response = HttpResponse(content_type='text/csv')
     filename = "dashboard_data.csv"
@@ -322,6 +285,8 @@ def export_dashboard_csv(request):
     writer.writerow(["Avg Wait (sec)", overview['avg_wait']])
     writer.writerow(["Max Wait (sec)", overview['max_wait']])
     writer.writerow(["Min Wait (sec)", overview['min_wait']])
+    for label, value in analytics['wait_percentiles'].items():
+        writer.writerow([f"{label.upper()} Wait (sec)", value])
     writer.writerow([])
     writer.writerow(["ARRIVALS BY HOUR"])
     writer.writerow(["Hour", "Count"])
@@ -8,10 +8,14 @@ class DetectionConfig(AppConfig):
     detection_thread = None
 
     def ready(self):
+        # Detection normally runs in its own process (manage.py detection_worker)
+        from django.conf import settings
+        if not getattr(settings, 'DETECTION_IN_PROCESS', False):
+            return
         #Avoids multi-runs
         if os.environ.get('RUN_MAIN', None) != 'true':
             return
-            
+
         from .detection_module import detection_loop
         if self.detection_thread is None or not self.detection_thread.is_alive():
             self.detection_thread = threading.Thread(target=detection_loop, daemon=True)
@@ -0,0 +1,79 @@
+import os
+import shutil
+
+MODEL_DIR = os.path.dirname(__file__)
+MODEL_SIZES = ('n', 's', 'm', 'l', 'x')
+BACKENDS = ('torch', 'onnx', 'openvino')
+PRECISIONS = ('fp32', 'fp16', 'int8')
+
+
+def check_options(size, backend, precision, imgsz):
+    if size not in MODEL_SIZES:
+        raise ValueError(f"Unknown model size {size!r}, expected one of {', '.join(MODEL_SIZES)}")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {', '.join(PRECISIONS)}")
+    if backend == 'torch' and precision == 'int8':
+        raise ValueError("The torch backend has no int8 mode; export to onnx or openvino instead")
+    if imgsz % 32:
+        raise ValueError(f"Input size must be a multiple of 32, got {imgsz}")
+
+
+def weights_path(size):
+    return os.path.join(MODEL_DIR, f"yolov8{size}.pt")
+
+
+def exported_path(size, backend, precision, imgsz):
+    stem = f"yolov8{size}_{imgsz}_{precision}"
+    if backend == 'onnx':
+        return os.path.join(MODEL_DIR, f"{stem}.onnx")
+    if backend == 'openvino':
+        return os.path.join(MODEL_DIR, f"{stem}_openvino_model")
+    return weights_path(size)
+
+
+def export_model(size='x', backend='onnx', precision='fp32', imgsz=640):
+    """
+    Exports the person detector for a CPU backend and returns the path to load.
+    Exports are cached next to the weights, so this is a no-op after the first call.
+
+    ONNX is exported in FP32 and then converted: INT8 by onnxruntime dynamic quantization
+    (no calibration data needed), FP16 with onnxruntime's float16 converter. OpenVINO precision is
+    handled by the ultralytics exporter.
+    """
+    check_options(size, backend, precision, imgsz)
+    target = exported_path(size, backend, precision, imgsz)
+    if backend == 'torch' or os.path.exists(target):
+        return target
+
+    from ultralytics import YOLO
+    model = YOLO(weights_path(size))
+    if backend == 'openvino':
+        out = model.export(format='openvino', imgsz=imgsz, half=precision == 'fp16', int8=precision == 'int8')
+        shutil.move(str(out), target)
+        return target
+
+    out = str(model.export(format='onnx', imgsz=imgsz))
+    if precision == 'fp32':
+        os.replace(out, target)
+    elif precision == 'int8':
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(out, target, weight_type=QuantType.QUInt8)
+        os.remove(out)
+    else:
+        import onnx
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+        # keep fp32 inputs/outputs so pre/post-processing is unchanged
+        onnx.save(convert_float_to_float16(onnx.load(out), keep_io_types=True), target)
+        os.remove(out)
+    return target
+
+
+def load_model(size='x', backend='torch', precision='fp32', imgsz=640):
+    from ultralytics import YOLO
+    model = YOLO(export_model(size, backend, precision, imgsz), task='detect')
+    if backend == 'torch':
+        import torch
+        model.to(torch.device("cuda" if torch.cuda.is_available() else "cpu"))
+    return model
@@ -0,0 +1,113 @@
+import threading
+from collections import namedtuple
+
+FramePacket = namedtuple('FramePacket', ['timestamp', 'frame', 'annotated', 'track_list', 'jpeg'], defaults=(None,))
+
+
+class FrameRing:
+    """
+    Fixed-size ring of published items with one writer and any number of readers.
+    The writer never waits for readers: a reader that falls more than `capacity`
+    items behind skips ahead to the oldest item still held and counts the rest as dropped.
+    """
+
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._seq = 0
+        self._subscribers = 0
+        self._viewers = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def seq(self):
+        return self._seq
+
+    @property
+    def subscriber_count(self):
+        return self._subscribers
+
+    @property
+    def viewer_count(self):
+        """Subscribers that display frames, so the publisher knows whether to annotate."""
+        return self._viewers
+
+    def publish(self, item):
+        with self._cond:
+            self._seq += 1
+            self._slots[self._seq % self.capacity] = item
+            self._cond.notify_all()
+            return self._seq
+
+    def close(self):
+        """Marks the end of the stream; subscribers drain what is left and then get None."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def subscribe(self, latest_only=False, viewer=False):
+        with self._cond:
+            self._subscribers += 1
+            self._viewers += viewer
+            self._cond.notify_all()
+            return Subscription(self, self._seq + 1, latest_only, viewer)
+
+    def wait_for_subscribers(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: self._subscribers > 0 or self.closed, timeout)
+
+    def _unsubscribe(self, viewer=False):
+        with self._cond:
+            self._subscribers -= 1
+            self._viewers -= viewer
+
+
+class Subscription:
+    def __init__(self, ring, next_seq, latest_only, viewer=False):
+        self.ring = ring
+        self.next_seq = next_seq
+        self.latest_only = latest_only
+        self.viewer = viewer
+        self.dropped = 0
+        self.closed = False
+
+    def get(self, timeout=None):
+        """
+        Returns the next item, or None if nothing was published within `timeout` seconds
+        or the ring has been closed and drained. With latest_only, everything but the
+        newest item is skipped.
+        """
+        ring = self.ring
+        with ring._cond:
+            if not ring._cond.wait_for(lambda: ring._seq >= self.next_seq or ring.closed, timeout):
+                return None
+            if ring._seq < self.next_seq:
+                return None
+            oldest = max(1, ring._seq - ring.capacity + 1)
+            target = ring._seq if self.latest_only else max(self.next_seq, oldest)
+            self.dropped += target - self.next_seq
+            self.next_seq = target + 1
+            return ring._slots[target % ring.capacity]
+
+    def qsize(self):
+        """Published items this subscriber hasn't read yet (at most the ring capacity)."""
+        return max(0, min(self.ring.capacity, self.ring._seq - self.next_seq + 1))
+
+    def set_viewer(self, viewer):
+        """For relays to other processes: count as a viewer only while someone there is watching."""
+        with self.ring._cond:
+            if not self.closed:
+                self.ring._viewers += viewer - self.viewer
+            self.viewer = viewer
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.ring._unsubscribe(self.viewer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
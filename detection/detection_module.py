@@ -1,36 +1,89 @@
+import threading
 import time
-import os
 import numpy as np
 import cv2
-import mss
-import torch
 from datetime import datetime
 from django.utils import timezone
-from ultralytics import YOLO
+from .tracking import TrackingEngine, assign, iou_matrix
+from .broadcast import FramePacket, FrameRing
+from .sources import open_source
+from .backends import load_model
+from .motion import MotionGate
+from .scheduler import FrameScheduler
+from .pipeline import Pipeline, Stage
+from .reid import ReIDGallery
+from .metrics import metrics
+from .identity import TrackIdentityManager
 
 DETECTION_ZONES = None
-REFRESH_INTERVAL = 0
+TARGET_FPS = 5.0                # steady-state frame rate for the detection producer
+MAX_FPS = 15.0                  # burst rate while the number of people in view is changing
+CPU_BUDGET = 0.5                # max share of wall-clock time spent processing frames
+FRAME_SOURCE = 'screen'         # see sources.source_factory for accepted specs
+FRAME_SOURCE_REALTIME = True    # False replays file sources as fast as inference allows
+FRAME_BUFFER_SIZE = 8           # frames held for subscribers before slow ones start dropping
+MOTION_GATING = True            # skip inference on frames where nothing moved
+MOTION_MAX_SKIP_SECONDS = 2.0   # infer at least this often even when the scene looks static
 CONFIDENCE_THRESHOLD = 0.35
 TRACKER_CONFIG = 'bytetrack.yaml'
 REID_MAX_SECONDS_AWAY = 300    # how far back to search for a returning person (seconds)
 REID_SIMILARITY_THRESHOLD = 0.75  # minimum HSV histogram correlation to accept a re-ID match
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "yolov8x.pt")
-model = YOLO(MODEL_PATH)
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
-_contiguous_id_map = {}
-_next_contiguous_id = 1
-
-def get_contiguous_id(raw_id):
-    global _next_contiguous_id
-    if raw_id not in _contiguous_id_map:
-        _contiguous_id_map[raw_id] = str(_next_contiguous_id)
-        _next_contiguous_id += 1
-    return _contiguous_id_map[raw_id]
+MODEL_SIZE = 'x'                # yolov8 n/s/m/l/x - smaller is much faster on CPU
+MODEL_BACKEND = 'torch'         # torch, onnx or openvino (see backends.py)
+MODEL_PRECISION = 'fp32'        # fp32, fp16 or int8 (int8 needs onnx/openvino)
+INPUT_SIZE = 640                # inference resolution, multiple of 32
+TRACK_ID_HORIZON_SECONDS = 600  # a track ID unseen for this long is released for reuse
+_model = None
+_engine = None
+_model_lock = threading.Lock()
+_track_ids = TrackIdentityManager(TRACK_ID_HORIZON_SECONDS)
+_frame_producer = None
+_frame_producer_lock = threading.Lock()
+_session_registry = None
+_session_stage = None
+
+def get_model():
+    """
+    Loads the YOLO model for the configured size/backend/precision on first use.
+    torch and ultralytics are only imported here, so Django startup, management
+    commands and tests that never run inference don't pay for them.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model(MODEL_SIZE, MODEL_BACKEND, MODEL_PRECISION, INPUT_SIZE)
+    return _model
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        model = get_model()
+        with _model_lock:
+            if _engine is None:
+                _engine = TrackingEngine(
+                    model, TRACKER_CONFIG, CONFIDENCE_THRESHOLD, imgsz=INPUT_SIZE,
+                    half=(MODEL_BACKEND == 'torch' and MODEL_PRECISION == 'fp16'),
+                    dynamic_imgsz=(MODEL_BACKEND == 'torch')
+                )
+    return _engine
+
+def model_loaded():
+    return _model is not None
+
+def reset_track_ids():
+    """Fresh tracker state and track IDs numbered from 1, so replays are repeatable."""
+    _track_ids.horizon = TRACK_ID_HORIZON_SECONDS
+    _track_ids.reset()
+    if _engine is not None:
+        _engine.reset()
 
 def capture_screen(sct, monitor, target_width=640):
-    screenshot = sct.grab(monitor)
-    img = np.array(screenshot)
+    img = np.asarray(sct.grab(monitor))  # BGRA view over mss's buffer, no copy
+    h, w = img.shape[:2]
+    if target_width and w > target_width:
+        # shrink while still BGRA so the colour conversion only touches the small image
+        img = cv2.resize(img, (target_width, max(1, round(h * target_width / float(w)))), interpolation=cv2.INTER_AREA)
     return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
 
 def extract_appearance_feature(frame, bbox):
@@ -47,46 +100,99 @@ def find_matching_session(frame, bbox, PersonSession):
     """
     Compare the current detection's appearance against recently exited sessions.
     Returns the best-matching PersonSession if correlation exceeds REID_SIMILARITY_THRESHOLD,
-    otherwise returns None.
+    otherwise returns None. The SessionRegistry keeps a long-lived gallery instead of
+    calling this once per new track.
     """
     new_feature = extract_appearance_feature(frame, bbox)
     if new_feature is None:
         return None
-    new_hist = np.array(new_feature, dtype=np.float32)
-    cutoff = timezone.now() - timezone.timedelta(seconds=REID_MAX_SECONDS_AWAY)
-    recent_exits = PersonSession.objects.filter(
-        exit_timestamp__gte=cutoff,
-        appearance_feature__isnull=False
-    ).order_by('-exit_timestamp')
-    best_match = None
-    best_score = REID_SIMILARITY_THRESHOLD
-    for session in recent_exits:
-        stored = session.appearance_feature
-        if not stored:
-            continue
-        stored_hist = np.array(stored, dtype=np.float32)
-        if stored_hist.shape != new_hist.shape:
-            continue
-        score = cv2.compareHist(new_hist, stored_hist, cv2.HISTCMP_CORREL)
-        if score > best_score:
-            best_score = score
-            best_match = session
-    return best_match
-
-def compute_iou(boxA, boxB):
-    xA = max(boxA[0], boxB[0])
-    yA = max(boxA[1], boxB[1])
-    xB = min(boxA[2], boxB[2])
-    yB = min(boxA[3], boxB[3])
-    interW = max(0, xB - xA)
-    interH = max(0, yB - yA)
-    interArea = interW * interH
-    areaA = (boxA[2]-boxA[0]) * (boxA[3]-boxA[1])
-    areaB = (boxB[2]-boxB[0]) * (boxB[3]-boxB[1])
-    return interArea / float(areaA + areaB - interArea + 1e-6)
-
-def detect_and_track(frame, iou_thresh=0.3):
-    total_start = time.time()
+    gallery = ReIDGallery(REID_MAX_SECONDS_AWAY, REID_SIMILARITY_THRESHOLD).load(PersonSession)
+    return gallery.match([new_feature])[0]
+
+def zone_rects(frame_shape, zones):
+    """
+    Scales DETECTION_ZONES squares (drawn on an origWidth x origHeight picture of the stream)
+    to pixel rectangles in a frame of `frame_shape`. Returns None when no usable zone is set.
+    """
+    if not zones or not zones.get("squares"):
+        return None
+    h, w = frame_shape[:2]
+    sx = w / float(zones["origWidth"])
+    sy = h / float(zones["origHeight"])
+    rects = []
+    for square in zones["squares"]:
+        x1, y1, x2, y2 = square["coords"]
+        x1, x2 = sorted((min(max(int(x1 * sx), 0), w), min(max(int(round(x2 * sx)), 0), w)))
+        y1, y2 = sorted((min(max(int(y1 * sy), 0), h), min(max(int(round(y2 * sy)), 0), h)))
+        if x2 > x1 and y2 > y1:
+            rects.append((x1, y1, x2, y2))
+    return rects or None
+
+def bounding_region(rects):
+    return (
+        min(r[0] for r in rects), min(r[1] for r in rects),
+        max(r[2] for r in rects), max(r[3] for r in rects),
+    )
+
+def infer_frame(frame):
+    # Only the area covered by the detection zones is sent to the model, and
+    # people whose box centre is outside every zone are dropped before tracking.
+    rects = zone_rects(frame.shape, DETECTION_ZONES)
+    region = bounding_region(rects) if rects else None
+    engine = get_engine()
+    with metrics.timer('inference'):
+        return engine.detect(frame, region=region, zones=rects)
+
+def track_frame(frame, data, iou_thresh=0.3, now=None):
+    """now: capture time in seconds, used to expire track IDs (defaults to the current time)."""
+    now = time.time() if now is None else now
+    detections = get_engine().track(frame, data, iou_thresh)
+    _track_ids.evict(now)
+    for det in detections:
+        det['track_id'] = _track_ids.get(det.pop('raw_id'), now)
+    return detections
+
+def detect_and_track(frame, iou_thresh=0.3, annotate=True):
+    """
+    Returns (annotated_frame, track_list). With annotate=False nobody is watching, so the
+    frame is neither copied nor drawn on and annotated_frame is None.
+    """
+    track_list = track_frame(frame, infer_frame(frame), iou_thresh)
+    return (annotate_frame(frame, track_list) if annotate else None), track_list
+
+def annotate_frame(frame, track_list):
+    annotated = frame.copy()  # the raw frame is shared with other ring subscribers
+    for det in track_list:
+        x1, y1, x2, y2 = det['bbox']
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(annotated, f"ID:{det['track_id']} {det['confidence']:.2f}", (x1, max(y1-10,10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
+    return annotated
+
+def motion_detected(frame, motion_gate, now=None):
+    """Asks the MotionGate whether the zones (or whole frame) changed since the last inferred frame."""
+    if motion_gate is None:
+        return True
+    rects = zone_rects(frame.shape, DETECTION_ZONES)
+    region = bounding_region(rects) if rects else None
+    return motion_gate.should_infer(frame, region, now=now)
+
+def detect_and_track_gated(frame, motion_gate, previous_track_list, annotate=True):
+    """
+    detect_and_track behind a MotionGate: when the zones (or whole frame) haven't changed
+    since the last inferred frame, the previous track list is reused and only annotation runs.
+    """
+    if not motion_detected(frame, motion_gate) and previous_track_list is not None:
+        annotated = annotate_frame(frame, previous_track_list) if annotate else None
+        return annotated, previous_track_list
+    return detect_and_track(frame, annotate=annotate)
+
+def detect_and_track_two_pass(frame, iou_thresh=0.3):
+    """
+    Previous detect+track path: a plain inference pass for boxes plus a second
+    model.track() pass for IDs, joined by IoU. Kept for benchmark_detection only.
+    """
+    model = get_model()
     raw_frame = frame.copy()
     raw_results = model(raw_frame, conf=CONFIDENCE_THRESHOLD, iou=0.5)
     raw_boxes = []
@@ -120,79 +226,229 @@ def detect_and_track(frame, iou_thresh=0.3):
         conf = float(box.conf[0].item())
         tracker_boxes.append({'raw_id': str(box.id), 'bbox': coords, 'confidence': conf})
     track_list = []
-    for det in raw_boxes:
-        best_match = None
-        best_iou = 0
-        for trk in tracker_boxes:
-            iou_val = compute_iou(det['bbox'], trk['bbox'])
-            if iou_val > best_iou:
-                best_iou = iou_val
-                best_match = trk
-        if best_match and best_iou > iou_thresh:
-            norm_id = get_contiguous_id(best_match['raw_id'])
-        else:
-            new_raw = f"new_{len(_contiguous_id_map)+1}"
-            norm_id = get_contiguous_id(new_raw)
+    matches = assign(
+        iou_matrix([d['bbox'] for d in raw_boxes], [t['bbox'] for t in tracker_boxes]), iou_thresh
+    )
+    now = time.time()
+    for i, det in enumerate(raw_boxes):
+        norm_id = _track_ids.get(tracker_boxes[matches[i]]['raw_id'] if i in matches else None, now)
         det['track_id'] = norm_id
         track_list.append(det)
         x1, y1, x2, y2 = det['bbox']
         cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 255, 0), 2)
         cv2.putText(annotated, f"ID:{norm_id} {det['confidence']:.2f}", (x1, max(y1-10,10)),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 2)
-    total_end = time.time()
     return annotated, track_list
 
+class FrameProducer:
+    """
+    Captures, infers and annotates each frame once and publishes it to a FrameRing.
+    Session persistence and every video stream subscribe to the ring instead of
+    running their own capture and inference. Idles while nobody is subscribed.
+
+    The work is split into pipeline stages, each on its own thread and joined by small
+    drop-oldest queues, so capture, inference, tracking and JPEG encoding overlap:
+    capture (the prefetching source) -> detect (motion gate + model) -> track
+    (tracker + ID mapping) -> render (annotation and JPEG only while someone is
+    watching, then publish).
+    """
+
+    def __init__(self, ring, source_spec=None, realtime=True, motion_gate=None, scheduler=None):
+        self.ring = ring
+        self.source_spec = source_spec
+        self.realtime = realtime
+        self.motion_gate = motion_gate
+        self.scheduler = scheduler
+        self.frames = 0
+        self.end_to_end = None
+        self.thread = None
+        self.source = None
+        self.stopping = False
+        self.pipeline = Pipeline(self.stages())
+        self._track_list = None
+
+    def stages(self):
+        return [
+            Stage('detect', self._detect, pace=self._pace),
+            Stage('track', self._track),
+            Stage('render', self._render),
+        ]
+
+    def _detect(self, item):
+        captured_at, frame = item
+        # None tells the track stage that nothing moved and the previous tracks still hold
+        # capture time rather than processing time, so replays skip the same frames as the recording
+        if motion_detected(frame, self.motion_gate, now=captured_at.timestamp()):
+            return captured_at, frame, infer_frame(frame)
+        metrics.inc('skipped_frames')
+        return captured_at, frame, None
+
+    def _pace(self, busy):
+        if self.scheduler is not None:
+            self.scheduler.wait(busy, len(self._track_list or ()))
+
+    def _track(self, item):
+        captured_at, frame, data = item
+        if data is not None:
+            self._track_list = track_frame(frame, data, now=captured_at.timestamp())
+        elif self._track_list is None:
+            self._track_list = []
+        self.frames += 1
+        metrics.inc('frames')
+        metrics.set('active_tracks', len(self._track_list))
+        return captured_at, frame, self._track_list
+
+    def _render(self, item):
+        captured_at, frame, track_list = item
+        annotated = jpeg = None
+        if self.ring.viewer_count > 0:
+            with metrics.timer('annotate'):
+                annotated = annotate_frame(frame, track_list)
+            with metrics.timer('encode'):
+                ok, buf = cv2.imencode('.jpg', annotated)
+            jpeg = buf.tobytes() if ok else None
+        packet = FramePacket(captured_at, frame, annotated, track_list, jpeg)
+        self.ring.publish(packet)
+        delay = (timezone.now() - captured_at).total_seconds()
+        metrics.observe('end_to_end', delay)
+        self.end_to_end = delay if self.end_to_end is None else self.end_to_end + 0.2 * (delay - self.end_to_end)
+        return packet
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        self.ring.wait_for_subscribers()
+        if self.ring.closed:
+            return
+        source = None
+        try:
+            source = self.source = open_source(self.source_spec, realtime=self.realtime)
+            if self.stopping:
+                source.close()
+
+            def next_frame():
+                self.ring.wait_for_subscribers()
+                return source.get()
+
+            self.pipeline.source = next_frame
+            self.pipeline.start().join()  # raises a stage's error once the others have stopped
+        except Exception as e:
+            self.pipeline.error = self.pipeline.error or e
+            raise
+        finally:
+            if source is not None:
+                source.close()
+            self.ring.close()
+
+    def stop(self):
+        """Ends the stream at the source; frames already captured drain through the stages."""
+        self.stopping = True
+        if self.source is not None:
+            self.source.close()
+        else:
+            self.ring.close()
+
+    def run_sync(self, items):
+        """
+        Runs (captured_at, frame) items through the same stages on the calling thread,
+        in order and without dropping any; yields each published FramePacket.
+        """
+        return self.pipeline.run_sync(items)
+
+    def stats(self):
+        return {
+            'end_to_end_ms': round((self.end_to_end or 0.0) * 1000, 1),
+            'stages': self.pipeline.stats(),
+        }
+
+def get_frame_producer():
+    global _frame_producer
+    with _frame_producer_lock:
+        if _frame_producer is None or _frame_producer.ring.closed:
+            motion_gate = MotionGate(max_skip_seconds=MOTION_MAX_SKIP_SECONDS) if MOTION_GATING else None
+            # offline replays (realtime off) run flat out; live capture is paced
+            scheduler = FrameScheduler(TARGET_FPS, CPU_BUDGET, MAX_FPS) if FRAME_SOURCE_REALTIME else None
+            _frame_producer = FrameProducer(
+                FrameRing(FRAME_BUFFER_SIZE), FRAME_SOURCE, FRAME_SOURCE_REALTIME, motion_gate, scheduler
+            )
+        _frame_producer.start()
+        return _frame_producer
+
+def stop_detection():
+    """Asks the running producer to finish; detection_loop returns once the last frame is handled."""
+    with _frame_producer_lock:
+        if _frame_producer is not None:
+            _frame_producer.stop()
+
+def get_detection_stats():
+    producer = _frame_producer
+    frames = producer.frames if producer else 0
+    skipped = producer.motion_gate.skipped if producer and producer.motion_gate else 0
+    stats = {
+        'frames': frames,
+        'skipped_frames': skipped,
+        'skip_ratio': round(skipped / float(frames), 4) if frames else 0.0,
+    }
+    stats.update(_track_ids.stats())
+    if producer:
+        stats.update(producer.stats())
+        if _session_stage is not None:
+            stats['stages']['sessions'] = _session_stage.stats()
+    if producer and producer.scheduler:
+        stats.update(producer.scheduler.stats())
+    if _session_registry is not None:
+        stats.update(_session_registry.stats())
+    return stats
+
 def detection_loop():
+    """
+    Session bookkeeping stage: reads every published frame from the ring and updates the
+    SessionRegistry; database writes are handed on to the SessionWriter's own thread.
+    """
+    global _session_registry, _session_stage
     from .models import PersonSession
-    with mss.mss() as sct:
-        monitor = sct.monitors[1]
-        while True:
-            frame = capture_screen(sct, monitor, target_width=640)
-            annotated_frame, track_list = detect_and_track(frame)
-            current_ids = set()
-            for t in track_list:
-                norm_id = t['track_id']
-                bbox = t['bbox']
-                current_ids.add(norm_id)
-                if not PersonSession.objects.filter(track_id=norm_id, exit_timestamp__isnull=True).exists():
-                    matched = find_matching_session(frame, bbox, PersonSession)
-                    if matched:
-                        # Same person returning — re-open the existing session under the new tracker ID
-                        # so they aren't counted as a new arrival and their original enter time is kept.
-                        matched.track_id = norm_id
-                        matched.exit_timestamp = None
-                        matched.duration_seconds = None
-                        matched.active = True
-                        fresh_feature = extract_appearance_feature(frame, bbox)
-                        if fresh_feature is not None:
-                            matched.appearance_feature = fresh_feature
-                        matched.save()
-                    else:
-                        feature = extract_appearance_feature(frame, bbox)
-                        PersonSession.objects.create(
-                            track_id=norm_id,
-                            enter_timestamp=timezone.now(),
-                            appearance_feature=feature
-                        )
-            for norm_id in set().union(*[{s.track_id} for s in PersonSession.objects.filter(exit_timestamp__isnull=True)]) - current_ids:
-                session = PersonSession.objects.filter(track_id=norm_id, exit_timestamp__isnull=True).first()
-                if session:
-                    session.exit_timestamp = timezone.now()
-                    session.duration_seconds = (session.exit_timestamp - session.enter_timestamp).total_seconds()
-                    session.save()
-            time.sleep(REFRESH_INTERVAL)
+    from .sessions import SessionRegistry, SessionWriter
+    writer = SessionWriter(PersonSession).start()
+    registry = _session_registry = SessionRegistry(PersonSession, writer).load()
+    try:
+        with get_frame_producer().ring.subscribe() as subscription:
+            _session_stage = Stage(
+                'sessions',
+                lambda packet: registry.update(packet.frame, packet.track_list, now=packet.timestamp),
+                inbox=subscription,
+            )
+            pipeline = Pipeline([_session_stage]).start()
+            try:
+                pipeline.join()
+            except Exception:
+                stop_detection()
+                raise
+    finally:
+        writer.stop()
 
 def generate_video_stream():
-    with mss.mss() as sct:
-        monitor = sct.monitors[1]
+    from django.conf import settings
+    if not getattr(settings, 'DETECTION_IN_PROCESS', False):
+        # detection runs in the worker process; only read what it publishes
+        from .worker import snapshot_stream
+        yield from snapshot_stream()
+        return
+    with get_frame_producer().ring.subscribe(latest_only=True, viewer=True) as subscription:
         while True:
-            frame = capture_screen(sct, monitor, target_width=640)
-            annotated_frame, _ = detect_and_track(frame)
-            ret, jpeg = cv2.imencode('.jpg', annotated_frame)
-            if ret:
+            packet = subscription.get()
+            if packet is None:
+                break
+            jpeg = packet.jpeg
+            if jpeg is None:
+                # published just before this viewer subscribed
+                ret, buf = cv2.imencode('.jpg', annotate_frame(packet.frame, packet.track_list))
+                jpeg = buf.tobytes() if ret else None
+            if jpeg is not None:
                 yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n\r\n')
-            time.sleep(REFRESH_INTERVAL)
+                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n\r\n')
 
 def perform_detection_on_frame(frame):
     annotated_frame, track_list = detect_and_track(frame)
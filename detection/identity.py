@@ -0,0 +1,70 @@
+import heapq
+import itertools
+from collections import OrderedDict
+
+
+class TrackIdentityManager:
+    """
+    Maps the tracker's raw IDs to the short numeric track IDs shown on the stream and
+    stored on PersonSessions, with memory bounded for 24/7 operation.
+
+    Entries are kept least recently seen first, so evicting the ones not seen for
+    `horizon_seconds` only looks at the front. Evicted numbers are reused smallest
+    first, so IDs stay as small as the number of people seen within one horizon. A
+    track that has been gone that long has long since had its session closed.
+    Detections the tracker hasn't confirmed yet (raw_id None) get a fresh ID each time,
+    and that ID is released after the same horizon.
+    """
+
+    def __init__(self, horizon_seconds=600.0):
+        self.horizon = horizon_seconds
+        self.evicted = 0
+        self.reset()
+
+    def reset(self):
+        self._ids = OrderedDict()     # raw ID -> [number, last seen]
+        self._free = []               # heap of released numbers
+        self._next = 1
+        self._unconfirmed = itertools.count()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, raw_id, now):
+        """The track ID for `raw_id` at time `now` (seconds, never decreasing between calls)."""
+        if raw_id is None:
+            raw_id = ('unconfirmed', next(self._unconfirmed))
+        entry = self._ids.get(raw_id)
+        if entry is None:
+            entry = self._ids[raw_id] = [heapq.heappop(self._free) if self._free else self._allocate(), now]
+        else:
+            entry[1] = now
+            self._ids.move_to_end(raw_id)
+        return str(entry[0])
+
+    def _allocate(self):
+        number = self._next
+        self._next += 1
+        return number
+
+    def evict(self, now):
+        """Releases IDs not seen since now - horizon; returns how many were released."""
+        cutoff = now - self.horizon
+        released = 0
+        while self._ids:
+            raw_id, (number, seen) = next(iter(self._ids.items()))
+            if seen >= cutoff:
+                break
+            self._ids.popitem(last=False)
+            heapq.heappush(self._free, number)
+            released += 1
+        self.evicted += released
+        return released
+
+    def stats(self):
+        return {
+            'track_ids_held': len(self._ids),
+            'track_ids_free': len(self._free),
+            'track_id_max': self._next - 1,
+            'track_ids_evicted': self.evicted,
+        }
@@ -0,0 +1,69 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from detection.tracking import assign, compute_iou, has_scipy, iou_matrix
+
+
+def make_boxes(count, rng, width=1920, height=1080):
+    """Person-sized boxes scattered over a frame, plus the same boxes jittered as 'tracks'."""
+    x1 = rng.uniform(0, width - 120, count)
+    y1 = rng.uniform(0, height - 300, count)
+    w = rng.uniform(40, 120, count)
+    h = rng.uniform(120, 300, count)
+    dets = np.stack([x1, y1, x1 + w, y1 + h], axis=1)
+    tracks = dets + rng.normal(0, 4, dets.shape)
+    return dets.tolist(), tracks[rng.permutation(count)].tolist()
+
+
+def loop_associate(dets, tracks, iou_thresh):
+    """The previous scalar association: best track per detection, duplicates allowed."""
+    matches = {}
+    for i, det in enumerate(dets):
+        best, best_iou = None, 0
+        for j, trk in enumerate(tracks):
+            iou_val = compute_iou(det, trk)
+            if iou_val > best_iou:
+                best_iou, best = iou_val, j
+        if best is not None and best_iou > iou_thresh:
+            matches[i] = best
+    return matches
+
+
+def best_time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+class Command(BaseCommand):
+    help = "Times detection-to-track association: scalar IoU loop vs IoU matrix + one-to-one assignment."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=str,
+            default='10,50,200',
+            help='Comma-separated box counts to time (default: 10,50,200).'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Runs per measurement; the fastest is reported (default: 20).'
+        )
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        repeat = max(1, options['repeat'])
+        self.stdout.write(f"scipy available: {has_scipy()}")
+        self.stdout.write(f"{'boxes':>6} {'loop ms':>9} {'greedy ms':>10} {'hungarian ms':>13}")
+        for count in (int(n) for n in options['sizes'].split(',')):
+            dets, tracks = make_boxes(count, rng)
+            loop_ms = best_time(lambda: loop_associate(dets, tracks, 0.3), repeat)
+            greedy_ms = best_time(lambda: assign(iou_matrix(dets, tracks), 0.3, optimal=False), repeat)
+            hungarian = (f"{best_time(lambda: assign(iou_matrix(dets, tracks), 0.3), repeat):13.2f}"
+                         if has_scipy() else f"{'n/a':>13}")
+            self.stdout.write(f"{count:>6} {loop_ms:9.2f} {greedy_ms:10.2f} {hungarian}")
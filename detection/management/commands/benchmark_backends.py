@@ -0,0 +1,96 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from detection.backends import BACKENDS, PRECISIONS, check_options, load_model
+from detection.tracking import PERSON_CLASS
+from .benchmark_detection import load_frames
+
+
+class Command(BaseCommand):
+    help = "Reports person-detector latency and throughput for each inference backend on a recorded clip."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            type=str,
+            required=True,
+            help='Recorded clip (video file or image directory) to run every backend on.'
+        )
+        parser.add_argument(
+            '--backends',
+            type=str,
+            default=','.join(BACKENDS),
+            help=f"Comma-separated backends to compare (default: {','.join(BACKENDS)})."
+        )
+        parser.add_argument(
+            '--precisions',
+            type=str,
+            default='fp32',
+            help=f"Comma-separated precisions from {', '.join(PRECISIONS)} (default: fp32)."
+        )
+        parser.add_argument(
+            '--model-size',
+            type=str,
+            default='n',
+            help='YOLOv8 model size n/s/m/l/x (default: n).'
+        )
+        parser.add_argument(
+            '--imgsz',
+            type=int,
+            default=640,
+            help='Inference input size in pixels (default: 640).'
+        )
+        parser.add_argument(
+            '--frames',
+            type=int,
+            default=100,
+            help='Frames to time per backend (default: 100).'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=5,
+            help='Untimed frames run through each backend first (default: 5).'
+        )
+
+    def handle(self, *args, **options):
+        size = options['model_size']
+        imgsz = options['imgsz']
+        warmup = options['warmup']
+        combos = [
+            (backend, precision)
+            for backend in options['backends'].split(',')
+            for precision in options['precisions'].split(',')
+        ]
+        frames = load_frames(options['frames'] + warmup, options['source'])
+        if len(frames) <= warmup:
+            raise CommandError("Not enough frames in the clip.")
+
+        self.stdout.write(f"yolov8{size} @ {imgsz}px, {len(frames) - warmup} frames")
+        self.stdout.write(f"{'backend':>10} {'precision':>9} {'mean ms':>8} {'p95 ms':>8} {'FPS':>7}")
+        for backend, precision in combos:
+            try:
+                check_options(size, backend, precision, imgsz)
+                model = load_model(size, backend, precision, imgsz)
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"{backend:>10} {precision:>9} skipped: {e}"))
+                continue
+            latencies = time_model(model, frames, warmup, imgsz, half=(backend == 'torch' and precision == 'fp16'))
+            self.stdout.write(
+                f"{backend:>10} {precision:>9} {np.mean(latencies) * 1000:8.1f} "
+                f"{np.percentile(latencies, 95) * 1000:8.1f} {len(latencies) / np.sum(latencies):7.2f}"
+            )
+
+
+def time_model(model, frames, warmup, imgsz, half=False):
+    kwargs = dict(imgsz=imgsz, classes=[PERSON_CLASS], verbose=False)
+    if half:
+        kwargs['half'] = True
+    for frame in frames[:warmup]:
+        model(frame, **kwargs)
+    latencies = []
+    for frame in frames[warmup:]:
+        start = time.perf_counter()
+        model(frame, **kwargs)
+        latencies.append(time.perf_counter() - start)
+    return latencies
@@ -0,0 +1,75 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from detection import detection_module
+from detection.sources import open_source
+
+
+class Command(BaseCommand):
+    help = "Compares frames-per-second of the single-pass detect+track engine against the old two-pass path."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--frames',
+            type=int,
+            default=50,
+            help='Number of frames to time per path (default: 50).'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=5,
+            help='Untimed frames run through each path first (default: 5).'
+        )
+        parser.add_argument(
+            '--source',
+            type=str,
+            default='screen',
+            help="Frame source: 'screen', 'screen:N', a camera index, stream URL, image directory or video file."
+        )
+
+    def handle(self, *args, **options):
+        num_frames = options['frames']
+        warmup = options['warmup']
+        frames = load_frames(num_frames + warmup, options['source'])
+        if not frames:
+            raise CommandError("No frames could be read.")
+        if len(frames) <= warmup:
+            raise CommandError(f"Only {len(frames)} frames could be read; need more than --warmup={warmup}.")
+
+        self.stdout.write(f"Benchmarking {len(frames) - warmup} frames ({warmup} warm-up)...")
+        paths = [
+            ("two-pass", detection_module.detect_and_track_two_pass),
+            ("single-pass", detection_module.detect_and_track),
+        ]
+        fps = {}
+        for name, fn in paths:
+            fps[name] = time_path(fn, frames, warmup)
+            self.stdout.write(f"{name:>12}: {fps[name]:.2f} FPS ({1000.0 / fps[name]:.1f} ms/frame)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Speed-up: {fps['single-pass'] / fps['two-pass']:.2f}x"
+        ))
+
+
+def load_frames(count, spec='screen'):
+    source = open_source(spec, realtime=False)
+    frames = []
+    try:
+        while len(frames) < count:
+            item = source.get()
+            if item is None:
+                break
+            frames.append(item[1])
+    finally:
+        source.close()
+    return frames
+
+
+def time_path(fn, frames, warmup):
+    for frame in frames[:warmup]:
+        fn(frame)
+    timed = frames[warmup:]
+    start = time.perf_counter()
+    for frame in timed:
+        fn(frame)
+    elapsed = time.perf_counter() - start
+    return len(timed) / elapsed if elapsed > 0 else float('inf')
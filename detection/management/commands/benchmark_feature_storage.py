@@ -0,0 +1,76 @@
+import time
+from datetime import timedelta
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Avg
+from django.db.models.functions import Length
+from django.utils import timezone
+from dashboard.utils import get_top_longest_waits_custom, get_wait_time_distribution_custom
+from detection.models import PersonSession
+
+QUERIES = [
+    ("all rows", lambda start, end: list(PersonSession.objects.all())),
+    # a base_qs keeps these on the session rows rather than the hourly rollups, and out of
+    # the dashboard cache, which would otherwise answer every repeat after the first
+    ("wait distribution", lambda start, end: get_wait_time_distribution_custom(
+        start, end, base_qs=PersonSession.objects.all())),
+    ("top longest waits", lambda start, end: get_top_longest_waits_custom(
+        start, end, base_qs=PersonSession.objects.defer('appearance_feature'))),
+]
+
+
+def fake_feature(rng):
+    hist = rng.random(512).astype(np.float32) ** 4
+    return (hist / np.linalg.norm(hist)).tolist()
+
+
+class Command(BaseCommand):
+    help = ("Measures stored appearance-feature size and dashboard query time on synthetic sessions. "
+            "Everything runs in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=5000,
+            help='Synthetic sessions to insert (default: 5000).'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Runs per query; the fastest is reported (default: 5).'
+        )
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        end = timezone.now()
+        start = end - timedelta(days=7)
+        with transaction.atomic():
+            sessions = []
+            for i in range(options['rows']):
+                enter = start + timedelta(seconds=float(rng.uniform(0, 7 * 86400 - 3600)))
+                wait = float(rng.gamma(2.0, 600.0))
+                sessions.append(PersonSession(
+                    track_id=f"bench_{i}",
+                    enter_timestamp=enter,
+                    exit_timestamp=enter + timedelta(seconds=wait),
+                    duration_seconds=wait,
+                    active=False,
+                    appearance_feature=fake_feature(rng),
+                ))
+            PersonSession.objects.bulk_create(sessions, batch_size=500)
+
+            size = PersonSession.objects.filter(track_id__startswith='bench_').aggregate(
+                avg=Avg(Length('appearance_feature'))
+            )['avg']
+            self.stdout.write(f"{options['rows']} sessions, appearance_feature averages {size:.0f} bytes per row")
+            for name, query in QUERIES:
+                best = float('inf')
+                for _ in range(max(1, options['repeat'])):
+                    t0 = time.perf_counter()
+                    query(start, end)
+                    best = min(best, time.perf_counter() - t0)
+                self.stdout.write(f"{name:>18}: {best * 1000:8.1f} ms")
+            transaction.set_rollback(True)
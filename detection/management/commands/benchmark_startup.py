@@ -0,0 +1,56 @@
+import json
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+HEAVY_MODULES = ('torch', 'ultralytics', 'scipy')
+
+PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smart_patient_flow.settings')
+import django
+django.setup()
+{body}
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'loaded': [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+SCENARIOS = [
+    ("manage.py check", "from django.core.management import call_command\ncall_command('check', verbosity=0)"),
+    ("dashboard process", "import importlib\nfrom django.conf import settings\nimportlib.import_module(settings.ROOT_URLCONF)"),
+]
+
+
+def run_probe(body):
+    """Runs `body` after django.setup() in a fresh interpreter and returns its timing and heavy imports."""
+    script = PROBE.format(body=body, heavy=HEAVY_MODULES)
+    out = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+class Command(BaseCommand):
+    help = "Times Django startup scenarios in fresh processes and reports whether torch, ultralytics or scipy got imported."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Runs per scenario; the fastest is reported (default: 3).'
+        )
+
+    def handle(self, *args, **options):
+        for name, body in SCENARIOS:
+            runs = [run_probe(body) for _ in range(max(1, options['repeat']))]
+            best = min(r['seconds'] for r in runs)
+            loaded = runs[0]['loaded']
+            self.stdout.write(
+                f"{name:>18}: {best:.3f}s, heavy modules loaded: {', '.join(loaded) if loaded else 'none'}"
+            )
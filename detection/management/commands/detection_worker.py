@@ -0,0 +1,38 @@
+from django.core.management.base import CommandError
+from detection import detection_module
+from detection.shared_ring import FrameRingInUse
+from detection.worker import HEARTBEAT_INTERVAL, STOP_FLAG_NAME, DetectionWorker
+from .run_detection import Command as RunDetectionCommand
+
+
+class Command(RunDetectionCommand):
+    help = ("Runs detection as a standalone, supervised worker process. Writes a heartbeat file, "
+            "restarts the pipeline after failures and shuts down cleanly on SIGTERM or the stop flag.")
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--heartbeat-interval',
+            type=float,
+            default=HEARTBEAT_INTERVAL,
+            help=f'Seconds between heartbeat file updates (default: {HEARTBEAT_INTERVAL}).'
+        )
+        parser.add_argument(
+            '--restart-delay',
+            type=float,
+            default=2.0,
+            help='Initial wait before restarting a failed pipeline; doubles on each failure (default: 2).'
+        )
+
+    def handle(self, *args, **options):
+        self.configure(options)
+        worker = DetectionWorker(options['heartbeat_interval'], options['restart_delay'])
+        self.stdout.write(f"Detection worker starting on {options['source']}...")
+        try:
+            started = worker.run()
+        except FrameRingInUse as e:
+            raise CommandError(f"{e} Is another detection worker running?")
+        if not started:
+            raise CommandError(f"{STOP_FLAG_NAME} is present; run clear_detection_stop first.")
+        self.report(detection_module.get_detection_stats())
+        self.stdout.write(f"Detection worker stopped after {worker.restarts} restart(s).")
@@ -0,0 +1,62 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from detection.sources import ClipWriter, source_factory
+
+
+class Command(BaseCommand):
+    help = "Records frames from a source (the screen by default) into a compact .npz clip for replay_clip."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output',
+            type=str,
+            help='Path of the clip to write; .npz is added if missing.'
+        )
+        parser.add_argument(
+            '--source',
+            type=str,
+            default='screen',
+            help="Frame source: 'screen', 'screen:N', a camera index, stream URL, image directory or video file."
+        )
+        parser.add_argument(
+            '--frames',
+            type=int,
+            default=300,
+            help='Number of frames to record (default: 300).'
+        )
+        parser.add_argument(
+            '--fps',
+            type=float,
+            default=5.0,
+            help='Recording rate for live sources; file sources keep their own (default: 5).'
+        )
+        parser.add_argument(
+            '--quality',
+            type=int,
+            default=90,
+            help='JPEG quality of the stored frames (default: 90).'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            source = source_factory(options['source'])()
+        except ValueError as e:
+            raise CommandError(str(e))
+        writer = ClipWriter(options['output'], quality=options['quality'])
+        interval = 1.0 / options['fps'] if source.live else 1.0 / (source.fps or options['fps'])
+        start = time.time()
+        try:
+            for index in range(options['frames']):
+                if source.live:
+                    # pace live capture; file sources are read back to back with nominal timestamps
+                    time.sleep(max(0.0, start + index * interval - time.time()))
+                frame = source.read()
+                if frame is None:
+                    break
+                writer.add(frame, time.time() if source.live else start + index * interval)
+        finally:
+            source.close()
+        if not len(writer):
+            raise CommandError("The source produced no frames.")
+        path = writer.close()
+        self.stdout.write(f"Recorded {len(writer)} frames to {path}")
@@ -0,0 +1,82 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from detection.replay import replay
+from detection.sources import ClipSource
+from .run_detection import add_model_arguments, configure_model
+
+
+class Command(BaseCommand):
+    help = ("Replays a recorded clip through detection, tracking and session bookkeeping as fast as "
+            "possible, against a throwaway database, and reports FPS, per-stage latency and DB queries per frame.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'clip',
+            type=str,
+            help='Clip written by record_clip.'
+        )
+        parser.add_argument(
+            '--json',
+            type=str,
+            default=None,
+            help="Also write the full results as JSON to this path ('-' for stdout), for diffing between releases."
+        )
+        parser.add_argument(
+            '--no-motion-gate',
+            action='store_true',
+            help='Run inference on every frame, even when nothing in view has moved.'
+        )
+        parser.add_argument(
+            '--annotate',
+            action='store_true',
+            help='Annotate and JPEG-encode every frame, as when someone is watching the stream.'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=1,
+            help='Untimed inference passes on the first frame before replaying (default: 1).'
+        )
+        add_model_arguments(parser)
+
+    def handle(self, *args, **options):
+        configure_model(options)
+        try:
+            clip = ClipSource(options['clip'])
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(f"Could not read clip {options['clip']!r}: {e}")
+        if not len(clip):
+            raise CommandError("The clip has no frames.")
+
+        # sessions go to a fresh, fully migrated copy of the schema that is dropped afterwards
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = replay(
+                clip,
+                motion_gating=not options['no_motion_gate'],
+                annotate=options['annotate'],
+                warmup=options['warmup'],
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+            return
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        self.stdout.write(
+            f"{results['clip']['frames']} frames in {results['wall_seconds']} s: {results['fps']} FPS, "
+            f"inference skipped on {results['skipped_frames']}, "
+            f"{results['db_queries_per_frame']} DB queries per frame, {results['sessions']} sessions."
+        )
+        self.stdout.write(f"{'stage':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'count':>6}")
+        for stage, timing in results['timings'].items():
+            if 'p50_ms' in timing:
+                self.stdout.write(
+                    f"{stage:>12} {timing['p50_ms']:9.2f} {timing['p95_ms']:9.2f} {timing['p99_ms']:9.2f} {timing['count']:>6}"
+                )
+        self.stdout.write(f"tracks digest {results['tracks_digest']}")
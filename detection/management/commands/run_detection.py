@@ -1,10 +1,112 @@
-from django.core.management.base import BaseCommand
-from detection.detection_module import detection_loop
+from django.core.management.base import BaseCommand, CommandError
+from detection import detection_module
+from detection.backends import BACKENDS, MODEL_SIZES, PRECISIONS, check_options
+
+
+def add_model_arguments(parser):
+    """Model options shared by the commands that run inference."""
+    parser.add_argument(
+        '--model-size',
+        choices=MODEL_SIZES,
+        default=detection_module.MODEL_SIZE,
+        help=f'YOLOv8 model size (default: {detection_module.MODEL_SIZE}).'
+    )
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default=detection_module.MODEL_BACKEND,
+        help=f'Inference backend (default: {detection_module.MODEL_BACKEND}).'
+    )
+    parser.add_argument(
+        '--precision',
+        choices=PRECISIONS,
+        default=detection_module.MODEL_PRECISION,
+        help=f'Inference precision (default: {detection_module.MODEL_PRECISION}).'
+    )
+    parser.add_argument(
+        '--imgsz',
+        type=int,
+        default=detection_module.INPUT_SIZE,
+        help=f'Inference input size in pixels (default: {detection_module.INPUT_SIZE}).'
+    )
+
+
+def configure_model(options):
+    try:
+        check_options(options['model_size'], options['backend'], options['precision'], options['imgsz'])
+    except ValueError as e:
+        raise CommandError(str(e))
+    detection_module.MODEL_SIZE = options['model_size']
+    detection_module.MODEL_BACKEND = options['backend']
+    detection_module.MODEL_PRECISION = options['precision']
+    detection_module.INPUT_SIZE = options['imgsz']
+
 
 class Command(BaseCommand):
     help = 'Runs the YOLOv8 detection module'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            type=str,
+            default='screen',
+            help="Frame source: 'screen', 'screen:N', a camera index, stream URL, image directory, recorded clip or video file."
+        )
+        parser.add_argument(
+            '--fast',
+            action='store_true',
+            help='Replay file sources as fast as possible instead of at their native frame rate.'
+        )
+        parser.add_argument(
+            '--target-fps',
+            type=float,
+            default=detection_module.TARGET_FPS,
+            help=f'Steady-state frames per second for live sources (default: {detection_module.TARGET_FPS}).'
+        )
+        parser.add_argument(
+            '--cpu-budget',
+            type=float,
+            default=detection_module.CPU_BUDGET,
+            help=f'Max fraction of time spent processing frames; slower inference lowers the frame rate (default: {detection_module.CPU_BUDGET}).'
+        )
+        parser.add_argument(
+            '--no-motion-gate',
+            action='store_true',
+            help='Run inference on every frame, even when nothing in view has moved.'
+        )
+        parser.add_argument(
+            '--max-skip-seconds',
+            type=float,
+            default=detection_module.MOTION_MAX_SKIP_SECONDS,
+            help=f'Longest gap between inferred frames on a static scene (default: {detection_module.MOTION_MAX_SKIP_SECONDS}).'
+        )
+        add_model_arguments(parser)
+
+    def configure(self, options):
+        configure_model(options)
+        detection_module.FRAME_SOURCE = options['source']
+        detection_module.FRAME_SOURCE_REALTIME = not options['fast']
+        detection_module.TARGET_FPS = options['target_fps']
+        detection_module.CPU_BUDGET = options['cpu_budget']
+        detection_module.MOTION_GATING = not options['no_motion_gate']
+        detection_module.MOTION_MAX_SKIP_SECONDS = options['max_skip_seconds']
+
     def handle(self, *args, **options):
-        self.stdout.write("Starting Detection...")
-        detection_loop()
-        self.stdout.write("Detection has stopped.")
\ No newline at end of file
+        self.configure(options)
+        self.stdout.write(f"Starting Detection on {options['source']}...")
+        detection_module.detection_loop()
+        self.report(detection_module.get_detection_stats())
+        self.stdout.write("Detection has stopped.")
+
+    def report(self, stats):
+        self.stdout.write(
+            f"Processed {stats['frames']} frames, skipped inference on {stats['skipped_frames']} "
+            f"({stats['skip_ratio']:.1%}) unchanged frames."
+        )
+        if 'db_queries_per_flush' in stats:
+            self.stdout.write(
+                f"The session writer made {stats['session_flushes']} flushes of {stats['sessions_written']} "
+                f"sessions, {stats['db_queries_per_flush']} DB queries each."
+            )
+        if 'achieved_fps' in stats:
+            self.stdout.write(f"Achieved {stats['achieved_fps']} FPS against a target of {stats['target_fps']}.")
\ No newline at end of file
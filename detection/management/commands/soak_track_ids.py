@@ -0,0 +1,103 @@
+import os
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+from detection import detection_module
+from detection.identity import TrackIdentityManager
+
+
+def synthetic_frames(count, people=20, fps=5.0, unconfirmed=2, seed=0):
+    """
+    Yields (now, raw_ids) for `count` frames of a queue where people keep arriving and
+    leaving, numbered the way ByteTrack numbers tracks, plus a few unconfirmed (None) detections.
+    """
+    rng = random.Random(seed)
+    present = {}          # raw ID -> time the person leaves
+    next_raw = 1
+    for index in range(count):
+        now = index / fps
+        present = {raw: leaves for raw, leaves in present.items() if leaves > now}
+        while len(present) < people:
+            present[str(next_raw)] = now + rng.expovariate(1 / 120.0)
+            next_raw += 1
+        yield now, list(present) + [None] * rng.randint(0, unconfirmed)
+
+
+def rss_kb():
+    """Current resident set size, or the peak where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = ("Feeds millions of synthetic frames through the track-ID manager and fails if memory "
+            "keeps growing once the ID horizon has filled.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--frames',
+            type=int,
+            default=2000000,
+            help='Synthetic frames to run (default: 2000000, about 4.6 days at 5 FPS).'
+        )
+        parser.add_argument(
+            '--people',
+            type=int,
+            default=20,
+            help='People in view at any time (default: 20).'
+        )
+        parser.add_argument(
+            '--fps',
+            type=float,
+            default=5.0,
+            help='Simulated frame rate (default: 5).'
+        )
+        parser.add_argument(
+            '--horizon',
+            type=float,
+            default=detection_module.TRACK_ID_HORIZON_SECONDS,
+            help=f'Seconds before an unseen track ID is released (default: {detection_module.TRACK_ID_HORIZON_SECONDS}).'
+        )
+        parser.add_argument(
+            '--report-every',
+            type=int,
+            default=250000,
+            help='Frames between progress lines (default: 250000).'
+        )
+        parser.add_argument(
+            '--max-growth-kb',
+            type=int,
+            default=2048,
+            help='Allowed RSS growth after the first report before the soak fails (default: 2048).'
+        )
+
+    def handle(self, *args, **options):
+        if options['frames'] < options['report_every']:
+            raise CommandError("--frames must be at least --report-every.")
+        manager = TrackIdentityManager(options['horizon'])
+        baseline = None
+        started = time.perf_counter()
+        self.stdout.write(f"{'frames':>10} {'ids held':>9} {'max id':>7} {'rss MB':>8}")
+        frames = synthetic_frames(options['frames'], options['people'], options['fps'])
+        for index, (now, raw_ids) in enumerate(frames, 1):
+            manager.evict(now)
+            for raw_id in raw_ids:
+                manager.get(raw_id, now)
+            if index % options['report_every'] == 0:
+                rss = rss_kb()
+                baseline = rss if baseline is None else baseline
+                stats = manager.stats()
+                self.stdout.write(
+                    f"{index:>10} {stats['track_ids_held']:>9} {stats['track_id_max']:>7} {rss / 1024:8.1f}"
+                )
+        growth = rss_kb() - baseline
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{options['frames']} frames in {elapsed:.1f} s; RSS grew {growth} KB after the first report."
+        )
+        if growth > options['max_growth_kb']:
+            raise CommandError(f"RSS grew by {growth} KB (limit {options['max_growth_kb']} KB).")
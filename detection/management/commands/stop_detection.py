@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+import os
+from django.conf import settings
+
+class Command(BaseCommand):
+    help = "Creates the stop flag so a running detection worker shuts down cleanly."
+
+    def handle(self, *args, **options):
+        stop_file = os.path.join(settings.BASE_DIR, "detection_stop.flag")
+        open(stop_file, "a").close()
+        self.stdout.write("Stop flag created; the detection worker will stop within a few seconds.")
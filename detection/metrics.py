@@ -0,0 +1,112 @@
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+HISTOGRAM_WINDOW = 1024     # observations kept per timer; percentiles cover roughly the last few minutes
+QUANTILES = ((0.5, 'p50_ms'), (0.95, 'p95_ms'), (0.99, 'p99_ms'))
+
+
+class RollingHistogram:
+    """
+    The last `window` observations in a fixed numpy buffer. Recording is one array store;
+    percentiles are only computed when a snapshot is read. count and sum cover every
+    observation since start, as Prometheus summaries expect.
+    """
+
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self._values = np.zeros(window)
+        self._next = 0
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._values[self._next] = value
+            self._next = (self._next + 1) % len(self._values)
+            self.count += 1
+            self.sum += value
+
+    def summary(self):
+        """Milliseconds, matching the other detection stats."""
+        with self._lock:
+            values = self._values[:min(self.count, len(self._values))].copy()
+            count, total = self.count, self.sum
+        summary = {'count': count, 'sum_ms': round(total * 1000, 3)}
+        if len(values):
+            for (_, key), value in zip(QUANTILES, np.percentile(values, [q * 100 for q, _ in QUANTILES])):
+                summary[key] = round(value * 1000, 3)
+            summary['max_ms'] = round(values.max() * 1000, 3)
+        return summary
+
+
+class Metrics:
+    """
+    Named timers (rolling histograms), counters and gauges for the detection pipeline.
+    Any thread can record; snapshot() is what the worker heartbeat and the metrics views read.
+    """
+
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, RollingHistogram(self.window))
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def snapshot(self):
+        return {
+            'timings': {name: h.summary() for name, h in sorted(self.histograms.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'gauges': dict(sorted(self.gauges.items())),
+        }
+
+
+def prometheus_text(snapshot, prefix='detection'):
+    """Renders a Metrics.snapshot() in the Prometheus text exposition format."""
+    lines = []
+    timings = snapshot.get('timings', {})
+    if timings:
+        name = f"{prefix}_stage_seconds"
+        lines += [f"# HELP {name} Time spent per pipeline stage, over the most recent observations.",
+                  f"# TYPE {name} summary"]
+        for stage, summary in timings.items():
+            for quantile, key in QUANTILES:
+                if key in summary:
+                    lines.append(f'{name}{{stage="{stage}",quantile="{quantile}"}} {summary[key] / 1000:.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {summary["sum_ms"] / 1000:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {summary["count"]}')
+    for counter, value in snapshot.get('counters', {}).items():
+        lines += [f"# TYPE {prefix}_{counter}_total counter", f"{prefix}_{counter}_total {value}"]
+    for gauge, value in snapshot.get('gauges', {}).items():
+        lines += [f"# TYPE {prefix}_{gauge} gauge", f"{prefix}_{gauge} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,55 @@
+import numpy as np
+import detection.models
+from django.db import migrations
+
+
+def json_to_binary(apps, schema_editor):
+    PersonSession = apps.get_model('detection', 'PersonSession')
+    batch = []
+    qs = PersonSession.objects.filter(appearance_feature__isnull=False).only('id', 'appearance_feature')
+    for session in qs.iterator(chunk_size=500):
+        if session.appearance_feature:
+            session.appearance_feature_bin = np.asarray(session.appearance_feature, dtype=np.float16).tobytes()
+            batch.append(session)
+        if len(batch) >= 500:
+            PersonSession.objects.bulk_update(batch, ['appearance_feature_bin'])
+            batch = []
+    PersonSession.objects.bulk_update(batch, ['appearance_feature_bin'])
+
+
+def binary_to_json(apps, schema_editor):
+    PersonSession = apps.get_model('detection', 'PersonSession')
+    batch = []
+    qs = PersonSession.objects.filter(appearance_feature_bin__isnull=False).only('id', 'appearance_feature_bin')
+    for session in qs.iterator(chunk_size=500):
+        session.appearance_feature = [float(v) for v in session.appearance_feature_bin]
+        batch.append(session)
+        if len(batch) >= 500:
+            PersonSession.objects.bulk_update(batch, ['appearance_feature'])
+            batch = []
+    PersonSession.objects.bulk_update(batch, ['appearance_feature'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0004_delete_detectionrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personsession',
+            name='appearance_feature_bin',
+            field=detection.models.FeatureField(blank=True, null=True),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='personsession',
+            name='appearance_feature',
+        ),
+        migrations.RenameField(
+            model_name='personsession',
+            old_name='appearance_feature_bin',
+            new_name='appearance_feature',
+        ),
+    ]
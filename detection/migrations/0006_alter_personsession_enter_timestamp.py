@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0005_binary_appearance_feature'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='personsession',
+            name='enter_timestamp',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,13 +1,44 @@
+from base64 import b64decode, b64encode
+import numpy as np
 from django.db import models
 from django.utils import timezone
 
+
+class FeatureField(models.BinaryField):
+    """
+    Appearance histogram stored as raw float16 bytes (1 KB for 512 bins instead of ~10 KB of
+    JSON text). Accepts a list or array and reads back as a float32 NumPy array.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return np.frombuffer(bytes(value), dtype=np.float16).astype(np.float32)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+        return np.asarray(value, dtype=np.float16).tobytes()
+
+    def to_python(self, value):
+        if isinstance(value, str):  # base64, as written by value_to_string
+            value = b64decode(value.encode('ascii'))
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return np.frombuffer(bytes(value), dtype=np.float16).astype(np.float32)
+        return value
+
+    def value_to_string(self, obj):
+        value = self.get_prep_value(self.value_from_object(obj))
+        return None if value is None else b64encode(value).decode('ascii')
+
+
 class PersonSession(models.Model):
     track_id = models.CharField(max_length=50)
-    enter_timestamp = models.DateTimeField(default=timezone.now)
+    enter_timestamp = models.DateTimeField(default=timezone.now, db_index=True)
     exit_timestamp = models.DateTimeField(null=True, blank=True)
     duration_seconds = models.FloatField(null=True, blank=True)
     active = models.BooleanField(default=True)
-    appearance_feature = models.JSONField(null=True, blank=True)
+    appearance_feature = FeatureField(null=True, blank=True)
 
     def __str__(self):
         return f"PersonSession {self.track_id} (Entered: {self.enter_timestamp}, Active: {self.active})"
@@ -0,0 +1,52 @@
+import time
+import cv2
+
+
+class MotionGate:
+    """
+    Cheap change detector run before inference. Each frame is shrunk to a small blurred
+    greyscale image and compared with the last frame that was actually sent to the model;
+    if too few pixels changed, inference is skipped and the previous tracks are reused.
+    A frame is always inferred once max_skip_seconds have passed so tracks can't go stale.
+    """
+
+    def __init__(self, threshold=0.005, pixel_delta=25, width=160, max_skip_seconds=2.0):
+        self.threshold = threshold          # fraction of changed pixels that counts as motion
+        self.pixel_delta = pixel_delta      # grey-level difference for a pixel to count as changed
+        self.width = width
+        self.max_skip_seconds = max_skip_seconds
+        self.frames = 0
+        self.skipped = 0
+        self._reference = None
+        self._reference_time = None
+
+    def _signature(self, frame, region=None):
+        if region is not None:
+            x1, y1, x2, y2 = region
+            frame = frame[y1:y2, x1:x2]
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.width / float(w))
+        small = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def should_infer(self, frame, region=None, now=None):
+        now = time.monotonic() if now is None else now
+        self.frames += 1
+        signature = self._signature(frame, region)
+        reference = self._reference
+        if (reference is not None and reference.shape == signature.shape
+                and now - self._reference_time < self.max_skip_seconds):
+            diff = cv2.absdiff(signature, reference)
+            changed = cv2.countNonZero(cv2.threshold(diff, self.pixel_delta, 255, cv2.THRESH_BINARY)[1])
+            if changed < self.threshold * diff.size:
+                self.skipped += 1
+                return False
+        self._reference = signature
+        self._reference_time = now
+        return True
+
+    @property
+    def skip_ratio(self):
+        return self.skipped / float(self.frames) if self.frames else 0.0
+
@@ -0,0 +1,187 @@
+import queue
+import threading
+import time
+
+
+class DropOldestQueue:
+    """
+    Bounded hand-off between two pipeline stages. When the consumer falls behind, a lossy
+    queue discards its oldest item to make room (a stale frame is worth less than a fresh
+    one); a lossless queue blocks the producer instead. None marks the end of the stream.
+    Once the consumer has failed, abort() makes every put a no-op so no producer blocks on it.
+    """
+
+    def __init__(self, maxsize=2, lossy=True):
+        self.lossy = lossy
+        self.dropped = 0
+        self.wait = None          # smoothed seconds an item sat in the queue
+        self.aborted = False
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item):
+        entry = (time.perf_counter(), item)
+        if not self.lossy or item is None:
+            # the end-of-stream marker waits for room rather than evicting a frame
+            while not self.aborted:
+                try:
+                    self._queue.put(entry, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+            return
+        if self.aborted:
+            return
+        while True:
+            try:
+                self._queue.put_nowait(entry)
+                return
+            except queue.Full:
+                self._make_room()
+
+    def _make_room(self):
+        try:
+            self._queue.get_nowait()
+            self.dropped += 1
+        except queue.Empty:
+            pass
+
+    def get(self, timeout=None):
+        queued_at, item = self._queue.get(timeout=timeout)
+        waited = time.perf_counter() - queued_at
+        self.wait = waited if self.wait is None else self.wait + 0.2 * (waited - self.wait)
+        return item
+
+    def close(self):
+        self.put(None)
+
+    def abort(self):
+        """Discards what is queued and everything put from now on; nothing will read it."""
+        self.aborted = True
+        while self._queue.qsize():
+            self._make_room()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class Stage:
+    """
+    One step of the pipeline. fn(item) returns the item for the next stage, or None to
+    drop it there. When the pipeline runs threaded each stage gets its own worker reading
+    from `inbox`; `pace(busy_seconds)` (optional) is called by the worker after each item
+    and may sleep to throttle the stage. Any bounded queue with get(), qsize() and a
+    `dropped` count can be passed as the inbox, e.g. a FrameRing subscription.
+    """
+
+    def __init__(self, name, fn, maxsize=2, lossy=True, pace=None, inbox=None):
+        self.name = name
+        self.fn = fn
+        self.pace = pace
+        self.inbox = inbox if inbox is not None else DropOldestQueue(maxsize, lossy)
+        self.processed = 0
+        self.latency = None
+        self.max_latency = 0.0
+
+    def process(self, item):
+        start = time.perf_counter()
+        out = self.fn(item)
+        busy = time.perf_counter() - start
+        self.processed += 1
+        self.latency = busy if self.latency is None else self.latency + 0.2 * (busy - self.latency)
+        self.max_latency = max(self.max_latency, busy)
+        return out
+
+    def stats(self):
+        return {
+            'processed': self.processed,
+            'dropped': self.inbox.dropped,
+            'queued': self.inbox.qsize(),
+            'latency_ms': round((self.latency or 0.0) * 1000, 2),
+            'max_latency_ms': round(self.max_latency * 1000, 2),
+            'queue_wait_ms': round((getattr(self.inbox, 'wait', None) or 0.0) * 1000, 2),
+        }
+
+
+class Pipeline:
+    """
+    Chains stages with bounded queues. start() runs every stage on its own daemon thread,
+    with the first stage reading from `source` (any callable returning the next item, or
+    None at the end) or else its own inbox; the end of the stream flows through each
+    stage in turn.
+    run_sync() pushes items through the same stages one at a time on the calling thread,
+    which is deterministic and used for replays.
+    """
+
+    def __init__(self, stages, source=None):
+        self.stages = list(stages)
+        self.source = source
+        self.threads = []
+        self.error = None
+
+    def start(self):
+        for i, stage in enumerate(self.stages):
+            get = self.source if i == 0 and self.source is not None else stage.inbox.get
+            outbox = self.stages[i + 1].inbox if i + 1 < len(self.stages) else None
+            thread = threading.Thread(target=self._work, args=(stage, get, outbox),
+                                      name=f"pipeline-{stage.name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def _work(self, stage, get, outbox):
+        try:
+            while True:
+                item = get()
+                if item is None or self.error is not None:
+                    break
+                start = time.perf_counter()
+                out = stage.process(item)
+                if out is not None and outbox is not None:
+                    outbox.put(out)
+                if stage.pace is not None:
+                    stage.pace(time.perf_counter() - start)
+        except Exception as e:
+            # downstream stages drain and stop, upstream ones stop at their next item and
+            # must not block handing it (or the end marker) to this stage
+            self.error = e
+            abort = getattr(stage.inbox, 'abort', None)
+            if abort is not None:
+                abort()
+            raise
+        finally:
+            if outbox is not None:
+                outbox.close()
+
+    def join(self, timeout=None, error_timeout=5.0):
+        """
+        Waits up to timeout seconds (None: until the stream ends) for every stage to finish.
+        Once a stage has failed the others get error_timeout seconds to wind down, since one
+        blocked on its source may not notice for a while, and then the stage's error is raised.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        failed_at = None
+        for thread in self.threads:
+            while thread.is_alive():
+                now = time.monotonic()
+                if self.error is not None:
+                    failed_at = failed_at or now
+                    if now - failed_at >= error_timeout:
+                        break
+                if deadline is not None and now >= deadline:
+                    break
+                thread.join(0.05)
+        if self.error is not None:
+            raise self.error
+
+    def run_sync(self, items):
+        """Yields what the last stage returns for each item."""
+        for item in items:
+            for stage in self.stages:
+                item = stage.process(item)
+                if item is None:
+                    break
+            else:
+                yield item
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
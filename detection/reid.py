@@ -0,0 +1,97 @@
+import numpy as np
+from django.utils import timezone
+from .tracking import assign
+
+
+class ReIDGallery:
+    """
+    Appearance features of recently exited sessions, held as one contiguous float32 matrix.
+    Rows are stored mean-centred and unit-length, so a single matrix product gives the same
+    Pearson correlation as cv2.compareHist(..., HISTCMP_CORREL) for every detection/candidate
+    pair. Entries older than max_seconds_away are dropped on each match.
+    """
+
+    def __init__(self, max_seconds_away=300, threshold=0.75, capacity=64):
+        self.max_seconds_away = max_seconds_away
+        self.threshold = threshold
+        self._matrix = None
+        self._exited = np.zeros(capacity, dtype=np.float64)
+        self._sessions = []
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def normalise(features):
+        m = np.asarray(features, dtype=np.float32)
+        m = m - m.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        np.divide(m, norms, out=m, where=norms > 0)  # a flat histogram stays all-zero
+        return m
+
+    def load(self, PersonSession, now=None):
+        """Seeds the gallery with sessions that exited within the window."""
+        now = now or timezone.now()
+        recent = PersonSession.objects.filter(
+            exit_timestamp__gte=now - timezone.timedelta(seconds=self.max_seconds_away),
+            appearance_feature__isnull=False
+        )
+        for session in recent:
+            self.add(session, session.appearance_feature, session.exit_timestamp)
+        return self
+
+    def add(self, session, feature, exited_at):
+        if feature is None or len(feature) == 0:
+            return
+        row = self.normalise([feature])[0]
+        n = len(self._sessions)
+        if self._matrix is None:
+            self._matrix = np.zeros((len(self._exited), row.size), dtype=np.float32)
+        elif row.size != self._matrix.shape[1]:
+            return
+        if n == len(self._matrix):
+            self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+            self._exited = np.concatenate([self._exited, np.zeros_like(self._exited)])
+        self._matrix[n] = row
+        self._exited[n] = exited_at.timestamp()
+        self._sessions.append(session)
+
+    def _keep(self, mask):
+        n = len(self._sessions)
+        keep = np.flatnonzero(mask)
+        if len(keep) == n:
+            return
+        self._matrix[:len(keep)] = self._matrix[keep]
+        self._exited[:len(keep)] = self._exited[keep]
+        self._sessions = [self._sessions[i] for i in keep]
+
+    def discard(self, session):
+        mask = np.array([s is not session for s in self._sessions], dtype=bool)
+        if not mask.all():
+            self._keep(mask)
+
+    def expire(self, now=None):
+        now = now or timezone.now()
+        if self._sessions:
+            cutoff = now.timestamp() - self.max_seconds_away
+            self._keep(self._exited[:len(self._sessions)] >= cutoff)
+
+    def match(self, features, now=None):
+        """
+        Scores every feature (None for detections without one) against the whole gallery in
+        one product and returns the matched session per feature, or None. Pairs are assigned
+        greedily from the highest correlation down, so two detections never claim one session.
+        """
+        self.expire(now)
+        matches = [None] * len(features)
+        rows = [i for i, f in enumerate(features) if f is not None and len(f) == self._width()]
+        if not rows or not self._sessions:
+            return matches
+        n = len(self._sessions)
+        scores = self.normalise([features[i] for i in rows]) @ self._matrix[:n].T
+        for r, c in assign(scores, self.threshold, optimal=False).items():
+            matches[rows[r]] = self._sessions[c]
+        return matches
+
+    def _width(self):
+        return None if self._matrix is None else self._matrix.shape[1]
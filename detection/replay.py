@@ -0,0 +1,95 @@
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+from . import detection_module
+from .broadcast import FrameRing
+from .metrics import metrics
+from .motion import MotionGate
+
+
+def replay(clip, motion_gating=True, max_skip_seconds=None, annotate=False, warmup=1):
+    """
+    Drives a recorded clip through the same stages as live detection - detect, track,
+    render and session bookkeeping - one frame at a time on the calling thread and as fast
+    as possible. Each frame keeps its recorded capture time, so motion gating, session
+    timestamps and write batching (one flush per second of clip) come out the same on
+    every run. Sessions are written to whatever database is active; replay_clip points
+    that at a throwaway one.
+
+    Returns a JSON-ready dict: throughput, per-stage latency percentiles, DB queries per
+    frame (flushes run inline here, so they are included) and per writer flush, and a digest
+    of every frame's tracks, which changes when detection output does.
+    """
+    from .models import PersonSession
+    from .sessions import QueryCounter, SessionRegistry, SessionWriter
+    if max_skip_seconds is None:
+        max_skip_seconds = detection_module.MOTION_MAX_SKIP_SECONDS
+
+    engine = detection_module.get_engine()
+    first = clip.frame(0)
+    for _ in range(warmup):
+        engine.detect(first)  # model load and first-call overhead stay out of the timings
+    detection_module.reset_track_ids()
+    metrics.reset()
+
+    ring = FrameRing(1)
+    producer = detection_module.FrameProducer(
+        ring, motion_gate=MotionGate(max_skip_seconds=max_skip_seconds) if motion_gating else None
+    )
+    writer = SessionWriter(PersonSession)
+    start_time = datetime.fromtimestamp(clip.timestamps[0], tz=dt_timezone.utc)
+    registry = SessionRegistry(PersonSession, writer).load(now=start_time)
+    flush_every = max(1, round(writer.flush_interval * clip.fps)) if clip.fps else 1
+
+    def frames():
+        for index in range(len(clip)):
+            with metrics.timer('capture'):
+                frame = clip.frame(index)
+            yield datetime.fromtimestamp(clip.timestamps[index], tz=dt_timezone.utc), frame
+
+    digest = hashlib.sha1()
+    queries = 0
+    viewer = ring.subscribe(viewer=True) if annotate else None
+    started = time.perf_counter()
+    for index, packet in enumerate(producer.run_sync(frames())):
+        with QueryCounter() as counter:
+            with metrics.timer('sessions'):
+                registry.update(packet.frame, packet.track_list, now=packet.timestamp)
+            if (index + 1) % flush_every == 0 or writer._queue.qsize() >= writer.batch_size:
+                writer.flush()
+        queries += counter.count
+        digest.update(repr([(t['track_id'], t['bbox']) for t in packet.track_list]).encode())
+        if viewer is not None:
+            viewer.get(timeout=0)
+    with QueryCounter() as counter:
+        writer.flush()
+    queries += counter.count
+    elapsed = time.perf_counter() - started
+    if viewer is not None:
+        viewer.close()
+
+    count = len(clip)
+    snapshot = metrics.snapshot()
+    snapshot['timings'].pop('end_to_end', None)  # measured against the recording's wall clock
+    height, width = first.shape[:2]
+    return {
+        'clip': {'frames': count, 'width': width, 'height': height,
+                 'fps': round(clip.fps, 2) if clip.fps else None},
+        'config': {
+            'model_size': detection_module.MODEL_SIZE,
+            'backend': detection_module.MODEL_BACKEND,
+            'precision': detection_module.MODEL_PRECISION,
+            'imgsz': detection_module.INPUT_SIZE,
+            'motion_gating': motion_gating,
+            'annotate': annotate,
+        },
+        'wall_seconds': round(elapsed, 3),
+        'fps': round(count / elapsed, 2) if elapsed else None,
+        'skipped_frames': producer.motion_gate.skipped if producer.motion_gate else 0,
+        'db_queries_per_frame': round(queries / float(count), 3),
+        'db_queries_per_flush': writer.stats()['db_queries_per_flush'],
+        'sessions': PersonSession.objects.count(),
+        'tracks_digest': digest.hexdigest(),
+        'timings': snapshot['timings'],
+        'counters': snapshot['counters'],
+    }
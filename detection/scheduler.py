@@ -0,0 +1,59 @@
+import time
+
+
+class FrameScheduler:
+    """
+    Paces the frame producer instead of looping flat out.
+
+    Aims for target_fps, but never lets inference use more than cpu_budget of
+    wall-clock time (so Django threads in the same process keep getting CPU):
+    when per-frame latency rises the interval stretches to latency / cpu_budget.
+    When the number of people in view changes, it bursts towards max_fps for
+    burst_seconds so arrivals and departures are picked up quickly.
+    """
+
+    def __init__(self, target_fps=5.0, cpu_budget=0.5, max_fps=15.0, burst_seconds=5.0, smoothing=0.3):
+        self.target_fps = target_fps
+        self.cpu_budget = cpu_budget
+        self.max_fps = max(max_fps, target_fps)
+        self.burst_seconds = burst_seconds
+        self.smoothing = smoothing
+        self.latency = None
+        self.achieved_fps = 0.0
+        self._last_count = None
+        self._burst_until = 0.0
+        self._last_frame_at = None
+
+    def _ema(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+
+    def current_fps(self, now):
+        return self.max_fps if now < self._burst_until else self.target_fps
+
+    def frame_done(self, busy_seconds, track_count, now=None):
+        """
+        Records one processed frame that kept the CPU busy for busy_seconds
+        and returns how long to sleep before starting the next one.
+        """
+        now = time.monotonic() if now is None else now
+        if self._last_frame_at is not None and now > self._last_frame_at:
+            self.achieved_fps = self._ema(self.achieved_fps or None, 1.0 / (now - self._last_frame_at))
+        self._last_frame_at = now
+        self.latency = self._ema(self.latency, busy_seconds)
+        if self._last_count is not None and track_count != self._last_count:
+            self._burst_until = now + self.burst_seconds
+        self._last_count = track_count
+
+        interval = max(1.0 / self.current_fps(now), self.latency / self.cpu_budget)
+        return max(0.0, interval - busy_seconds)
+
+    def wait(self, busy_seconds, track_count):
+        time.sleep(self.frame_done(busy_seconds, track_count))
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'target_fps': self.current_fps(now),
+            'achieved_fps': round(self.achieved_fps, 2),
+            'latency_ms': round((self.latency or 0.0) * 1000, 1),
+        }
@@ -0,0 +1,268 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from django.db import connection, transaction
+from django.utils import timezone
+from . import detection_module
+from .detection_module import extract_appearance_feature
+from .reid import ReIDGallery
+from .metrics import metrics
+from .signals import sessions_written
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter:
+    """Counts the SQL statements run on the default connection while active."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._wrapper.__exit__(*exc)
+
+
+class SessionWriter:
+    """
+    Write-behind for PersonSession changes. The detection thread queues creates and
+    field updates; a background thread applies them with bulk_create/bulk_update once
+    batch_size events are pending or flush_interval seconds have passed, so a slow
+    SQLite lock never stalls inference.
+
+    Each batch is written in one transaction, together with whatever listens to
+    sessions_written (the dashboard's hourly rollups). If it fails, the error is logged and
+    the batch retried on the next flush; after max_retries failures in a row it is written
+    one session at a time, and sessions that still fail are set aside in `quarantined` so
+    one bad row can't hold up every later write. stop() (also registered with atexit while
+    the thread runs) drains the queue and flushes.
+    """
+
+    def __init__(self, PersonSession, batch_size=50, flush_interval=1.0, max_retries=3, quarantine_size=1000):
+        self.PersonSession = PersonSession
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.flushes = 0
+        self.written = 0
+        self.queries = 0
+        self.failures = 0
+        self.last_error = None
+        self.quarantined = deque(maxlen=quarantine_size)
+        self._retries = 0
+        self._queue = queue.Queue()
+        self._creates = []
+        self._updates = {}
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self.thread = None
+
+    def create(self, session):
+        self._queue.put(('create', session, None))
+
+    def update(self, session, **fields):
+        self._queue.put(('update', session, fields))
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self._stop.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            atexit.unregister(self.stop)  # once per writer, however often it is restarted
+            atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        atexit.unregister(self.stop)
+        self._stop.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                deadline = time.monotonic() + self.flush_interval
+                while self._queue.qsize() < self.batch_size and not self._stop.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._stop.wait(min(remaining, 0.05))
+                if self._stop.is_set():
+                    break  # stop() makes the final flush once this thread has finished
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Session writer flush failed")
+        finally:
+            connection.close()
+
+    def _drain(self):
+        while True:
+            try:
+                kind, session, fields = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if kind == 'create':
+                self._creates.append(session)
+                continue
+            for name, value in fields.items():
+                setattr(session, name, value)
+            if session.pk is not None:
+                self._updates.setdefault(id(session), (session, set()))[1].update(fields)
+            # unsaved sessions pick the new values up when they are created
+
+    def flush(self):
+        """Writes everything pending; returns how many sessions were written."""
+        with self._flush_lock:
+            self._drain()
+            if not self._creates and not self._updates:
+                return 0
+            creates = list(self._creates)
+            updates = list(self._updates.values())
+            try:
+                written = self._write(creates, updates)
+            except Exception as e:
+                self._retries += 1
+                self._failed(e, creates)
+                logger.exception("Writing %d sessions failed (attempt %d of %d)",
+                                 len(creates) + len(updates), self._retries, self.max_retries)
+                if self._retries < self.max_retries:
+                    return 0
+                written = self._write_each(creates, updates)
+            self._creates = []
+            self._updates = {}
+            self._retries = 0
+            return written
+
+    def _write(self, creates, updates):
+        with metrics.timer('db_write'), QueryCounter() as counter, transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                self.PersonSession.objects.bulk_create(creates)
+            else:
+                # later updates need the primary key, so fall back to one insert per row
+                for session in creates:
+                    session.save(force_insert=True)
+            if updates:
+                fields = sorted(set().union(*(f for _, f in updates)))
+                self.PersonSession.objects.bulk_update([s for s, _ in updates], fields)
+            sessions_written.send(sender=self.PersonSession, sessions=creates + [s for s, _ in updates])
+        self.flushes += 1
+        self.written += len(creates) + len(updates)
+        self.queries += counter.count
+        return len(creates) + len(updates)
+
+    def _write_each(self, creates, updates):
+        """Writes a batch that keeps failing one session at a time, quarantining the ones that fail."""
+        written = 0
+        for session, batch in [(s, ([s], [])) for s in creates] + [(u[0], ([], [u])) for u in updates]:
+            try:
+                written += self._write(*batch)
+            except Exception as e:
+                self._failed(e, batch[0])
+                self.quarantined.append(session)
+                logger.exception("Quarantined session %s after repeated write failures", session.track_id)
+        return written
+
+    def _failed(self, error, creates):
+        self.failures += 1
+        self.last_error = repr(error)
+        for session in creates:
+            # the transaction was rolled back, so any primary key bulk_create handed out is gone
+            session.pk = None
+            session._state.adding = True
+
+    def stats(self):
+        return {
+            'pending_writes': self._queue.qsize(),
+            'session_flushes': self.flushes,
+            'sessions_written': self.written,
+            'db_queries_per_flush': round(self.queries / float(self.flushes), 3) if self.flushes else 0.0,
+            'write_failures': self.failures,
+            'quarantined_sessions': len(self.quarantined),
+            'last_write_error': self.last_error,
+        }
+
+
+class SessionRegistry:
+    """
+    Open PersonSessions keyed by track ID, loaded from the database once when detection starts.
+    Per-frame bookkeeping is done against this dict and returning people are matched against
+    an in-memory ReIDGallery of recent exits, so steady-state frames never read the database;
+    all writes go through the SessionWriter.
+    """
+
+    def __init__(self, PersonSession, writer=None, gallery=None):
+        self.PersonSession = PersonSession
+        self.writer = writer or SessionWriter(PersonSession)
+        self.gallery = gallery or ReIDGallery(
+            detection_module.REID_MAX_SECONDS_AWAY, detection_module.REID_SIMILARITY_THRESHOLD
+        )
+        self.open = {}
+        self.features = {}
+
+    def load(self, now=None):
+        self.open = {
+            s.track_id: s
+            for s in self.PersonSession.objects.filter(exit_timestamp__isnull=True).order_by('enter_timestamp')
+        }
+        self.features = {tid: s.appearance_feature for tid, s in self.open.items()}
+        self.gallery.load(self.PersonSession, now)
+        return self
+
+    def update(self, frame, track_list, now=None):
+        now = now or timezone.now()
+        current = {t['track_id']: t for t in track_list}
+        arrivals = [tid for tid in current if tid not in self.open]
+        if arrivals:
+            with metrics.timer('reid'):
+                features = [extract_appearance_feature(frame, current[tid]['bbox']) for tid in arrivals]
+                matches = self.gallery.match(features, now)
+            metrics.inc('reid_hits', sum(m is not None for m in matches))
+            for track_id, feature, matched in zip(arrivals, features, matches):
+                self.open[track_id] = self._enter(track_id, feature, matched, now)
+        for track_id in [tid for tid in self.open if tid not in current]:
+            self._exit(track_id, self.open.pop(track_id), now)
+
+    def _enter(self, track_id, feature, matched, now):
+        self.features[track_id] = feature
+        if matched:
+            # Same person returning — re-open the existing session under the new tracker ID
+            # so they aren't counted as a new arrival and their original enter time is kept.
+            self.gallery.discard(matched)
+            fields = {'track_id': track_id, 'exit_timestamp': None, 'duration_seconds': None, 'active': True}
+            if feature is not None:
+                fields['appearance_feature'] = feature
+            self.writer.update(matched, **fields)
+            return matched
+        session = self.PersonSession(track_id=track_id, enter_timestamp=now, appearance_feature=feature)
+        self.writer.create(session)
+        return session
+
+    def _exit(self, track_id, session, now):
+        self.gallery.add(session, self.features.pop(track_id, None), now)
+        # enter_timestamp never changes after the session is handed to the writer
+        self.writer.update(
+            session,
+            exit_timestamp=now,
+            duration_seconds=(now - session.enter_timestamp).total_seconds(),
+            active=False,
+        )
+
+    def stats(self):
+        # the detection thread itself doesn't query; the writer's flushes are the DB cost
+        return dict({
+            'open_sessions': len(self.open),
+            'reid_gallery': len(self.gallery),
+        }, **self.writer.stats())
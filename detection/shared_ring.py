@@ -0,0 +1,193 @@
+import os
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+SHM_NAME = 'smart_patient_flow_frames'
+SLOTS = 4
+SLOT_BYTES = 1 << 20          # an annotated 1080p JPEG is typically 150-400 KB
+READER_TIMEOUT = 2.0          # seconds since the last read before the writer stops encoding for readers
+_MAGIC = 0x53504652494E47     # marks a block that has been fully initialised
+_HEADER_BYTES = 128
+_created = set()              # blocks this process owns and the resource tracker should keep tracking
+
+
+def _data_offset(slots):
+    meta_end = _HEADER_BYTES + slots * 24      # per slot: uint64 version, uint64 size, float64 timestamp
+    return (meta_end + 63) // 64 * 64
+
+
+class FrameRingInUse(RuntimeError):
+    """Another live process (a second detection worker) owns the block."""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _owner(shm):
+    """The pid that created an initialised, still open block, else None."""
+    if shm.size < _HEADER_BYTES:
+        return None
+    header = np.ndarray((6,), np.uint64, shm.buf, 0)
+    try:
+        if int(header[0]) != _MAGIC or header[4]:
+            return None
+        return int(header[5])
+    finally:
+        del header
+
+
+def _untrack(shm):
+    """Readers only borrow the block: stop the resource tracker unlinking it when this process exits."""
+    if os.name == 'posix' and shm.name not in _created:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+
+class SharedFrameRing:
+    """
+    The latest few JPEG frames in a named shared-memory block, written by the detection
+    worker and read by any number of web processes without copying through a pipe or file.
+
+    Each slot is guarded by a seqlock: the writer makes the slot's version odd while it
+    copies a frame in and sets it to 2 * frame number when done. A reader copies the bytes
+    out and keeps them only if the version was that even value before and after the copy,
+    so neither side takes a lock and a slow reader can never stall the writer. A slot is
+    reused only `slots` frames later, so a torn read is rare and simply retried.
+    Readers stamp the header each time they poll, which tells the writer whether anyone
+    is watching. The header also records the writer's pid, so a second writer refuses to
+    take over a block whose owner is still running.
+    """
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        buf = shm.buf
+        self._header = np.ndarray((6,), np.uint64, buf, 0)       # magic, slots, slot bytes, latest seq, closed, owner pid
+        self._clock = np.ndarray((1,), np.float64, buf, 64)      # last time a reader polled
+        self.slots, self.slot_bytes = int(self._header[1]), int(self._header[2])
+        self._meta = np.ndarray((self.slots, 2), np.uint64, buf, _HEADER_BYTES)
+        self._times = np.ndarray((self.slots,), np.float64, buf, _HEADER_BYTES + self.slots * 16)
+        self._data = np.ndarray((self.slots, self.slot_bytes), np.uint8, buf, _data_offset(self.slots))
+        self.published = 0
+        self.oversized = 0
+
+    @classmethod
+    def create(cls, name=SHM_NAME, slots=SLOTS, slot_bytes=SLOT_BYTES):
+        size = _data_offset(slots) + slots * slot_bytes
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            existing = shared_memory.SharedMemory(name)
+            owner = _owner(existing)
+            # Windows removes a block with its last handle, so one that exists there is in use
+            if os.name != 'posix' or (owner is not None and owner != os.getpid() and _pid_alive(owner)):
+                _untrack(existing)
+                existing.close()
+                raise FrameRingInUse(f"Shared frame block {name!r} is in use by process {owner}.")
+            # left behind by a worker that was killed; nothing writes to it any more
+            existing.close()
+            existing.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        header = np.ndarray((6,), np.uint64, shm.buf, 0)
+        header[1:] = (slots, slot_bytes, 0, 0, os.getpid())
+        header[0] = _MAGIC
+        del header
+        _created.add(shm.name)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name=SHM_NAME):
+        """Opens the worker's ring, or returns None if it hasn't created one yet."""
+        try:
+            shm = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            return None
+        _untrack(shm)
+        if shm.size < _HEADER_BYTES or int(np.ndarray((1,), np.uint64, shm.buf, 0)[0]) != _MAGIC:
+            shm.close()
+            return None
+        return cls(shm)
+
+    @property
+    def seq(self):
+        return int(self._header[3])
+
+    @property
+    def closed(self):
+        return self._header is None or bool(self._header[4])
+
+    def publish(self, jpeg, timestamp=None):
+        """Returns the frame's sequence number, or None if it is larger than a slot."""
+        size = len(jpeg)
+        if size > self.slot_bytes:
+            self.oversized += 1
+            return None
+        seq = self.seq + 1
+        slot = seq % self.slots
+        meta = self._meta[slot]
+        meta[0] = 2 * seq - 1
+        self._data[slot, :size] = np.frombuffer(jpeg, np.uint8)
+        meta[1] = size
+        self._times[slot] = time.time() if timestamp is None else timestamp
+        meta[0] = 2 * seq
+        self._header[3] = seq
+        self.published += 1
+        return seq
+
+    def read(self, after=0):
+        """(seq, timestamp, jpeg bytes) for the newest frame if it is newer than `after`, else None."""
+        self._clock[0] = time.time()
+        for _ in range(3):
+            seq = self.seq
+            if seq <= after:
+                return None
+            slot = seq % self.slots
+            meta = self._meta[slot]
+            version = int(meta[0])
+            if version != 2 * seq:
+                continue  # already being overwritten with a newer frame
+            size = min(int(meta[1]), self.slot_bytes)
+            timestamp = float(self._times[slot])
+            jpeg = self._data[slot, :size].tobytes()
+            if int(meta[0]) == version:
+                return seq, timestamp, jpeg
+        return None
+
+    def has_readers(self, timeout=READER_TIMEOUT):
+        return time.time() - float(self._clock[0]) < timeout
+
+    def stats(self):
+        return {
+            'published': self.published,
+            'oversized': self.oversized,
+            'slots': self.slots,
+            'slot_kb': self.slot_bytes // 1024,
+            'readers': self.has_readers(),
+        }
+
+    def close(self):
+        """The writer also marks the ring closed and removes the block."""
+        if self._header is None:
+            return
+        if self.owner:
+            self._header[4] = 1
+        # numpy views keep the buffer exported, and SharedMemory refuses to close until they are gone
+        self._header = self._clock = self._meta = self._times = self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent by SessionWriter inside each flush's transaction with sessions=[PersonSession, ...],
+# since bulk_create/bulk_update don't send post_save.
+sessions_written = Signal()
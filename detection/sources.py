@@ -0,0 +1,264 @@
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from django.utils import timezone
+from .metrics import metrics
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+CLIP_EXTENSION = '.npz'
+
+
+class FrameSource:
+    """
+    A source of BGR frames. read() returns the next frame, or None once the source is exhausted.
+    `live` sources (screen, cameras, network streams) produce frames in real time;
+    file sources have a native `fps` they can be paced to. A live source that is
+    `on_demand` is only read when the consumer asks for a frame.
+    """
+    live = True
+    on_demand = True
+    fps = None
+
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ScreenSource(FrameSource):
+    def __init__(self, monitor=1, target_width=640):
+        import mss
+        from .detection_module import capture_screen
+        self._capture = capture_screen
+        self._sct = mss.mss()
+        self.monitor = self._sct.monitors[monitor]
+        self.target_width = target_width
+
+    def read(self):
+        return self._capture(self._sct, self.monitor, target_width=self.target_width)
+
+    def close(self):
+        self._sct.close()
+
+
+class VideoSource(FrameSource):
+    """Video files, camera indexes and stream URLs - anything cv2.VideoCapture can open."""
+    # cameras and streams deliver at their own rate and buffer frames in the driver,
+    # so they are read continuously to stay current
+    on_demand = False
+
+    def __init__(self, target, live=False):
+        self.cap = cv2.VideoCapture(target)
+        if not self.cap.isOpened():
+            raise ValueError(f"Could not open video source {target!r}")
+        self.live = live
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else None
+
+    def read(self):
+        ok, frame = self.cap.read()
+        return frame if ok else None
+
+    def close(self):
+        self.cap.release()
+
+
+class ImageDirectorySource(FrameSource):
+    live = False
+
+    def __init__(self, path, fps=10.0):
+        self.paths = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self.fps = fps
+        self._index = 0
+
+    def read(self):
+        while self._index < len(self.paths):
+            frame = cv2.imread(self.paths[self._index])
+            self._index += 1
+            if frame is not None:
+                return frame
+        return None
+
+
+class ClipWriter:
+    """
+    Records frames into a compact clip for replay: one .npz holding every frame as JPEG
+    bytes back to back, their offsets and their capture times (seconds since the epoch).
+    """
+
+    def __init__(self, path, quality=90):
+        self.path = path if path.endswith(CLIP_EXTENSION) else path + CLIP_EXTENSION
+        self.quality = quality
+        self._jpegs = []
+        self._timestamps = []
+
+    def __len__(self):
+        return len(self._jpegs)
+
+    def add(self, frame, timestamp):
+        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if ok:
+            self._jpegs.append(buf.tobytes())
+            self._timestamps.append(timestamp)
+
+    def close(self):
+        offsets = np.cumsum([0] + [len(j) for j in self._jpegs], dtype=np.int64)
+        np.savez(
+            self.path,
+            jpeg=np.frombuffer(b''.join(self._jpegs), dtype=np.uint8),
+            offsets=offsets,
+            timestamps=np.asarray(self._timestamps, dtype=np.float64),
+        )
+        return self.path
+
+
+class ClipSource(FrameSource):
+    """Plays back a ClipWriter recording, at its recorded frame rate when paced."""
+    live = False
+
+    def __init__(self, path):
+        with np.load(path) as clip:
+            self.jpeg = clip['jpeg']
+            self.offsets = clip['offsets']
+            self.timestamps = clip['timestamps']
+        span = self.timestamps[-1] - self.timestamps[0] if len(self.timestamps) > 1 else 0
+        self.fps = (len(self.timestamps) - 1) / span if span > 0 else None
+        self._index = 0
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def frame(self, index):
+        return cv2.imdecode(self.jpeg[self.offsets[index]:self.offsets[index + 1]], cv2.IMREAD_COLOR)
+
+    def read(self):
+        if self._index >= len(self):
+            return None
+        self._index += 1
+        return self.frame(self._index - 1)
+
+
+def source_factory(spec=None):
+    """
+    Returns a zero-argument callable that opens the source described by `spec`:
+    'screen' or 'screen:N' for monitor N, a camera index such as '0', a stream URL,
+    an image directory, a recorded clip (.npz, see ClipWriter), or a video file path.
+    """
+    spec = str(spec or 'screen')
+    if spec == 'screen' or spec.startswith('screen:'):
+        monitor = int(spec.split(':', 1)[1]) if ':' in spec else 1
+        return lambda: ScreenSource(monitor)
+    if spec.isdigit():
+        return lambda: VideoSource(int(spec), live=True)
+    if '://' in spec:
+        return lambda: VideoSource(spec, live=True)
+    if os.path.isdir(spec):
+        return lambda: ImageDirectorySource(spec)
+    if os.path.isfile(spec) and spec.endswith(CLIP_EXTENSION):
+        return lambda: ClipSource(spec)
+    if os.path.isfile(spec):
+        return lambda: VideoSource(spec, live=False)
+    raise ValueError(f"Unknown frame source {spec!r}")
+
+
+class PrefetchingSource:
+    """
+    Opens a source on a background thread and decodes ahead into a bounded queue,
+    so capture/decode overlaps inference.
+
+    Live sources that are on_demand (the screen) are only captured when the consumer
+    asks for a frame, so capture follows whatever pace the consumer keeps. Other live
+    sources, and file sources replayed in real time, drop the oldest queued frame when
+    the consumer falls behind, like a camera would. With realtime=False a file source is
+    replayed as fast as the consumer can take frames and nothing is dropped.
+    """
+
+    def __init__(self, factory, realtime=True, queue_size=4):
+        self.factory = factory
+        self.realtime = realtime
+        self.dropped = 0
+        self.error = None
+        self.reads = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._wanted = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            source = self.factory()
+        except Exception as e:
+            self.error = e
+            self._put(None, lossy=False)
+            return
+        lossy = source.live or self.realtime
+        pull = source.live and source.on_demand
+        interval = 1.0 / source.fps if self.realtime and not source.live and source.fps else 0
+        next_due = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                if pull:
+                    self._wanted.wait()
+                    self._wanted.clear()
+                    if self._stop.is_set():
+                        break
+                elif interval:
+                    next_due += interval
+                    time.sleep(max(0.0, next_due - time.perf_counter()))
+                with metrics.timer('capture'):
+                    frame = source.read()
+                self.reads += 1
+                if frame is None:
+                    break
+                self._put((timezone.now(), frame), lossy)
+        except Exception as e:
+            self.error = e
+        finally:
+            source.close()
+            self._put(None, lossy=False)
+
+    def _put(self, item, lossy):
+        if lossy:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(self):
+        """Returns (captured_at, frame), or None once the source has ended."""
+        self._wanted.set()
+        item = self._queue.get()
+        if item is None:
+            self._stop.set()
+            if self.error is not None:
+                raise self.error
+        return item
+
+    def close(self):
+        self._stop.set()
+        self._wanted.set()
+        self._put(None, lossy=True)  # wake a consumer blocked in get()
+
+
+def open_source(spec=None, realtime=True, queue_size=4):
+    return PrefetchingSource(source_factory(spec), realtime=realtime, queue_size=queue_size)
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 import numpy as np
@@ -6,7 +6,36 @@ import cv2
 from detection.models import PersonSession
 from django.utils import timezone
 from datetime import timedelta
-from detection.detection_module import compute_iou, extract_appearance_feature
+from detection.detection_module import extract_appearance_feature
+from detection.tracking import TrackingEngine, assign, compute_iou, iou_matrix
+from detection.detection_module import zone_rects, bounding_region
+from detection.broadcast import FrameRing
+from detection.motion import MotionGate
+from detection.scheduler import FrameScheduler
+from detection.sessions import SessionRegistry, SessionWriter
+from detection.reid import ReIDGallery
+from detection.pipeline import DropOldestQueue, Pipeline, Stage
+from detection.sources import ClipSource, ClipWriter, FrameSource, PrefetchingSource, open_source, source_factory
+from detection.replay import replay
+from detection.identity import TrackIdentityManager
+from detection import worker
+from detection.shared_ring import FrameRingInUse, SharedFrameRing
+from detection.metrics import Metrics, RollingHistogram, metrics, prometheus_text
+from dashboard.caching import data_version
+from django.core import serializers
+from django.core.management import call_command
+from django.core.management.base import CommandError
+import io
+import os
+import subprocess
+import sys
+import functools
+import itertools
+import threading
+from types import SimpleNamespace
+import tempfile
+import time
+from unittest import mock
 
 User = get_user_model()
 
@@ -64,13 +93,941 @@ class PersonSessionTests(TestCase):
         )
         self.assertAlmostEqual(session.waiting_time, 600, delta=2)
 
+    def test_appearance_feature_round_trips_as_float16(self):
+        img = np.zeros((100, 100, 3), dtype=np.uint8)
+        cv2.rectangle(img, (30, 30), (70, 70), (0, 255, 0), -1)
+        feature = extract_appearance_feature(img, (20, 20, 80, 80))
+        PersonSession.objects.create(track_id="f", appearance_feature=feature)
+        stored = PersonSession.objects.get(track_id="f").appearance_feature
+        self.assertEqual(stored.dtype, np.float32)
+        self.assertEqual(stored.shape, (512,))
+        np.testing.assert_allclose(stored, feature, atol=1e-3)
+
+    def test_appearance_feature_survives_serialization(self):
+        feature = np.linspace(0, 1, 512, dtype=np.float32)
+        PersonSession.objects.create(track_id="f", appearance_feature=feature)
+        PersonSession.objects.create(track_id="g")
+        data = serializers.serialize('json', PersonSession.objects.all())
+        PersonSession.objects.all().delete()
+        for obj in serializers.deserialize('json', data):
+            obj.save()
+        np.testing.assert_allclose(PersonSession.objects.get(track_id="f").appearance_feature, feature, atol=1e-3)
+        self.assertIsNone(PersonSession.objects.get(track_id="g").appearance_feature)
+
+    def test_benchmark_feature_storage_bypasses_the_dashboard_cache(self):
+        with mock.patch('dashboard.caching.cached') as cached:
+            call_command('benchmark_feature_storage', rows=20, repeat=2, stdout=io.StringIO())
+        cached.assert_not_called()
+        self.assertFalse(PersonSession.objects.exists())
+
 class ZoneResetTests(TestCase):
     def setUp(self):
         self.staff = User.objects.create_user(username="admin", password="admin123", is_staff=True)
         self.client.login(username="admin", password="admin123")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(BASE_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
 
     def test_reset_zone_post(self):
         resp = self.client.post(reverse("reset_detection_zone"))
         self.assertEqual(resp.status_code, 200)
         self.assertJSONEqual(resp.content, {"status": "success", "zone": None})
 
+
+class _StubResult:
+    def __init__(self, data, shape):
+        from ultralytics.engine.results import Boxes
+        self.boxes = Boxes(data, shape)
+
+
+class _StubModel:
+    """Returns the same person boxes for every frame, like a detector on a static scene."""
+    def __init__(self, data):
+        self.data = np.array(data, dtype=np.float32)
+        self.calls = 0
+        self.last_shape = None
+        self.last_imgsz = None
+
+    def __call__(self, frame, **kwargs):
+        self.calls += 1
+        self.last_shape = frame.shape
+        self.last_imgsz = kwargs.get('imgsz')
+        return [_StubResult(self.data, frame.shape[:2])]
+
+
+class StubEngineMixin:
+    """Runs detection_module on a stub detector, with no zones, restoring both after each test."""
+
+    def use_stub_engine(self, boxes):
+        from detection import detection_module
+        self.addCleanup(setattr, detection_module, '_engine', detection_module._engine)
+        self.addCleanup(setattr, detection_module, 'DETECTION_ZONES', detection_module.DETECTION_ZONES)
+        detection_module.DETECTION_ZONES = None
+        stub = _StubModel(boxes)
+        detection_module._engine = TrackingEngine(stub, 'bytetrack.yaml', conf=0.35)
+        return stub
+
+
+class TrackingEngineTests(TestCase):
+    def test_single_inference_per_frame_with_stable_ids(self):
+        stub = _StubModel([[10, 10, 100, 200, 0.9, 0], [200, 10, 300, 200, 0.8, 0]])
+        engine = TrackingEngine(stub, 'bytetrack.yaml', conf=0.35)
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        first = engine.step(frame)
+        second = engine.step(frame)
+        self.assertEqual(stub.calls, 2)
+        self.assertEqual([d['bbox'] for d in second], [[10, 10, 100, 200], [200, 10, 300, 200]])
+        self.assertTrue(all(d['raw_id'] is not None for d in second))
+        self.assertEqual([d['raw_id'] for d in first], [d['raw_id'] for d in second])
+        self.assertNotEqual(second[0]['raw_id'], second[1]['raw_id'])
+
+    def test_region_inference_maps_boxes_back_and_drops_people_outside_zones(self):
+        # boxes are relative to the crop handed to the model
+        stub = _StubModel([[10, 10, 60, 100, 0.9, 0], [220, 10, 280, 100, 0.8, 0]])
+        engine = TrackingEngine(stub, 'bytetrack.yaml', conf=0.35, imgsz=640)
+        frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+        # the second person stands in the gap between the two zones
+        zones = [(100, 200, 300, 600), (400, 200, 500, 600)]
+        dets = engine.step(frame, region=bounding_region(zones), zones=zones)
+        self.assertEqual(stub.last_shape[:2], (400, 400))
+        self.assertEqual(stub.last_imgsz, 160)
+        self.assertEqual([d['bbox'] for d in dets], [[110, 210, 160, 300]])
+
+    def test_empty_frame_returns_no_detections(self):
+        engine = TrackingEngine(_StubModel(np.zeros((0, 6))), 'bytetrack.yaml', conf=0.35)
+        self.assertEqual(engine.step(np.zeros((240, 320, 3), dtype=np.uint8)), [])
+
+
+class DetectionZoneTests(TestCase):
+    def test_zone_rects_scaled_to_frame(self):
+        zones = {"squares": [{"coords": (10, 20, 110, 220)}, {"coords": (300, 0, 200, 50)}],
+                 "origWidth": 320, "origHeight": 240}
+        self.assertEqual(zone_rects((480, 640, 3), zones), [(20, 40, 220, 440), (400, 0, 600, 100)])
+        self.assertEqual(bounding_region(zone_rects((480, 640, 3), zones)), (20, 0, 600, 440))
+
+    def test_no_zones(self):
+        self.assertIsNone(zone_rects((480, 640, 3), None))
+        self.assertIsNone(zone_rects((480, 640, 3), {"squares": [], "origWidth": 1, "origHeight": 1}))
+
+
+class FrameRingTests(TestCase):
+    def test_subscribers_each_receive_published_frames(self):
+        ring = FrameRing(capacity=4)
+        a = ring.subscribe()
+        b = ring.subscribe()
+        ring.publish("f1")
+        ring.publish("f2")
+        self.assertEqual([a.get(timeout=0), a.get(timeout=0)], ["f1", "f2"])
+        self.assertEqual(b.get(timeout=0), "f1")
+        self.assertIsNone(a.get(timeout=0))
+
+    def test_viewer_subscriptions_are_counted(self):
+        ring = FrameRing()
+        worker = ring.subscribe()
+        with ring.subscribe(latest_only=True, viewer=True):
+            self.assertEqual((ring.subscriber_count, ring.viewer_count), (2, 1))
+        self.assertEqual((ring.subscriber_count, ring.viewer_count), (1, 0))
+        worker.close()
+
+    def test_slow_subscriber_drops_instead_of_blocking(self):
+        ring = FrameRing(capacity=3)
+        slow = ring.subscribe()
+        for i in range(10):
+            ring.publish(i)
+        self.assertEqual(slow.get(timeout=0), 7)
+        self.assertEqual(slow.dropped, 7)
+
+    def test_latest_only_skips_to_newest(self):
+        ring = FrameRing(capacity=8)
+        viewer = ring.subscribe(latest_only=True)
+        for i in range(5):
+            ring.publish(i)
+        self.assertEqual(viewer.get(timeout=0), 4)
+
+    def test_close_releases_subscriber(self):
+        ring = FrameRing()
+        with ring.subscribe():
+            self.assertTrue(ring.wait_for_subscribers(timeout=0))
+        self.assertEqual(ring.subscriber_count, 0)
+        self.assertFalse(ring.wait_for_subscribers(timeout=0))
+
+
+class FrameSourceTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def _write_images(self, count):
+        for i in range(count):
+            img = np.full((48, 64, 3), i * 10, dtype=np.uint8)
+            cv2.imwrite(os.path.join(self.tmp.name, f"{i:03d}.png"), img)
+
+    def _read_all(self, source):
+        frames = []
+        while True:
+            item = source.get()
+            if item is None:
+                return frames
+            frames.append(item[1])
+
+    def test_image_directory_fast_replay_keeps_every_frame(self):
+        self._write_images(12)
+        source = open_source(self.tmp.name, realtime=False, queue_size=2)
+        frames = self._read_all(source)
+        self.assertEqual([int(f[0, 0, 0]) for f in frames], [i * 10 for i in range(12)])
+        self.assertEqual(source.dropped, 0)
+
+    def test_live_source_is_only_read_when_a_frame_is_wanted(self):
+        class Live(FrameSource):
+            def read(self):
+                return np.zeros((4, 4, 3), dtype=np.uint8)
+
+        source = PrefetchingSource(Live)
+        self.addCleanup(source.close)
+        for _ in range(5):
+            self.assertIsNotNone(source.get())
+            time.sleep(0.05)  # a slow consumer
+        self.assertEqual(source.reads, 5)
+        self.assertEqual(source.dropped, 0)
+
+    def test_video_file_source(self):
+        path = os.path.join(self.tmp.name, "clip.avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (64, 48))
+        for i in range(5):
+            writer.write(np.full((48, 64, 3), 40 * i, dtype=np.uint8))
+        writer.release()
+        frames = self._read_all(open_source(path, realtime=False))
+        self.assertEqual(len(frames), 5)
+        self.assertEqual(frames[0].shape, (48, 64, 3))
+
+    def test_unknown_source_rejected(self):
+        with self.assertRaises(ValueError):
+            source_factory(os.path.join(self.tmp.name, "missing.mp4"))
+
+    def test_clip_round_trip(self):
+        writer = ClipWriter(os.path.join(self.tmp.name, "clip"), quality=95)
+        for i in range(4):
+            writer.add(np.full((48, 64, 3), i * 60, dtype=np.uint8), 1000.0 + i / 5.0)
+        path = writer.close()
+        self.assertTrue(path.endswith(".npz"))
+        frames = self._read_all(open_source(path, realtime=False))
+        self.assertEqual([int(f[0, 0, 0]) for f in frames], [0, 60, 120, 180])
+        self.assertAlmostEqual(ClipSource(path).fps, 5.0)
+
+    def test_record_clip_command(self):
+        self._write_images(6)
+        out = os.path.join(self.tmp.name, "recorded")
+        call_command('record_clip', out, '--source', self.tmp.name, '--frames', '4', stdout=io.StringIO())
+        self.assertEqual(len(ClipSource(out + ".npz")), 4)
+
+    def test_benchmark_detection_needs_frames_past_warmup(self):
+        self._write_images(3)
+        with self.assertRaisesMessage(CommandError, "need more than --warmup=5"):
+            call_command('benchmark_detection', '--source', self.tmp.name, '--warmup', '5', stdout=io.StringIO())
+
+
+class LazyModelLoadingTests(TestCase):
+    def test_startup_does_not_import_heavy_modules(self):
+        from detection.management.commands.benchmark_startup import SCENARIOS, run_probe
+        for name, body in SCENARIOS:
+            self.assertEqual(run_probe(body)['loaded'], [], name)
+
+    def test_model_not_loaded_by_import(self):
+        from detection import detection_module
+        self.assertFalse(detection_module.model_loaded())
+
+
+class InferenceBackendTests(TestCase):
+    def test_exported_paths_encode_size_precision_and_resolution(self):
+        from detection.backends import exported_path, weights_path
+        self.assertTrue(exported_path('n', 'onnx', 'int8', 416).endswith('yolov8n_416_int8.onnx'))
+        self.assertTrue(exported_path('s', 'openvino', 'fp16', 640).endswith('yolov8s_640_fp16_openvino_model'))
+        self.assertEqual(exported_path('x', 'torch', 'fp32', 640), weights_path('x'))
+
+    def test_invalid_options_rejected(self):
+        from detection.backends import check_options
+        check_options('n', 'onnx', 'int8', 320)
+        for args in [('q', 'onnx', 'fp32', 640), ('n', 'tflite', 'fp32', 640),
+                     ('n', 'torch', 'int8', 640), ('n', 'onnx', 'fp32', 500)]:
+            with self.assertRaises(ValueError):
+                check_options(*args)
+
+
+class MotionGateTests(TestCase):
+    def setUp(self):
+        self.frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        cv2.rectangle(self.frame, (20, 20), (60, 120), (200, 200, 200), -1)
+
+    def test_static_scene_is_skipped_until_max_interval(self):
+        gate = MotionGate(max_skip_seconds=2.0)
+        self.assertTrue(gate.should_infer(self.frame, now=0.0))
+        self.assertFalse(gate.should_infer(self.frame.copy(), now=0.5))
+        self.assertFalse(gate.should_infer(self.frame.copy(), now=1.5))
+        self.assertTrue(gate.should_infer(self.frame.copy(), now=2.1))
+        self.assertEqual((gate.frames, gate.skipped), (4, 2))
+        self.assertAlmostEqual(gate.skip_ratio, 0.5)
+
+    def test_movement_triggers_inference(self):
+        gate = MotionGate()
+        gate.should_infer(self.frame, now=0.0)
+        moved = np.zeros_like(self.frame)
+        cv2.rectangle(moved, (150, 20), (190, 120), (200, 200, 200), -1)
+        self.assertTrue(gate.should_infer(moved, now=0.1))
+
+    def test_movement_outside_region_is_ignored(self):
+        gate = MotionGate()
+        region = (200, 0, 320, 240)
+        gate.should_infer(self.frame, region=region, now=0.0)
+        moved = self.frame.copy()
+        cv2.rectangle(moved, (20, 130), (60, 230), (255, 255, 255), -1)
+        self.assertFalse(gate.should_infer(moved, region=region, now=0.1))
+
+
+class FrameSchedulerTests(TestCase):
+    def test_paces_to_target_fps(self):
+        scheduler = FrameScheduler(target_fps=5.0, cpu_budget=0.5, max_fps=15.0)
+        self.assertAlmostEqual(scheduler.frame_done(0.05, 2, now=0.0), 0.15)
+
+    def test_backs_off_when_inference_slows(self):
+        scheduler = FrameScheduler(target_fps=5.0, cpu_budget=0.5, max_fps=15.0, smoothing=1.0)
+        # 0.4s per frame at a 50% budget means one frame every 0.8s
+        self.assertAlmostEqual(scheduler.frame_done(0.4, 2, now=0.0), 0.4)
+
+    def test_bursts_while_occupancy_changes(self):
+        scheduler = FrameScheduler(target_fps=2.0, cpu_budget=1.0, max_fps=10.0, burst_seconds=5.0)
+        self.assertAlmostEqual(scheduler.frame_done(0.01, 1, now=0.0), 0.49)
+        self.assertAlmostEqual(scheduler.frame_done(0.01, 3, now=0.5), 0.09)
+        self.assertEqual(scheduler.current_fps(4.0), 10.0)
+        self.assertEqual(scheduler.current_fps(6.0), 2.0)
+
+    def test_reports_achieved_fps(self):
+        scheduler = FrameScheduler(smoothing=1.0)
+        scheduler.frame_done(0.01, 0, now=0.0)
+        scheduler.frame_done(0.01, 0, now=0.25)
+        self.assertAlmostEqual(scheduler.achieved_fps, 4.0)
+
+
+class SessionRegistryTests(TestCase):
+    def setUp(self):
+        self.frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        cv2.rectangle(self.frame, (10, 10), (60, 120), (0, 0, 255), -1)
+        cv2.rectangle(self.frame, (200, 10), (260, 120), (255, 0, 0), -1)
+        self.alice = {'track_id': '1', 'bbox': [10, 10, 60, 120], 'confidence': 0.9}
+        self.bob = {'track_id': '2', 'bbox': [200, 10, 260, 120], 'confidence': 0.9}
+
+    def test_loads_open_sessions_once(self):
+        PersonSession.objects.create(track_id="1", enter_timestamp=timezone.now())
+        PersonSession.objects.create(track_id="9", enter_timestamp=timezone.now(), exit_timestamp=timezone.now())
+        registry = SessionRegistry(PersonSession).load()
+        self.assertEqual(list(registry.open), ["1"])
+
+    def test_steady_frames_do_not_touch_the_database(self):
+        registry = SessionRegistry(PersonSession).load()
+        registry.update(self.frame, [self.alice, self.bob])
+        registry.writer.flush()
+        self.assertEqual(PersonSession.objects.filter(exit_timestamp__isnull=True).count(), 2)
+        with self.assertNumQueries(0):
+            for _ in range(5):
+                registry.update(self.frame, [self.alice, self.bob])
+
+    def test_departure_closes_session(self):
+        registry = SessionRegistry(PersonSession).load()
+        start = timezone.now()
+        registry.update(self.frame, [self.alice, self.bob], now=start)
+        registry.writer.flush()
+        with self.assertNumQueries(0):
+            registry.update(self.frame, [self.alice], now=start + timedelta(seconds=30))
+        registry.writer.flush()
+        closed = PersonSession.objects.get(track_id="2")
+        self.assertEqual(closed.duration_seconds, 30)
+        self.assertFalse(closed.active)
+        self.assertEqual(registry.stats()['open_sessions'], 1)
+
+    def test_returning_person_reopens_their_session(self):
+        registry = SessionRegistry(PersonSession).load()
+        start = timezone.now()
+        registry.update(self.frame, [self.alice], now=start)
+        registry.update(self.frame, [], now=start + timedelta(seconds=5))
+        registry.writer.flush()
+        returning = dict(self.alice, track_id='7')
+        registry.update(self.frame, [returning], now=start + timedelta(seconds=10))
+        registry.writer.flush()
+        self.assertEqual(PersonSession.objects.count(), 1)
+        session = PersonSession.objects.get()
+        self.assertEqual(session.track_id, '7')
+        self.assertIsNone(session.exit_timestamp)
+
+
+class SessionWriterTests(TestCase):
+    def test_batches_creates_and_updates_in_one_flush(self):
+        writer = SessionWriter(PersonSession)
+        start = timezone.now()
+        sessions = [PersonSession(track_id=str(i), enter_timestamp=start) for i in range(10)]
+        for s in sessions:
+            writer.create(s)
+        writer.update(sessions[0], exit_timestamp=start + timedelta(seconds=4), duration_seconds=4.0, active=False)
+        self.assertEqual(PersonSession.objects.count(), 0)
+        data_version()  # creates the dashboard's version row, as the first write ever would
+        # savepoint, one insert, the hour's rollup (read, upsert), the data version bump, release
+        with self.assertNumQueries(6):
+            self.assertEqual(writer.flush(), 10)
+        self.assertEqual(writer.stats()['db_queries_per_flush'], 6)
+        closed = PersonSession.objects.get(track_id='0')
+        self.assertEqual(closed.duration_seconds, 4.0)
+        self.assertEqual(PersonSession.objects.filter(exit_timestamp__isnull=True).count(), 9)
+
+    def test_updates_saved_sessions_with_the_event_timestamp(self):
+        writer = SessionWriter(PersonSession)
+        start = timezone.now() - timedelta(hours=1)
+        session = PersonSession.objects.create(track_id='1', enter_timestamp=start)
+        writer.update(session, exit_timestamp=start + timedelta(seconds=90), duration_seconds=90.0, active=False)
+        writer.flush()
+        session.refresh_from_db()
+        self.assertEqual(session.exit_timestamp, start + timedelta(seconds=90))
+        self.assertFalse(session.active)
+
+    def test_poison_batch_is_retried_then_quarantined(self):
+        writer = SessionWriter(PersonSession, max_retries=2)
+        writer.create(PersonSession(track_id='1', enter_timestamp=timezone.now()))
+        writer.create(PersonSession(track_id='bad', enter_timestamp=None))
+        with self.assertLogs('detection.sessions', 'ERROR'):
+            self.assertEqual(writer.flush(), 0)
+        self.assertEqual(PersonSession.objects.count(), 0)
+        with self.assertLogs('detection.sessions', 'ERROR') as logs:
+            self.assertEqual(writer.flush(), 1)
+        self.assertIn("Quarantined session bad", logs.output[-1])
+        self.assertEqual(list(PersonSession.objects.values_list('track_id', flat=True)), ['1'])
+        stats = writer.stats()
+        self.assertEqual((stats['write_failures'], stats['quarantined_sessions']), (3, 1))
+        self.assertIn('IntegrityError', stats['last_write_error'])
+        # later writes are no longer held up
+        writer.create(PersonSession(track_id='2', enter_timestamp=timezone.now()))
+        self.assertEqual(writer.flush(), 1)
+
+    def test_restarts_register_one_exit_handler(self):
+        handlers = []
+
+        def unregister(fn):
+            handlers[:] = [h for h in handlers if h != fn]
+
+        writer = SessionWriter(PersonSession, flush_interval=0.01)
+        with mock.patch('detection.sessions.atexit') as fake_atexit:
+            fake_atexit.register.side_effect = handlers.append
+            fake_atexit.unregister.side_effect = unregister
+            writer.start()
+            self.assertEqual(handlers, [writer.stop])
+            writer.stop()
+            writer.start()
+            writer.start()
+            self.assertEqual(handlers, [writer.stop])
+            writer.stop()
+        self.assertEqual(handlers, [])
+
+    def test_stop_flushes_pending_events(self):
+        writer = SessionWriter(PersonSession, flush_interval=60).start()
+        writer.create(PersonSession(track_id='1', enter_timestamp=timezone.now()))
+        writer.stop()
+        self.assertFalse(writer.thread.is_alive())
+        self.assertEqual(PersonSession.objects.count(), 1)
+
+
+class ReIDGalleryTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.features = rng.random((5, 512)).astype(np.float32)
+        self.now = timezone.now()
+
+    def test_scores_match_compare_hist(self):
+        a, b = self.features[0], self.features[1]
+        expected = cv2.compareHist(a, b, cv2.HISTCMP_CORREL)
+        got = float(ReIDGallery.normalise([a])[0] @ ReIDGallery.normalise([b])[0])
+        self.assertAlmostEqual(got, expected, places=4)
+
+    def test_each_session_is_claimed_once(self):
+        gallery = ReIDGallery(threshold=0.75)
+        sessions = ['first', 'second']
+        for name, feature in zip(sessions, self.features[:2]):
+            gallery.add(name, feature.tolist(), self.now)
+        noisy = self.features[0] + np.random.default_rng(1).normal(0, 0.02, 512).astype(np.float32)
+        matches = gallery.match([self.features[0].tolist(), noisy.tolist(), None, self.features[1].tolist()], self.now)
+        self.assertEqual(matches, ['first', None, None, 'second'])
+
+    def test_old_exits_expire(self):
+        gallery = ReIDGallery(max_seconds_away=60)
+        gallery.add('old', self.features[0].tolist(), self.now - timedelta(seconds=120))
+        gallery.add('recent', self.features[1].tolist(), self.now - timedelta(seconds=10))
+        self.assertEqual(gallery.match([self.features[0].tolist()], self.now), [None])
+        self.assertEqual(len(gallery), 1)
+        gallery.discard('recent')
+        self.assertEqual(len(gallery), 0)
+
+    def test_grows_past_initial_capacity(self):
+        gallery = ReIDGallery(capacity=2)
+        for i, feature in enumerate(self.features):
+            gallery.add(i, feature.tolist(), self.now)
+        self.assertEqual(gallery.match([self.features[4].tolist()], self.now), [4])
+
+    def test_registry_reidentifies_without_queries(self):
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        cv2.rectangle(frame, (10, 10), (60, 120), (0, 0, 255), -1)
+        person = {'track_id': '1', 'bbox': [10, 10, 60, 120], 'confidence': 0.9}
+        registry = SessionRegistry(PersonSession).load()
+        registry.update(frame, [person], now=self.now)
+        registry.update(frame, [], now=self.now + timedelta(seconds=5))
+        with self.assertNumQueries(0):
+            registry.update(frame, [dict(person, track_id='7')], now=self.now + timedelta(seconds=10))
+        registry.writer.flush()
+        self.assertEqual(PersonSession.objects.get().track_id, '7')
+
+
+class AssociationTests(TestCase):
+    def test_iou_matrix_matches_scalar_iou(self):
+        a = [[0, 0, 10, 10], [5, 5, 15, 15]]
+        b = [[5, 5, 15, 15], [20, 20, 30, 30], [0, 0, 10, 10]]
+        m = iou_matrix(a, b)
+        self.assertEqual(m.shape, (2, 3))
+        for i, box_a in enumerate(a):
+            for j, box_b in enumerate(b):
+                self.assertAlmostEqual(m[i, j], compute_iou(box_a, box_b), places=5)
+
+    def test_two_detections_never_claim_one_track(self):
+        # both detections overlap track 0 best; the second should fall back to track 1
+        scores = np.array([[0.9, 0.0], [0.8, 0.6]])
+        for optimal in (True, False):
+            self.assertEqual(assign(scores, 0.3, optimal=optimal), {0: 0, 1: 1})
+
+    def test_assignment_respects_threshold(self):
+        scores = np.array([[0.2, 0.1], [0.0, 0.5]])
+        for optimal in (True, False):
+            self.assertEqual(assign(scores, 0.3, optimal=optimal), {1: 1})
+        self.assertEqual(assign(np.zeros((0, 3)), 0.3), {})
+
+
+class FrameAllocationTests(StubEngineMixin, TestCase):
+    def setUp(self):
+        from detection import detection_module
+        self.dm = detection_module
+        self.use_stub_engine([[100, 100, 300, 600, 0.9, 0], [900, 100, 1100, 600, 0.8, 0]])
+        self.frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+
+    def peak_allocation(self, annotate):
+        import tracemalloc
+        self.dm.detect_and_track(self.frame, annotate=annotate)  # warm up tracker state
+        tracemalloc.start()
+        try:
+            annotated, tracks = self.dm.detect_and_track(self.frame, annotate=annotate)
+            return tracemalloc.get_traced_memory()[1], annotated, tracks
+        finally:
+            tracemalloc.stop()
+
+    def test_unwatched_frames_are_not_copied_or_annotated(self):
+        peak, annotated, tracks = self.peak_allocation(annotate=False)
+        self.assertIsNone(annotated)
+        self.assertEqual(len(tracks), 2)
+        self.assertLess(peak, self.frame.nbytes // 10)
+
+    def test_watched_frames_are_copied_once(self):
+        peak, annotated, _ = self.peak_allocation(annotate=True)
+        self.assertGreater(annotated.sum(), 0)
+        self.assertFalse(self.frame.any())
+        self.assertLess(peak, 2 * self.frame.nbytes)
+
+    def test_screen_capture_downscales_before_colour_conversion(self):
+        from mss.screenshot import ScreenShot
+        from detection.detection_module import capture_screen
+        monitor = {'left': 0, 'top': 0, 'width': 1920, 'height': 1080}
+
+        class FakeGrabber:
+            def grab(self, mon):
+                return ScreenShot(bytearray(4 * 1920 * 1080), mon)
+
+        img = capture_screen(FakeGrabber(), monitor, target_width=640)
+        self.assertEqual(img.shape, (360, 640, 3))
+        self.assertEqual(capture_screen(FakeGrabber(), monitor, target_width=None).shape, (1080, 1920, 3))
+
+
+class PipelineTests(StubEngineMixin, TestCase):
+    def test_lossy_queue_drops_oldest(self):
+        q = DropOldestQueue(maxsize=2)
+        for i in range(5):
+            q.put(i)
+        self.assertEqual([q.get(), q.get()], [3, 4])
+        q.close()
+        self.assertIsNone(q.get(timeout=1))
+        self.assertEqual(q.dropped, 3)
+
+    def test_threaded_stages_run_in_order_and_finish(self):
+        items = iter(range(20))
+        seen = []
+        stages = [
+            Stage('double', lambda x: x * 2, lossy=False),
+            Stage('odd_filter', lambda x: x if x % 4 else None, lossy=False),
+            Stage('collect', seen.append, lossy=False),
+        ]
+        pipeline = Pipeline(stages, source=lambda: next(items, None)).start()
+        pipeline.join(timeout=5)
+        self.assertEqual(seen, [x * 2 for x in range(20) if (x * 2) % 4])
+        stats = pipeline.stats()
+        self.assertEqual(stats['double']['processed'], 20)
+        self.assertEqual(stats['collect']['processed'], 10)
+
+    def test_failing_middle_stage_stops_the_pipeline(self):
+        for lossy in (True, False):
+            counter = itertools.count()
+
+            def explode(x):
+                if x >= 3:
+                    raise ValueError("bad frame")
+                time.sleep(0.01)
+                return x
+
+            stages = [
+                Stage('a', lambda x: x, maxsize=1, lossy=lossy),
+                Stage('b', explode, maxsize=1, lossy=lossy),
+                Stage('c', lambda x: x, maxsize=1, lossy=lossy),
+            ]
+            with mock.patch('threading.excepthook'):  # the failing thread's traceback
+                pipeline = Pipeline(stages, source=lambda: next(counter)).start()
+                with self.assertRaisesMessage(ValueError, "bad frame"):
+                    pipeline.join(timeout=10)
+            self.assertFalse(any(t.is_alive() for t in pipeline.threads), f"lossy={lossy}")
+
+    def test_run_sync_is_deterministic(self):
+        stages = [Stage('inc', lambda x: x + 1), Stage('neg', lambda x: -x)]
+        self.assertEqual(list(Pipeline(stages).run_sync([1, 2, 3])), [-2, -3, -4])
+
+    def test_frame_producer_stages_publish_packets(self):
+        from detection import detection_module
+        stub = self.use_stub_engine([[10, 10, 100, 200, 0.9, 0]])
+        ring = FrameRing()
+        producer = detection_module.FrameProducer(ring, motion_gate=MotionGate())
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        now = timezone.now()
+        with ring.subscribe(viewer=True) as viewer:
+            packets = list(producer.run_sync([(now, frame), (now, frame), (now, frame)]))
+            self.assertIsNotNone(viewer.get(timeout=0).jpeg)
+        self.assertEqual(len(packets), 3)
+        self.assertEqual(stub.calls, 1)  # static scene: later frames reuse the tracks
+        self.assertEqual(packets[2].track_list, packets[0].track_list)
+        self.assertEqual(producer.stats()['stages']['track']['processed'], 3)
+
+
+class DetectionWorkerTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(BASE_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        from detection import detection_module
+        saved = detection_module.DETECTION_ZONES
+        self.addCleanup(setattr, detection_module, 'DETECTION_ZONES', saved)
+
+    def test_status_without_worker(self):
+        self.assertEqual(worker.worker_status(), {'alive': False, 'state': 'not running'})
+
+    def test_heartbeat_reports_alive_until_stale(self):
+        w = worker.DetectionWorker()
+        w.state = 'running'
+        w.heartbeat()
+        status = worker.worker_status()
+        self.assertTrue(status['alive'])
+        self.assertEqual(status['pid'], os.getpid())
+        self.assertIn('stats', status)
+        stale = worker.worker_status(now=status['updated_at'] + worker.HEARTBEAT_STALE_SECONDS + 1)
+        self.assertFalse(stale['alive'])
+
+    def test_stop_flag_refuses_to_start(self):
+        call_command('stop_detection', stdout=io.StringIO())
+        self.assertFalse(worker.DetectionWorker().run())
+        with self.assertRaises(CommandError):
+            call_command('detection_worker', stdout=io.StringIO())
+
+    def test_zones_saved_by_web_are_reloaded(self):
+        from detection import detection_module
+        w = worker.DetectionWorker()
+        zones = {"squares": [{"coords": [1, 2, 3, 4]}], "origWidth": 10, "origHeight": 10}
+        worker.save_zones(zones)
+        w.reload_zones()
+        self.assertEqual(detection_module.DETECTION_ZONES, zones)
+        worker.save_zones(None)
+        w.reload_zones()
+        self.assertIsNone(detection_module.DETECTION_ZONES)
+
+
+class DetectionWorkerRunTests(StubEngineMixin, TransactionTestCase):
+    """DetectionWorker.run() itself, with detection threads writing through their own connections."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        settings_override = override_settings(BASE_DIR=self.tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        from detection import detection_module
+        self.dm = detection_module
+        for name in ('_frame_producer', '_session_registry', '_session_stage'):
+            patcher = mock.patch.object(detection_module, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('detection.worker.signal.signal')  # leave the test runner's handlers alone
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def worker(self, **kwargs):
+        return worker.DetectionWorker(frames_name=f"spf_test_worker_{os.getpid()}", **kwargs)
+
+    def test_failing_loop_is_restarted_with_backoff(self):
+        ring = FrameRing()
+        ring.close()
+        producer = SimpleNamespace(ring=ring, thread=None, pipeline=SimpleNamespace(error=None))
+        failures = iter([RuntimeError("camera unplugged")] * 3)
+
+        def detection_loop():
+            error = next(failures, None)
+            if error is not None:
+                raise error
+
+        w = self.worker(heartbeat_interval=0.01, restart_delay=1.0, max_restart_delay=3.0)
+        delays = []
+        with mock.patch.object(self.dm, 'detection_loop', detection_loop), \
+                mock.patch.object(self.dm, 'get_frame_producer', return_value=producer), \
+                mock.patch.object(w, '_sleep', side_effect=lambda seconds: delays.append(seconds) or False):
+            self.assertTrue(w.run())
+        self.assertEqual(delays, [1.0, 2.0, 3.0])
+        self.assertEqual(w.restarts, 3)
+        self.assertEqual(w.last_error, "RuntimeError: camera unplugged")
+        status = worker.worker_status()
+        self.assertEqual((status['state'], status['restarts']), ('stopped', 3))
+
+    def test_stop_during_backoff_ends_the_worker(self):
+        ring = FrameRing()
+        ring.close()
+        producer = SimpleNamespace(ring=ring, thread=None, pipeline=SimpleNamespace(error=None))
+        w = self.worker(heartbeat_interval=0.01)
+        with mock.patch.object(self.dm, 'detection_loop', side_effect=RuntimeError("model error")), \
+                mock.patch.object(self.dm, 'get_frame_producer', return_value=producer), \
+                mock.patch.object(w, '_sleep', return_value=True):
+            self.assertTrue(w.run())
+        self.assertEqual(w.restarts, 1)
+
+    def test_stop_flushes_pending_sessions(self):
+        for i in range(100):
+            cv2.imwrite(os.path.join(self.tmp.name, f"{i:03d}.png"), np.zeros((240, 320, 3), dtype=np.uint8))
+        self.use_stub_engine([[10, 10, 100, 200, 0.9, 0]])
+        w = self.worker(heartbeat_interval=0.05)
+        # the writer's only flush is the one stop() makes
+        with mock.patch.object(self.dm, 'FRAME_SOURCE', self.tmp.name), \
+                mock.patch('detection.sessions.SessionWriter', functools.partial(SessionWriter, flush_interval=3600)):
+            thread = threading.Thread(target=w.run)
+            thread.start()
+            deadline = time.monotonic() + 10
+            while not (self.dm._session_registry and self.dm._session_registry.open) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(self.dm._session_registry.open), 1)
+            self.assertEqual(PersonSession.objects.count(), 0)
+            w.request_stop()
+            thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(list(PersonSession.objects.values_list('track_id', flat=True)), ['1'])
+        self.assertEqual(worker.worker_status()['state'], 'stopped')
+
+
+class SharedFrameRingTests(TestCase):
+    def setUp(self):
+        self.name = f"spf_test_{os.getpid()}"
+        self.writer = SharedFrameRing.create(self.name, slots=3, slot_bytes=64)
+        self.addCleanup(self.writer.close)
+        self.reader = SharedFrameRing.attach(self.name)
+        self.addCleanup(self.reader.close)
+
+    def test_reader_sees_latest_frame_once(self):
+        self.assertIsNone(self.reader.read())
+        for i in range(5):
+            self.writer.publish(bytes([i]) * 10, timestamp=100.0 + i)
+        seq, timestamp, jpeg = self.reader.read()
+        self.assertEqual((seq, timestamp, jpeg), (5, 104.0, bytes([4]) * 10))
+        self.assertIsNone(self.reader.read(after=seq))
+
+    def test_oversized_frame_skipped(self):
+        self.assertIsNone(self.writer.publish(b"x" * 65))
+        self.assertEqual(self.writer.oversized, 1)
+        self.assertIsNone(self.reader.read())
+
+    def test_slot_being_rewritten_is_not_returned(self):
+        self.writer.publish(b"first")
+        self.writer._meta[1][0] = 1  # writer is midway through copying frame 1
+        self.assertIsNone(self.reader.read())
+
+    def test_create_refuses_a_block_owned_by_a_live_process(self):
+        name = f"{self.name}_owned"
+        first = SharedFrameRing.create(name, slots=3, slot_bytes=64)
+        self.addCleanup(first.close)
+        first._header[5] = os.getppid()  # as if another, still running, worker had created it
+        with self.assertRaises(FrameRingInUse):
+            SharedFrameRing.create(name, slots=3, slot_bytes=64)
+        first.publish(b"still mine")
+        with SharedFrameRing.attach(name) as reader:
+            self.assertEqual(reader.read()[2], b"still mine")
+
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        first._header[5] = dead.pid  # a killed worker's block is taken over
+        second = SharedFrameRing.create(name, slots=3, slot_bytes=64)
+        first.owner = False  # its block was replaced, so it mustn't unlink the new one
+        self.addCleanup(second.close)
+        self.assertEqual(second.seq, 0)
+
+    def test_readers_announce_themselves_and_see_close(self):
+        self.assertFalse(self.writer.has_readers())
+        self.reader.read()
+        self.assertTrue(self.writer.has_readers())
+        self.writer.close()
+        self.assertTrue(self.reader.closed)
+        self.assertIsNone(SharedFrameRing.attach(self.name))
+
+
+class MetricsTests(StubEngineMixin, TestCase):
+    def setUp(self):
+        self.pw = "LongPW123!"
+        self.staff = User.objects.create_user("staffer", password=self.pw, is_staff=True)
+        self.normal = User.objects.create_user("visitor", password=self.pw)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(BASE_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_histogram_percentiles_cover_recent_window(self):
+        hist = RollingHistogram(window=100)
+        for ms in range(1, 201):
+            hist.observe(ms / 1000.0)
+        summary = hist.summary()
+        self.assertEqual(summary['count'], 200)
+        self.assertAlmostEqual(summary['sum_ms'], 20100, places=3)
+        self.assertAlmostEqual(summary['p50_ms'], 150.5, places=3)  # only 101..200 are kept
+        self.assertAlmostEqual(summary['max_ms'], 200, places=3)
+        self.assertGreater(summary['p99_ms'], summary['p95_ms'])
+
+    def test_prometheus_text(self):
+        m = Metrics()
+        m.observe('inference', 0.02)
+        m.inc('frames', 3)
+        m.set('active_tracks', 2)
+        text = prometheus_text(m.snapshot())
+        self.assertIn('# TYPE detection_stage_seconds summary', text)
+        self.assertIn('detection_stage_seconds{stage="inference",quantile="0.99"} 0.020000', text)
+        self.assertIn('detection_stage_seconds_count{stage="inference"} 1', text)
+        self.assertIn('detection_frames_total 3', text)
+        self.assertIn('detection_active_tracks 2', text)
+
+    def test_producer_records_stage_timings(self):
+        from detection import detection_module
+        self.use_stub_engine([[10, 10, 100, 200, 0.9, 0]])
+        ring = FrameRing()
+        producer = detection_module.FrameProducer(ring, motion_gate=MotionGate())
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        with ring.subscribe(viewer=True):
+            list(producer.run_sync([(timezone.now(), frame)] * 3))
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['timings']['inference']['count'], 1)
+        self.assertEqual(snapshot['timings']['encode']['count'], 3)
+        self.assertIn('tracking', snapshot['timings'])
+        self.assertEqual(snapshot['counters'], {'frames': 3, 'skipped_frames': 2})
+        self.assertEqual(snapshot['gauges']['active_tracks'], 1)
+
+    def test_endpoints_read_worker_heartbeat_and_are_staff_only(self):
+        metrics.inc('frames', 7)
+        w = worker.DetectionWorker()
+        w.state = 'running'
+        w.heartbeat()
+        metrics.reset()  # the web process has no metrics of its own
+        self.client.force_login(self.normal)
+        self.assertEqual(self.client.get(reverse("detection_metrics")).status_code, 302)
+        self.client.force_login(self.staff)
+        data = self.client.get(reverse("detection_metrics")).json()
+        self.assertEqual(data['counters'], {'frames': 7})
+        self.assertEqual(data['gauges']['worker_up'], 1)
+        r = self.client.get(reverse("detection_metrics_prometheus"))
+        self.assertTrue(r['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'detection_frames_total 7', r.content)
+
+
+class ReplayTests(StubEngineMixin, TestCase):
+    def setUp(self):
+        self.addCleanup(metrics.reset)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        writer = ClipWriter(os.path.join(tmp.name, "clip"))
+        start = timezone.now().timestamp()
+        for i in range(20):
+            frame = np.zeros((240, 320, 3), dtype=np.uint8)
+            if i < 10:
+                cv2.rectangle(frame, (10 + i * 5, 10), (100 + i * 5, 200), (255, 255, 255), -1)
+            writer.add(frame, start + i / 10.0)
+        self.clip = ClipSource(writer.close())
+
+    def _replay(self, **kwargs):
+        self.use_stub_engine([[10, 10, 100, 200, 0.9, 0]])  # fresh tracker state for every run
+        PersonSession.objects.all().delete()
+        return replay(self.clip, **kwargs)
+
+    def test_replay_is_deterministic_and_reports_stages(self):
+        first = self._replay()
+        second = self._replay()
+        self.assertEqual(first['tracks_digest'], second['tracks_digest'])
+        self.assertEqual(first['clip']['frames'], 20)
+        self.assertEqual(first['skipped_frames'], 9)  # the second half of the clip is static
+        self.assertEqual(first['sessions'], 1)
+        self.assertEqual(first['timings']['inference']['count'], 11)
+        self.assertNotIn('encode', first['timings'])
+        self.assertNotIn('end_to_end', first['timings'])
+        self.assertLess(first['db_queries_per_frame'], 1)
+        self.assertGreater(first['db_queries_per_flush'], 0)
+
+    def test_replay_with_viewer_encodes_every_frame(self):
+        results = self._replay(motion_gating=False, annotate=True)
+        self.assertEqual(results['skipped_frames'], 0)
+        self.assertEqual(results['timings']['encode']['count'], 20)
+
+
+class TrackIdentityManagerTests(TestCase):
+    def test_ids_stable_while_seen_and_recycled_after_horizon(self):
+        ids = TrackIdentityManager(horizon_seconds=10)
+        self.assertEqual([ids.get("7", 0), ids.get("9", 0)], ["1", "2"])
+        self.assertEqual(ids.get("7", 8), "1")
+        self.assertEqual(ids.evict(15), 1)  # "9" last seen at 0
+        self.assertEqual(ids.get("7", 15), "1")
+        self.assertEqual(ids.get("12", 15), "2")  # smallest released number is reused
+        self.assertEqual(len(ids), 2)
+
+    def test_unconfirmed_detections_get_fresh_ids_that_expire(self):
+        ids = TrackIdentityManager(horizon_seconds=1)
+        self.assertEqual([ids.get(None, 0), ids.get(None, 0)], ["1", "2"])
+        ids.evict(5)
+        self.assertEqual(len(ids), 0)
+        self.assertEqual(ids.get(None, 5), "1")
+
+    def test_soak_keeps_state_bounded(self):
+        from detection.management.commands.soak_track_ids import synthetic_frames
+        ids = TrackIdentityManager(horizon_seconds=60)
+        held = []
+        for index, (now, raw_ids) in enumerate(synthetic_frames(60000, people=10, fps=5.0)):
+            ids.evict(now)
+            for raw_id in raw_ids:
+                ids.get(raw_id, now)
+            if index % 10000 == 9999:
+                held.append(len(ids))
+        stats = ids.stats()
+        self.assertLess(max(held), 1000)  # ~1 minute of people and unconfirmed detections
+        self.assertLess(stats['track_id_max'], 1000)
+        self.assertGreater(stats['track_ids_evicted'], 50000)
+
+    def test_soak_command(self):
+        out = io.StringIO()
+        call_command('soak_track_ids', '--frames', '20000', '--report-every', '5000', stdout=out)
+        self.assertIn("20000 frames", out.getvalue())
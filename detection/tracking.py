@@ -0,0 +1,180 @@
+import functools
+import numpy as np
+from .metrics import metrics
+
+PERSON_CLASS = 0
+
+
+@functools.lru_cache(maxsize=None)
+def _linear_sum_assignment():
+    # scipy is imported on first use so importing this module stays cheap
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        return None
+    return linear_sum_assignment
+
+
+def has_scipy():
+    return _linear_sum_assignment() is not None
+
+
+def compute_iou(boxA, boxB):
+    xA = max(boxA[0], boxB[0])
+    yA = max(boxA[1], boxB[1])
+    xB = min(boxA[2], boxB[2])
+    yB = min(boxA[3], boxB[3])
+    interW = max(0, xB - xA)
+    interH = max(0, yB - yA)
+    interArea = interW * interH
+    areaA = (boxA[2]-boxA[0]) * (boxA[3]-boxA[1])
+    areaB = (boxB[2]-boxB[0]) * (boxB[3]-boxB[1])
+    return interArea / float(areaA + areaB - interArea + 1e-6)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU of two (N, 4) and (M, 4) xyxy box arrays, returned as an (N, M) matrix."""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-6)
+
+
+def assign(scores, threshold, optimal=True):
+    """
+    One-to-one matching on a score matrix: returns {row: col} for pairs scoring above threshold.
+    Uses the Hungarian method when scipy is installed (optimal=True), otherwise greedily takes
+    pairs from the highest score down. Either way no column is claimed by two rows.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    if scores.size == 0:
+        return {}
+    if optimal and has_scipy():
+        rows, cols = _linear_sum_assignment()(np.where(scores > threshold, scores, 0), maximize=True)
+        return {int(r): int(c) for r, c in zip(rows, cols) if scores[r, c] > threshold}
+    pairs = np.argwhere(scores > threshold)
+    order = np.argsort(-scores[pairs[:, 0], pairs[:, 1]], kind='stable')
+    matches, used = {}, set()
+    for r, c in pairs[order]:
+        if r in matches or c in used:
+            continue
+        matches[int(r)] = int(c)
+        used.add(c)
+    return matches
+
+
+def in_zones(xyxy, zones):
+    """Boolean mask of boxes whose centre lies inside at least one (x1, y1, x2, y2) zone."""
+    xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+    cx = (xyxy[:, 0] + xyxy[:, 2]) / 2
+    cy = (xyxy[:, 1] + xyxy[:, 3]) / 2
+    mask = np.zeros(len(xyxy), dtype=bool)
+    for zx1, zy1, zx2, zy2 in zones:
+        mask |= (cx >= zx1) & (cx <= zx2) & (cy >= zy1) & (cy <= zy2)
+    return mask
+
+
+def _build_tracker(tracker_config):
+    # ultralytics is imported lazily so importing this module stays cheap
+    from ultralytics.trackers.track import TRACKER_MAP
+    from ultralytics.utils import IterableSimpleNamespace
+    from ultralytics.utils.checks import check_yaml
+    try:
+        from ultralytics.utils import YAML
+        _load_yaml = YAML.load
+    except ImportError:  # older ultralytics releases
+        from ultralytics.utils import yaml_load as _load_yaml
+    cfg = IterableSimpleNamespace(**_load_yaml(check_yaml(tracker_config)))
+    tracker_cls = TRACKER_MAP[cfg.tracker_type]
+    try:
+        return tracker_cls(args=cfg, frame_rate=30)
+    except TypeError:
+        return tracker_cls(args=cfg)
+
+
+class TrackingEngine:
+    """
+    Runs the detector once per frame and feeds its boxes straight into the tracker,
+    so boxes, confidences and track IDs all come from a single inference pass.
+    """
+
+    def __init__(self, model, tracker_config, conf, iou=0.5, imgsz=640, half=False, dynamic_imgsz=True):
+        self.model = model
+        self.tracker_config = tracker_config
+        self.conf = conf
+        self.iou = iou
+        self.imgsz = imgsz
+        self.half = half
+        # exported (onnx/openvino) models have a fixed input size; torch can shrink it for crops
+        self.dynamic_imgsz = dynamic_imgsz
+        self.tracker = _build_tracker(tracker_config)
+
+    def reset(self):
+        self.tracker = _build_tracker(self.tracker_config)
+
+    def step(self, frame, iou_thresh=0.3, region=None, zones=None):
+        """
+        Returns a list of {'bbox', 'confidence', 'raw_id'} dicts, one per person detection.
+        raw_id is None for detections the tracker has not confirmed yet.
+
+        region: (x1, y1, x2, y2) crop to run inference on instead of the whole frame.
+        zones: rectangles a detection's centre must fall inside to be kept; others never reach the tracker.
+        Boxes are always returned in full-frame coordinates.
+        """
+        return self.track(frame, self.detect(frame, region=region, zones=zones), iou_thresh)
+
+    def detect(self, frame, region=None, zones=None):
+        """Inference half of step(): an (N, 6) [x1, y1, x2, y2, conf, cls] array in full-frame coordinates."""
+        image = frame
+        imgsz = self.imgsz
+        x0 = y0 = 0
+        if region is not None:
+            x0, y0, x1, y1 = region
+            image = frame[y0:y1, x0:x1]
+            if self.dynamic_imgsz:
+                # keep the full-frame pixel scale, so the input shrinks with the crop
+                scale = self.imgsz / float(max(frame.shape[:2]))
+                imgsz = min(self.imgsz, max(32, int(np.ceil(max(image.shape[:2]) * scale / 32.0)) * 32))
+        kwargs = {'half': True} if self.half else {}
+        results = self.model(
+            image, conf=self.conf, iou=self.iou, imgsz=imgsz,
+            classes=[PERSON_CLASS], verbose=False, **kwargs
+        )
+        data = results[0].boxes.cpu().numpy().data[:, :6].astype(np.float32)
+        if x0 or y0:
+            data[:, [0, 2]] += x0
+            data[:, [1, 3]] += y0
+        if zones is not None:
+            data = data[in_zones(data[:, :4], zones)]
+        return data
+
+    def track(self, frame, data, iou_thresh=0.3):
+        """Tracking half of step(): feeds detect()'s boxes to the tracker. Must be called in frame order."""
+        from ultralytics.engine.results import Boxes
+        boxes = Boxes(data, frame.shape[:2])
+        detections = []
+        for xyxy, conf in zip(boxes.xyxy, boxes.conf):
+            detections.append({'bbox': list(map(int, xyxy)), 'confidence': float(conf), 'raw_id': None})
+        with metrics.timer('tracking'):
+            tracks = self.tracker.update(boxes, frame)
+        if len(tracks) == 0:
+            return detections
+        with metrics.timer('association'):
+            self._attach_ids(detections, tracks, iou_thresh)
+        return detections
+
+    @staticmethod
+    def _attach_ids(detections, tracks, iou_thresh):
+        if tracks.shape[1] >= 8:
+            # [x1, y1, x2, y2, track_id, score, cls, idx] - idx points back at the detection row
+            for row in tracks:
+                detections[int(row[7])]['raw_id'] = str(int(row[4]))
+        else:
+            # Older trackers don't report the detection index, so fall back to box overlap.
+            matches = assign(iou_matrix([d['bbox'] for d in detections], tracks[:, :4]), iou_thresh)
+            for d, t in matches.items():
+                detections[d]['raw_id'] = str(int(tracks[t, 4]))
@@ -6,4 +6,6 @@ urlpatterns = [
     path('video_view/', views.video_view, name='video_view'),
     path('update_zones_multiple/', views.update_detection_zones_multiple, name='update_detection_zones_multiple'),
     path('reset_zone/', views.reset_detection_zone, name='reset_detection_zone'),
+    path('metrics/', views.detection_metrics, name='detection_metrics'),
+    path('metrics/prometheus/', views.detection_metrics_prometheus, name='detection_metrics_prometheus'),
 ]
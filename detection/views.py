@@ -1,8 +1,11 @@
 from django.shortcuts import render
-from django.http import StreamingHttpResponse, JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from .detection_module import capture_screen, perform_detection_on_frame, generate_video_stream
 from . import detection_module
+from .worker import save_zones, worker_status
+from .metrics import metrics, prometheus_text
 from django.contrib.admin.views.decorators import staff_member_required
 
 from .models import PersonSession
@@ -39,6 +42,7 @@ def update_detection_zones_multiple(request):
                 "origWidth": origWidth,
                 "origHeight": origHeight,
             }
+            save_zones(detection_module.DETECTION_ZONES)
             return JsonResponse({"status": "success", "zones": zones})
         except Exception as e:
             return JsonResponse({"status": "error", "error": str(e)})
@@ -50,6 +54,24 @@ def update_detection_zones_multiple(request):
 def reset_detection_zone(request):
     if request.method == "POST":
         detection_module.DETECTION_ZONES = None
+        save_zones(None)
         return JsonResponse({"status": "success", "zone": None})
     else:
         return JsonResponse({"status": "error", "error": "POST request required"})
+
+def current_metrics():
+    """Timings and counters from the detection worker's last heartbeat, or this process when detection runs in it."""
+    if getattr(settings, 'DETECTION_IN_PROCESS', False):
+        return metrics.snapshot()
+    status = worker_status()
+    snapshot = status.get('metrics') or {'timings': {}, 'counters': {}, 'gauges': {}}
+    snapshot['gauges']['worker_up'] = int(status['alive'])
+    return snapshot
+
+@staff_member_required(login_url='login')
+def detection_metrics(request):
+    return JsonResponse(current_metrics())
+
+@staff_member_required(login_url='login')
+def detection_metrics_prometheus(request):
+    return HttpResponse(prometheus_text(current_metrics()), content_type='text/plain; version=0.0.4')
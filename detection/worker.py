@@ -0,0 +1,225 @@
+import json
+import os
+import signal
+import threading
+import time
+from django.conf import settings
+from django.utils import timezone
+from . import detection_module
+from .shared_ring import SHM_NAME, SharedFrameRing
+from .metrics import metrics
+
+STOP_FLAG_NAME = 'detection_stop.flag'          # created to stop the worker, removed by clear_detection_stop
+HEARTBEAT_NAME = 'detection_heartbeat.json'
+ZONES_NAME = 'detection_zones.json'
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_STALE_SECONDS = 10.0                   # older than this and the worker counts as down
+
+
+def runtime_path(name):
+    return os.path.join(settings.BASE_DIR, name)
+
+
+def write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_zones(zones):
+    """Called by the web process; the worker picks the file up on its next heartbeat."""
+    path = runtime_path(ZONES_NAME)
+    if zones is None:
+        if os.path.exists(path):
+            os.remove(path)
+    else:
+        write_atomic(path, json.dumps(zones).encode())
+
+
+def worker_status(now=None):
+    """The worker's last heartbeat plus whether it is recent enough to count as alive."""
+    heartbeat = read_json(runtime_path(HEARTBEAT_NAME))
+    if heartbeat is None:
+        return {'alive': False, 'state': 'not running'}
+    age = (now or time.time()) - heartbeat.get('updated_at', 0)
+    heartbeat['age_seconds'] = round(age, 1)
+    heartbeat['alive'] = age < HEARTBEAT_STALE_SECONDS and heartbeat.get('state') in ('running', 'restarting')
+    return heartbeat
+
+
+def snapshot_stream(poll_interval=None):
+    """
+    MJPEG parts for the frames the worker publishes to shared memory; never touches capture
+    or the model, so each viewer costs one memcpy per frame plus the socket write.
+    """
+    poll_interval = poll_interval or 1.0 / detection_module.MAX_FPS
+    frames, last_seq, last_new = None, 0, 0.0
+    try:
+        while True:
+            if frames is None:
+                frames = SharedFrameRing.attach()
+                last_seq, last_new = 0, time.monotonic()
+            if frames is not None:
+                latest = frames.read(after=last_seq)
+                if latest is not None:
+                    last_seq, _, jpeg = latest
+                    last_new = time.monotonic()
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n\r\n')
+                elif frames.closed or time.monotonic() - last_new > HEARTBEAT_STALE_SECONDS:
+                    # the worker stopped, or was restarted with a fresh block
+                    frames.close()
+                    frames = None
+            time.sleep(poll_interval if frames is not None else 1.0)
+    finally:
+        if frames is not None:
+            frames.close()
+
+
+class DetectionWorker:
+    """
+    Runs detection_loop in a dedicated process and supervises it.
+
+    Every heartbeat_interval seconds it writes its state and detection stats to the heartbeat
+    file, applies zone changes saved by the web app, and checks for the stop flag. SIGTERM,
+    SIGINT or the stop flag end the stream at the source, so the frames already captured
+    drain through the pipeline and pending session writes are flushed before exiting.
+    If the pipeline fails (camera unplugged, model error) it is restarted with exponential
+    backoff; a file source that simply ends stops the worker.
+    """
+
+    def __init__(self, heartbeat_interval=HEARTBEAT_INTERVAL, restart_delay=2.0, max_restart_delay=60.0,
+                 frames_name=SHM_NAME):
+        self.heartbeat_interval = heartbeat_interval
+        self.frames_name = frames_name
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stop_flag = runtime_path(STOP_FLAG_NAME)
+        self.heartbeat_path = runtime_path(HEARTBEAT_NAME)
+        self.zones_path = runtime_path(ZONES_NAME)
+        self.state = 'starting'
+        self.restarts = 0
+        self.last_error = None
+        self.started_at = timezone.now()
+        self._stop = False     # set from the signal handler, so no locks (it interrupts the main thread)
+        self._zones_mtime = None
+        self._loop_error = None
+        self.frames = None
+        self._relay = None
+
+    def request_stop(self, *args):
+        self._stop = True
+
+    def stop_requested(self):
+        return self._stop or os.path.exists(self.stop_flag)
+
+    def _sleep(self, seconds):
+        """Sleeps in short slices so a stop request cuts the restart backoff short."""
+        deadline = time.monotonic() + seconds
+        while not self.stop_requested():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, 0.2))
+        return True
+
+    def heartbeat(self):
+        write_atomic(self.heartbeat_path, json.dumps({
+            'pid': os.getpid(),
+            'state': self.state,
+            'started_at': self.started_at.isoformat(),
+            'updated_at': time.time(),
+            'restarts': self.restarts,
+            'last_error': self.last_error,
+            'stats': detection_module.get_detection_stats(),
+            'shared_frames': self.frames.stats() if self.frames is not None else None,
+            'metrics': metrics.snapshot(),
+        }).encode())
+
+    def reload_zones(self):
+        try:
+            mtime = os.stat(self.zones_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._zones_mtime:
+            self._zones_mtime = mtime
+            detection_module.DETECTION_ZONES = read_json(self.zones_path) if mtime else None
+
+    def _publish_frames(self, ring):
+        """Copies encoded frames into shared memory, asking for them only while a web viewer reads."""
+        with ring.subscribe(latest_only=True) as subscription:
+            while True:
+                subscription.set_viewer(self.frames.has_readers())
+                packet = subscription.get(timeout=1.0)
+                if packet is None:
+                    if ring.closed:
+                        return
+                    continue
+                if packet.jpeg is not None:
+                    self.frames.publish(packet.jpeg)
+
+    def run(self):
+        """Returns False without starting if the stop flag is already set."""
+        if os.path.exists(self.stop_flag):
+            return False
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.request_stop)
+            signal.signal(signal.SIGINT, self.request_stop)
+        delay = self.restart_delay
+        self.frames = SharedFrameRing.create(self.frames_name)
+        try:
+            while True:
+                producer = self._run_once()
+                error = self._loop_error or producer.pipeline.error
+                if producer.thread is not None:
+                    producer.thread.join(self.heartbeat_interval * 5)
+                if self.stop_requested() or error is None:
+                    break
+                self.restarts += 1
+                self.last_error = f"{type(error).__name__}: {error}"
+                self.state = 'restarting'
+                self.heartbeat()
+                if self._sleep(delay):
+                    break
+                delay = min(delay * 2, self.max_restart_delay)
+        finally:
+            self.state = 'stopped'
+            self.heartbeat()
+            if self._relay is not None:
+                self._relay.join(2.0)
+            self.frames.close()
+        return True
+
+    def _detection_loop(self):
+        try:
+            detection_module.detection_loop()
+        except Exception as e:
+            self._loop_error = e
+
+    def _run_once(self):
+        self.reload_zones()
+        self._loop_error = None
+        producer = detection_module.get_frame_producer()
+        self._relay = threading.Thread(target=self._publish_frames, args=(producer.ring,), daemon=True)
+        self._relay.start()
+        loop = threading.Thread(target=self._detection_loop, name='detection-loop')
+        loop.start()
+        self.state = 'running'
+        while loop.is_alive():
+            self.heartbeat()
+            self.reload_zones()
+            if self.stop_requested() and self.state != 'stopping':
+                self.state = 'stopping'
+                self.heartbeat()
+                detection_module.stop_detection()
+            loop.join(self.heartbeat_interval)
+        return producer
@@ -97,6 +97,27 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/ref/settings/#caches
+# 'dashboard' holds computed dashboard analytics (see dashboard.caching). Local memory is
+# per process; to share results between several web processes point it at a file or Redis
+# backend instead, e.g.
+#   'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': BASE_DIR / 'cache'
+#   'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'dashboard': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dashboard',
+        'TIMEOUT': 600,  # for windows still open to new sessions; settled ones never expire
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -139,3 +160,9 @@ STATICFILES_DIRS = [ BASE_DIR / "static" ]
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Detection runs in its own supervised process: python manage.py detection_worker
+# The web process only reads its outputs. Set to True to run detection as a thread
+# inside the development server instead.
+DETECTION_IN_PROCESS = False